@@ -12,19 +12,41 @@ Licencia: MIT License
 """
 
 # --- Librerias ---
-import cv2
+import time
+_STARTED = time.perf_counter()
 import sys
-import numpy as np
 import webbrowser
 import os
 import threading
-import requests
-from io import BytesIO
-import time
 import random
+import argparse
+import atexit
+import glob
+import importlib
+import queue
+import json
+import shutil
+import mmap
+import tempfile
+import signal
+import logging
+from logging.handlers import RotatingFileHandler
+from contextlib import contextmanager
+import statistics
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import hashlib
+import gc
+import struct
+import zlib
+from io import BytesIO
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from multiprocessing import get_all_start_methods, get_context, resource_tracker, shared_memory
 from pathlib import Path
-import certifi
-from plyer import notification
 
 # --- UI ---
 import tkinter as tk
@@ -32,11 +54,78 @@ from tkinter import ttk
 from tkinter import filedialog, messagebox
 from tkinter.ttk import Button, Label, Progressbar, Style
 
+try:
+    from tkinterdnd2 import DND_FILES, TkinterDnD
+except ImportError:
+    DND_FILES = TkinterDnD = None
+
 # --- Imagen ---
-from PIL import Image, ImageTk, ImageOps, ImageDraw
+from PIL import Image, ImageTk, ImageOps, ImageColor, UnidentifiedImageError
+
+# --- Importación diferida ---
+# rembg arrastra onnxruntime, scipy, pymatting y numba: varios segundos en
+# frío. Estos módulos se importan la primera vez que se usan, así la ventana
+# aparece al instante y el motor se carga en segundo plano.
+# pymatting compila con numba; si su capa TBB arranca fuera del hilo
+# principal el proceso se cuelga al salir, así que se prefiere OpenMP
+os.environ.setdefault("NUMBA_THREADING_LAYER_PRIORITY", "omp tbb workqueue")
+PROFILE_IMPORTS = bool(os.getenv("EFI_PROFILE_IMPORTS"))
+IMPORT_TIMES = {}
+STARTUP_MARKS = {}
+
+class LazyModule:
+    """Módulo que se importa al acceder por primera vez a uno de sus atributos."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            IMPORT_TIMES.setdefault(self._name, time.perf_counter() - start)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+requests = LazyModule("requests")
+certifi = LazyModule("certifi")
+plyer = LazyModule("plyer")
 
 # --- IA / Remoción de fondo ---
-from rembg import remove, new_session
+ort = LazyModule("onnxruntime")
+rembg_bg = LazyModule("rembg.bg")
+rembg_sessions = LazyModule("rembg.sessions")
+u2net_custom = LazyModule("rembg.sessions.u2net_custom")
+pymatting_cf = LazyModule("pymatting.alpha.estimate_alpha_cf")
+ndimage = LazyModule("scipy.ndimage")
+
+HEAVY_MODULES = (np, cv2, ort, rembg_bg, rembg_sessions, u2net_custom, pymatting_cf, ndimage)
+
+def load_heavy_modules():
+    """Importa por adelantado todo lo necesario para procesar una imagen."""
+    for module in HEAVY_MODULES:
+        module._load()
+
+def mark_startup(label):
+    STARTUP_MARKS.setdefault(label, time.perf_counter() - _STARTED)
+
+def format_import_profile():
+    lines = ["Arranque (s desde el inicio del proceso):"]
+    for label, seconds in sorted(STARTUP_MARKS.items(), key=lambda item: item[1]):
+        lines.append(f"  {label:<32} {seconds:>7.3f}")
+    lines.append("Importaciones diferidas (s, incluye sus dependencias):")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+        lines.append(f"  {name:<32} {seconds:>7.3f}")
+    return "\n".join(lines)
+
+if PROFILE_IMPORTS:
+    atexit.register(lambda: print(format_import_profile(), file=sys.stderr))
 
 def resource_path(relative_path: str) -> str:
     """
@@ -46,22 +135,4139 @@ def resource_path(relative_path: str) -> str:
     base_path = getattr(sys, '_MEIPASS', os.path.abspath("."))
     return os.path.join(base_path, relative_path)
 
-MODEL_URLS = {
-    "objetos": "https://github.com/jesuspinedaof/efi/releases/download/v1.0/u2net.onnx"
+# --- Registro de modelos ---
+# latencia_s: segundos por imagen en una CPU de 4 núcleos, como referencia
+# hasta que se mide el equipo. calidad: 1 rápida, 2 alta.
+# sha256: la suma que se comprueba al descargar; se obtiene de los archivos
+# publicados con `python efi.py model-digests`. Mientras falte se usa el md5
+# que publica rembg, que detecta descargas dañadas pero no manipuladas; solo
+# vale para su misma URL, así que u2net (publicado en este repositorio) no
+# lleva ninguno y su descarga no se comprueba.
+MODEL_REGISTRY = {
+    "u2net": {
+        "url": "https://github.com/jesuspinedaof/efi/releases/download/v1.0/u2net.onnx",
+        "sha256": None,
+        "md5": None,
+        "entrada": (320, 320),
+        "latencia_s": 0.35,
+        "memoria_mb": 350,
+        "calidad": 2,
+        "descripcion": "U²-Net completo (176 MB), objetos en general",
+    },
+    "u2netp": {
+        "url": "https://github.com/danielgatis/rembg/releases/download/v0.0.0/u2netp.onnx",
+        "sha256": None,
+        "md5": "8e83ca70e441ab06c318d82300c84806",
+        "entrada": (320, 320),
+        "latencia_s": 0.06,
+        "memoria_mb": 25,
+        "calidad": 1,
+        "descripcion": "U²-Net reducido (4,7 MB), rápido y ligero",
+    },
+    "u2net_human_seg": {
+        "url": "https://github.com/danielgatis/rembg/releases/download/v0.0.0/u2net_human_seg.onnx",
+        "sha256": None,
+        "md5": "c09ddc2e0104f800e3e1bb4652583d1f",
+        "entrada": (320, 320),
+        "latencia_s": 0.35,
+        "memoria_mb": 350,
+        "calidad": 2,
+        "descripcion": "U²-Net entrenado para personas",
+    },
+}
+def get_cache_dir():
+    if sys.platform.startswith('win'):
+        base = os.getenv('LOCALAPPDATA') or os.path.expanduser(r"~\AppData\Local")
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
+    return os.path.join(base, "BackgroundRemover", "model_cache")
+
+CACHE_DIR = get_cache_dir()
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+os.environ.setdefault("U2NET_HOME", CACHE_DIR)
+
+# --- Registro de rendimiento ---
+PERF_LOG_PATH = os.path.join(CACHE_DIR, "rendimiento.log")
+PERF_LOG_ENABLED = os.getenv("EFI_PERF_LOG", "1") != "0"
+# Volcado de métricas al salir: .json o .prom (texto de Prometheus)
+METRICS_DUMP_PATH = os.getenv("EFI_METRICS_DUMP")
+# cprofile, tracemalloc o ambos: se captura el primer trabajo del proceso
+PROFILE_JOB = os.getenv("EFI_PROFILE_JOB", "").lower()
+PROFILE_DIR = os.path.join(CACHE_DIR, "perfiles")
+
+class PerfMetrics:
+    """
+    Tramos de tiempo y contadores del proceso. Cada tramo se escribe como
+    una línea JSON en `rendimiento.log` (rotativo, dentro de la caché) y se
+    acumula para volcarlo en JSON o en texto de Prometheus.
+    """
+
+    def __init__(self, log_path=PERF_LOG_PATH, enabled=PERF_LOG_ENABLED,
+                 max_bytes=1024 * 1024, backups=3):
+        self.counters = {}
+        self.spans = {}
+        self._lock = threading.Lock()
+        self._logger = None
+        if enabled:
+            self._logger = logging.getLogger("efi.rendimiento")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            if not self._logger.handlers:
+                # delay: el archivo no se abre hasta el primer registro
+                self._logger.addHandler(
+                    RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backups,
+                                        encoding="utf-8", delay=True)
+                )
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    @contextmanager
+    def span(self, name, **fields):
+        """Mide el bloque; el diccionario devuelto admite campos extra para el registro."""
+        start = time.perf_counter()
+        try:
+            yield fields
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self.spans.setdefault(name, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+            self.log(tramo=name, ms=round(elapsed * 1000, 2), **fields)
+
+    def log(self, **record):
+        if self._logger is None:
+            return
+        record = {
+            "t": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "pid": os.getpid(),
+            "hilo": threading.current_thread().name,
+            **record,
+        }
+        self._logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "contadores": dict(self.counters),
+                "tramos": {
+                    name: {"n": n, "total_s": round(total, 4), "max_s": round(peak, 4),
+                           "media_s": round(total / n, 4)}
+                    for name, (n, total, peak) in self.spans.items()
+                },
+            }
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["contadores"].items()):
+            lines.append(f"efi_{name}_total {value}")
+        for name, stats in sorted(snapshot["tramos"].items()):
+            lines.append(f'efi_tramo_segundos_count{{tramo="{name}"}} {stats["n"]}')
+            lines.append(f'efi_tramo_segundos_sum{{tramo="{name}"}} {stats["total_s"]}')
+            lines.append(f'efi_tramo_segundos_max{{tramo="{name}"}} {stats["max_s"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2, ensure_ascii=False)
+
+METRICS = PerfMetrics()
+if METRICS_DUMP_PATH:
+    atexit.register(lambda: METRICS.dump(METRICS_DUMP_PATH))
+
+_profile_lock = threading.Lock()
+_profile_done = []
+
+@contextmanager
+def profile_job(label):
+    """
+    Con EFI_PROFILE_JOB envuelve el primer trabajo del proceso en cProfile
+    y/o tracemalloc y deja el informe en `perfiles/` dentro de la caché.
+    """
+    with _profile_lock:
+        capture = PROFILE_JOB in ("cprofile", "tracemalloc", "ambos") and not _profile_done
+        if capture:
+            _profile_done.append(label)
+    if not capture:
+        yield
+        return
+
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    # Las importaciones diferidas se hacen antes para que no tapen el trabajo
+    load_heavy_modules()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{label}")
+    profiler = cProfile.Profile() if PROFILE_JOB in ("cprofile", "ambos") else None
+    trace = PROFILE_JOB in ("tracemalloc", "ambos")
+    if trace:
+        tracemalloc.start(25)
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(f"{base}.prof")
+            with open(f"{base}_cprofile.txt", "w", encoding="utf-8") as f:
+                pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(40)
+        if trace:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(f"{base}_tracemalloc.txt", "w", encoding="utf-8") as f:
+                f.write(f"Actual: {current / 1048576:.1f} MB  Pico: {peak / 1048576:.1f} MB\n\n")
+                for stat in snapshot.statistics("lineno")[:30]:
+                    f.write(f"{stat}\n")
+        METRICS.log(perfil=base, trabajo=label)
+
+# --- Descarga de modelos ---
+DOWNLOAD_CHUNK = 1024 * 1024
+# Por debajo de este tamaño no compensa partir la descarga
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+
+class _ThrottledProgress:
+    """Llama a `callback(descargado, total)` como mucho cada `interval` segundos."""
+
+    def __init__(self, callback, total, initial=0, interval=0.1):
+        self.callback = callback
+        self.total = total
+        self.done = initial
+        self.interval = interval
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, amount):
+        with self._lock:
+            self.done += amount
+            now = time.monotonic()
+            if self.callback is None or now - self._last < self.interval:
+                return
+            self._last = now
+            done = self.done
+        self.callback(done, self.total)
+
+    def finish(self):
+        if self.callback is not None:
+            self.callback(self.done, self.total)
+
+def file_digest(path, algorithm="sha256"):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def verify_checksum(path, expected):
+    algorithm, _, value = expected.partition(":")
+    return file_digest(path, algorithm) == value.lower()
+
+def _probe(http, url, timeout):
+    """Tamaño total y si el servidor acepta rangos (None, False si no se sabe)."""
+    try:
+        response = http.head(url, allow_redirects=True, timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None, False
+    size = response.headers.get("content-length")
+    ranges = response.headers.get("accept-ranges", "").lower() == "bytes"
+    return (int(size) if size else None), ranges
+
+def _download_stream(http, url, tmp_path, total, ranges, progress, timeout):
+    """Descarga en un solo flujo, continuando el temporal si el servidor lo permite."""
+    offset = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+    if total is not None and offset > total:
+        offset = 0
+    headers = {"Range": f"bytes={offset}-"} if offset and ranges else {}
+    response = http.get(url, stream=True, timeout=timeout, headers=headers)
+    response.raise_for_status()
+    if response.status_code != 206:
+        offset = 0
+
+    progress.add(offset)
+    with open(tmp_path, "ab" if offset else "wb") as f:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+            if chunk:
+                f.write(chunk)
+                progress.add(len(chunk))
+
+def _download_segments(http, url, tmp_path, total, segments, progress, timeout):
+    """
+    Descarga por rangos en paralelo. El avance de cada segmento se guarda en
+    `<temporal>.json`, así una descarga interrumpida retoma cada tramo.
+    """
+    state_path = f"{tmp_path}.json"
+    state = None
+    if os.path.exists(tmp_path) and os.path.exists(state_path):
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+    if not state or state.get("url") != url or state.get("size") != total:
+        step = -(-total // segments)
+        state = {
+            "url": url,
+            "size": total,
+            "segments": [[start, min(start + step, total), 0] for start in range(0, total, step)],
+        }
+        with open(tmp_path, "wb") as f:
+            f.truncate(total)
+
+    lock = threading.Lock()
+
+    def save_state():
+        with open(f"{state_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(f"{state_path}.tmp", state_path)
+
+    def fetch(segment):
+        start, end, done = segment
+        if start + done >= end:
+            return
+        headers = {"Range": f"bytes={start + done}-{end - 1}"}
+        response = http.get(url, stream=True, timeout=timeout, headers=headers)
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise ValueError("El servidor no respetó la descarga por rangos")
+        with open(tmp_path, "r+b") as f:
+            f.seek(start + done)
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                if not chunk:
+                    continue
+                chunk = chunk[:end - start - segment[2]]
+                f.write(chunk)
+                with lock:
+                    segment[2] += len(chunk)
+                progress.add(len(chunk))
+                if segment[2] >= end - start:
+                    break
+            f.flush()
+        with lock:
+            save_state()
+
+    save_state()
+    progress.add(sum(done for _, _, done in state["segments"]))
+    threads = []
+    errors = []
+
+    def run(segment):
+        try:
+            fetch(segment)
+        except Exception as e:
+            errors.append(e)
+
+    for segment in state["segments"]:
+        t = threading.Thread(target=run, args=(segment,), daemon=True)
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    with lock:
+        save_state()
+    if errors:
+        raise errors[0]
+    if any(done < end - start for start, end, done in state["segments"]):
+        raise ValueError("La descarga quedó incompleta")
+
+def download_file(url, dest, checksum=None, segments=4, progress=None, timeout=60, http=None):
+    """
+    Descarga `url` en `dest` de forma segura:
+
+    - se escribe en `<dest>.part` y solo se renombra a `dest` cuando el
+      tamaño y la suma de verificación coinciden, así nunca queda un
+      modelo a medias con el nombre final;
+    - si el servidor acepta rangos, la descarga se reparte en `segments`
+      tramos paralelos y un reintento continúa donde se quedó;
+    - `progress(descargado, total)` se llama como mucho cada 0,1 s.
+    """
+    http = http or requests.Session()
+    http.verify = certifi.where() if http.verify is True else http.verify
+    tmp_path = f"{dest}.part"
+    total, ranges = _probe(http, url, timeout)
+    tracker = _ThrottledProgress(progress, total)
+
+    if ranges and total and segments > 1 and total >= MIN_SEGMENT_SIZE:
+        _download_segments(http, url, tmp_path, total, segments, tracker, timeout)
+    else:
+        _download_stream(http, url, tmp_path, total, ranges, tracker, timeout)
+    tracker.finish()
+
+    if total is not None and os.path.getsize(tmp_path) != total:
+        raise ValueError("El archivo descargado está incompleto")
+    if checksum and not verify_checksum(tmp_path, checksum):
+        os.remove(tmp_path)
+        raise ValueError("La suma de verificación del archivo descargado no coincide")
+
+    os.replace(tmp_path, dest)
+    try:
+        os.remove(f"{tmp_path}.json")
+    except OSError:
+        pass
+    return dest
+
+def model_url(model_name):
+    return MODEL_REGISTRY.get(model_name, {}).get("url")
+
+MODEL_LOG = logging.getLogger("efi.modelos")
+
+def model_checksum(model_name):
+    """Suma ("algoritmo:hex") para comprobar la descarga: SHA-256 si está en el registro, si no MD5."""
+    entry = MODEL_REGISTRY.get(model_name, {})
+    if entry.get("sha256"):
+        return f"sha256:{entry['sha256']}"
+    if entry.get("md5"):
+        MODEL_LOG.warning("%s no tiene SHA-256 en el registro; se comprueba solo el MD5", model_name)
+        return f"md5:{entry['md5']}"
+    if model_name in MODEL_REGISTRY:
+        MODEL_LOG.warning("%s no tiene suma en el registro; la descarga no se comprueba", model_name)
+    return None
+
+def ensure_model(model_name, progress=None):
+    """
+    Descarga el modelo a la caché si falta. Si EFI no tiene URL para él se
+    deja que rembg lo descargue al crear la sesión.
+    """
+    filename = f"{model_name}.onnx"
+    model_path = os.path.join(os.environ["U2NET_HOME"], filename)
+    url = model_url(model_name)
+    if not os.path.exists(model_path) and url:
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+        with METRICS.span("descarga", modelo=model_name) as span:
+            download_file(url, model_path, model_checksum(model_name), progress=progress)
+            span["bytes"] = os.path.getsize(model_path)
+        METRICS.count("bytes_descargados", span["bytes"])
+    return model_path
+
+# --- Configuración de onnxruntime ---
+RUNTIME_CONFIG_PATH = os.path.join(CACHE_DIR, "runtime_config.json")
+# Orden de preferencia; solo se usan los que ofrezca el onnxruntime instalado
+PROVIDER_PREFERENCE = (
+    "CUDAExecutionProvider",
+    "DmlExecutionProvider",
+    "CoreMLExecutionProvider",
+    "CPUExecutionProvider",
+)
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+RUNTIME_DEFAULTS = {
+    "providers": None,
+    "intra_op_num_threads": 0,
+    "inter_op_num_threads": 0,
+    "execution_mode": "sequential",
+    "graph_optimization_level": "all",
+    "enable_cpu_mem_arena": True,
+    "enable_mem_pattern": True,
+    "optimized_model": False,
+    "shared_weights": False,
+}
+
+def available_providers(preferred=None):
+    """Proveedores disponibles ordenados por preferencia (CPU siempre al final)."""
+    installed = ort.get_available_providers()
+    order = list(preferred or PROVIDER_PREFERENCE)
+    providers = [p for p in order if p in installed]
+    if "CPUExecutionProvider" not in providers:
+        providers.append("CPUExecutionProvider")
+    return providers
+
+def load_runtime_config(path=RUNTIME_CONFIG_PATH):
+    """Configuración guardada por `calibrate_runtime`, o la predeterminada."""
+    config = dict(RUNTIME_DEFAULTS)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f).get("config", {}))
+    except (OSError, ValueError):
+        pass
+    if os.getenv("EFI_PROVIDERS"):
+        config["providers"] = os.environ["EFI_PROVIDERS"].split(",")
+    return config
+
+def build_session_options(config):
+    sess_opts = ort.SessionOptions()
+    sess_opts.intra_op_num_threads = config["intra_op_num_threads"]
+    sess_opts.inter_op_num_threads = config["inter_op_num_threads"]
+    # Igual que rembg: OMP_NUM_THREADS fija los hilos entre operadores
+    if not config["inter_op_num_threads"] and "OMP_NUM_THREADS" in os.environ:
+        sess_opts.inter_op_num_threads = int(os.environ["OMP_NUM_THREADS"])
+    sess_opts.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL if config["execution_mode"] == "parallel"
+        else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    sess_opts.graph_optimization_level = getattr(
+        ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[config["graph_optimization_level"]]
+    )
+    sess_opts.enable_cpu_mem_arena = config["enable_cpu_mem_arena"]
+    sess_opts.enable_mem_pattern = config["enable_mem_pattern"]
+    return sess_opts
+
+def optimized_model_path(model_name, config):
+    # El modelo optimizado depende del proveedor y del nivel: uno por combinación
+    provider = (config["providers"] or available_providers())[0].replace("ExecutionProvider", "").lower()
+    level = config["graph_optimization_level"]
+    return os.path.join(os.environ["U2NET_HOME"], f"{model_name}.{provider}.{level}.opt.onnx")
+
+# Los pesos externos se alinean a 64 KB (granularidad de mapeo de Windows y
+# múltiplo de la página en Linux/macOS): solo así onnxruntime los mapea en
+# lugar de copiarlos a su memoria
+SHARED_WEIGHTS_ALIGNMENT = 64 * 1024
+SHARED_WEIGHTS_MIN_BYTES = 1024
+
+def shared_model_path(model_name, config):
+    return optimized_model_path(model_name, config)[:-len(".opt.onnx")] + ".shared.onnx"
+
+def export_shared_model(model_name, config):
+    """
+    Guarda el grafo ya optimizado con los pesos en un archivo aparte
+    (`.shared.onnx.data`) y alineados, para que onnxruntime los mapee en
+    memoria. Todos los procesos que abren el modelo comparten así las mismas
+    páginas de la caché del sistema. Necesita el paquete `onnx`.
+    """
+    try:
+        import onnx
+    except ImportError:
+        raise ValueError("Para compartir los pesos entre procesos hace falta instalar el paquete 'onnx'")
+
+    target = shared_model_path(model_name, config)
+    if split_variant(model_name)[1]:
+        source = os.path.join(os.environ["U2NET_HOME"], f"{model_name}.onnx")
+    else:
+        source = ensure_model(model_name)
+    optimized = f"{target}.opt.tmp"
+    sess_opts = build_session_options(config)
+    sess_opts.optimized_model_filepath = optimized
+    try:
+        ort.InferenceSession(source, sess_opts, providers=available_providers(config["providers"]))
+        model = onnx.load(optimized)
+    finally:
+        if os.path.exists(optimized):
+            os.remove(optimized)
+
+    data_name = f"{os.path.basename(target)}.data"
+    with open(f"{target}.data.tmp", "wb") as f:
+        for tensor in model.graph.initializer:
+            if len(tensor.raw_data) < SHARED_WEIGHTS_MIN_BYTES:
+                continue
+            offset = f.tell() + (-f.tell()) % SHARED_WEIGHTS_ALIGNMENT
+            f.seek(offset)
+            f.write(tensor.raw_data)
+            length = len(tensor.raw_data)
+            tensor.ClearField("raw_data")
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+            for key, value in (("location", data_name), ("offset", offset), ("length", length)):
+                entry = tensor.external_data.add()
+                entry.key, entry.value = key, str(value)
+    onnx.save(model, f"{target}.tmp")
+    os.replace(f"{target}.data.tmp", f"{target}.data")
+    os.replace(f"{target}.tmp", target)
+    return target
+
+def ensure_shared_model(model_name, config):
+    path = shared_model_path(model_name, config)
+    return path if os.path.exists(path) else export_shared_model(model_name, config)
+
+def create_session(model_name, config=None):
+    """
+    Crea una sesión de rembg con la configuración de onnxruntime indicada
+    (sin pasar por el pool). Con `optimized_model` el grafo optimizado se
+    guarda en la caché la primera vez y se carga directamente las siguientes.
+    """
+    config = dict(RUNTIME_DEFAULTS, **(config or {}))
+    with METRICS.span("sesion", modelo=model_name) as span:
+        session = _create_session(model_name, config)
+        span["proveedores"] = session.inner_session.get_providers()
+        model_path = getattr(session.inner_session, "_model_path", None)
+        if model_path and os.path.exists(model_path):
+            span["bytes"] = os.path.getsize(model_path)
+            METRICS.count("bytes_leidos", span["bytes"])
+    METRICS.count("sesiones_creadas")
+    return session
+
+def _create_session(model_name, config):
+    providers = available_providers(config["providers"])
+    sess_opts = build_session_options(config)
+
+    base_name, variant = split_variant(model_name)
+    if variant:
+        variant_path = os.path.join(os.environ["U2NET_HOME"], f"{model_name}.onnx")
+        if not os.path.exists(variant_path):
+            raise ValueError(
+                f"La variante {variant} de {base_name} no existe; créala con 'efi.py quantize'"
+            )
+
+    if config["shared_weights"] and base_name in BATCHABLE_MODELS:
+        shared_path = ensure_shared_model(model_name, config)
+        # El grafo ya está optimizado; sin preempaquetar, los pesos se usan
+        # directamente desde el archivo mapeado y no se copian
+        sess_opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        sess_opts.add_session_config_entry("session.disable_prepacking", "1")
+        return u2net_custom.U2netCustomSession(model_name, sess_opts, providers, model_path=shared_path)
+
+    if variant:
+        return u2net_custom.U2netCustomSession(model_name, sess_opts, providers, model_path=variant_path)
+
+    session_class = next(
+        (sc for sc in rembg_sessions.sessions_class if sc.name() == model_name), None
+    )
+    if session_class is None:
+        raise ValueError(f"Modelo desconocido: {model_name}")
+    ensure_model(model_name)
+
+    if config["optimized_model"] and model_name in BATCHABLE_MODELS:
+        opt_path = optimized_model_path(model_name, config)
+        if os.path.exists(opt_path):
+            return u2net_custom.U2netCustomSession(model_name, sess_opts, providers, model_path=opt_path)
+        sess_opts.optimized_model_filepath = opt_path
+
+    return session_class(model_name, sess_opts, providers)
+
+def _time_inference(model_name, config, runs):
+    start = time.perf_counter()
+    session = create_session(model_name, config)
+    load_time = time.perf_counter() - start
+
+    inner = session.inner_session
+    input_meta = inner.get_inputs()[0]
+    sample = np.random.default_rng(0).standard_normal((1, 3, *U2NET_INPUT_SIZE)).astype(np.float32)
+    inner.run(None, {input_meta.name: sample})
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        inner.run(None, {input_meta.name: sample})
+        times.append(time.perf_counter() - start)
+    return load_time, sorted(times)[len(times) // 2]
+
+def calibration_candidates():
+    cpus = os.cpu_count() or 1
+    threads = sorted({t for t in (1, 2, cpus // 2, cpus) if 1 <= t <= cpus})
+    for provider in available_providers():
+        if provider != "CPUExecutionProvider":
+            yield dict(RUNTIME_DEFAULTS, providers=[provider, "CPUExecutionProvider"])
+            continue
+        for t in threads:
+            yield dict(RUNTIME_DEFAULTS, providers=[provider], intra_op_num_threads=t)
+        if cpus > 2:
+            yield dict(
+                RUNTIME_DEFAULTS, providers=[provider], intra_op_num_threads=cpus,
+                execution_mode="parallel", inter_op_num_threads=2,
+            )
+        yield dict(
+            RUNTIME_DEFAULTS, providers=[provider], intra_op_num_threads=cpus,
+            graph_optimization_level="extended",
+        )
+
+def calibrate_runtime(model_name="u2net", runs=5, path=RUNTIME_CONFIG_PATH, report=None):
+    """
+    Prueba varias configuraciones de onnxruntime en esta máquina y guarda la
+    más rápida en la caché; a partir de entonces es la predeterminada.
+    """
+    results = []
+    for config in calibration_candidates():
+        try:
+            load_time, median = _time_inference(model_name, config, runs)
+        except Exception as e:
+            if report:
+                report(f"  {config['providers'][0]}: no disponible ({e})")
+            continue
+        results.append({"config": config, "carga_s": round(load_time, 3), "inferencia_s": round(median, 4)})
+        if report:
+            report(
+                f"  {config['providers'][0]:<26} hilos={config['intra_op_num_threads']:<3} "
+                f"modo={config['execution_mode']:<10} grafo={config['graph_optimization_level']:<9} "
+                f"{median * 1000:8.1f} ms"
+            )
+    if not results:
+        raise ValueError("Ninguna configuración pudo ejecutarse")
+
+    best = min(results, key=lambda r: r["inferencia_s"])
+    best_config = dict(best["config"], optimized_model=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "modelo": model_name,
+            "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "cpu_count": os.cpu_count(),
+            "config": best_config,
+            "resultados": results,
+        }, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+    RUNTIME.clear()
+    RUNTIME.update(best_config)
+    return best_config, results
+
+RUNTIME = load_runtime_config()
+
+# --- Sesiones de modelo ---
+MODEL_NAMES = {
+    "objetos": "u2net",
+    "rapido": "u2netp",
+    "personas": "u2net_human_seg",
+}
+
+class SessionPool:
+    """
+    Mantiene las sesiones de rembg cargadas entre imágenes.
+
+    Cada sesión se identifica por el nombre del modelo y sus opciones de
+    ejecución, se crea la primera vez que se pide y se reutiliza después.
+    Cuando la memoria estimada supera el presupuesto se descartan las
+    sesiones usadas hace más tiempo (la más reciente siempre se conserva).
+    """
+
+    def __init__(self, memory_budget_mb=512):
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._sessions = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _config(providers, options):
+        config = dict(RUNTIME, **options)
+        if providers is not None:
+            config["providers"] = list(providers)
+        return config
+
+    @staticmethod
+    def _estimate_size(model_name):
+        if model_name in MODEL_REGISTRY:
+            return MODEL_REGISTRY[model_name]["memoria_mb"] * 1024 * 1024
+        # Pesos en memoria más las arenas de onnxruntime: ~2x el archivo
+        model_path = os.path.join(os.environ["U2NET_HOME"], f"{model_name}.onnx")
+        try:
+            return os.path.getsize(model_path) * 2
+        except OSError:
+            return 0
+
+    def get(self, model_name, providers=None, **options):
+        """
+        Devuelve una sesión lista para usar, cargándola si hace falta. Las
+        opciones sobreescriben las de `RUNTIME` (p. ej. `intra_op_num_threads`).
+        """
+        config = self._config(providers, options)
+        key = (model_name, json.dumps(config, sort_keys=True))
+        with self._lock:
+            if key in self._sessions:
+                self._sessions.move_to_end(key)
+                return self._sessions[key][0]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        METRICS.count("sesiones_no_cargadas")
+
+        # Solo un hilo carga cada modelo; el resto espera y reutiliza la sesión
+        with load_lock:
+            with self._lock:
+                if key in self._sessions:
+                    self._sessions.move_to_end(key)
+                    return self._sessions[key][0]
+
+            with METRICS.span("carga_modelo", modelo=model_name):
+                session = create_session(model_name, config)
+            with self._lock:
+                self._sessions[key] = (session, self._estimate_size(model_name))
+                self._loading.pop(key, None)
+                self._evict()
+        return session
+
+    def _evict(self):
+        total = sum(size for _, size in self._sessions.values())
+        while total > self.memory_budget and len(self._sessions) > 1:
+            _, (_, size) = self._sessions.popitem(last=False)
+            total -= size
+
+    def prewarm(self, model_names, background=True):
+        """Carga por adelantado los modelos que ya están descargados."""
+        def load():
+            for model_name in model_names:
+                model_path = os.path.join(os.environ["U2NET_HOME"], f"{model_name}.onnx")
+                if os.path.exists(model_path):
+                    try:
+                        self.get(model_name)
+                    except Exception:
+                        pass
+
+        if background:
+            threading.Thread(target=load, daemon=True).start()
+        else:
+            load()
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+SESSIONS = SessionPool(int(os.getenv("EFI_MODEL_MEMORY_MB", "512")))
+
+# --- Selección automática de modelo ---
+MODEL_SPEED_PATH = os.path.join(CACHE_DIR, "velocidad_modelos.json")
+QUALITY_LEVELS = {"rapida": 1, "alta": 2}
+AUTO_LATENCY_S = float(os.getenv("EFI_AUTO_LATENCY_S", "2.0"))
+AUTO_QUALITY = os.getenv("EFI_AUTO_QUALITY", "alta")
+# Modelos entre los que elige el modo automático (objetos en general)
+AUTO_MODELS = ("u2netp", "u2net")
+# Segundos por megapíxel de cada recorte, como referencia hasta medirlos
+MATTING_COST_S_PER_MP = {"closed_form": 2.0, "fast": 0.1, "mask": 0.02}
+
+class ModelSpeed:
+    """
+    Velocidad medida en este equipo: segundos por imagen de cada modelo y
+    segundos por megapíxel de cada método de recorte (media móvil). Se
+    guarda en la caché para que el modo automático acierte desde el
+    arranque; los modelos sin medir escalan su latencia de referencia con
+    lo que rinden los medidos.
+    """
+
+    def __init__(self, path=MODEL_SPEED_PATH, weight=0.2):
+        self.path = path
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault("modelos", {})
+        self.data.setdefault("recorte", {})
+
+    def observe(self, kind, name, seconds):
+        with self._lock:
+            table = self.data[kind]
+            old = table.get(name)
+            table[name] = seconds if old is None else old + self.weight * (seconds - old)
+            self._dirty = True
+
+    def machine_factor(self):
+        ratios = [
+            seconds / MODEL_REGISTRY[name]["latencia_s"]
+            for name, seconds in self.data["modelos"].items() if name in MODEL_REGISTRY
+        ]
+        return statistics.median(ratios) if ratios else 1.0
+
+    def inference_s(self, model_name):
+        measured = self.data["modelos"].get(model_name)
+        if measured is not None:
+            return measured
+        info = MODEL_REGISTRY.get(split_variant(model_name)[0], MODEL_REGISTRY["u2net"])
+        return info["latencia_s"] * self.machine_factor()
+
+    def estimate(self, model_name, pixels, matting="closed_form"):
+        """Segundos esperados para una imagen: inferencia más recorte según su tamaño."""
+        per_mp = self.data["recorte"].get(matting, MATTING_COST_S_PER_MP.get(matting, 0.0))
+        return self.inference_s(model_name) + per_mp * pixels / 1e6
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self.data, indent=2)
+            self._dirty = False
+        try:
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(f"{self.path}.tmp", self.path)
+        except OSError:
+            pass
+
+SPEED = ModelSpeed()
+atexit.register(SPEED.save)
+
+def select_model(pixels, matting="closed_form", latency_target=AUTO_LATENCY_S, quality=AUTO_QUALITY):
+    """
+    Modo automático: el modelo más barato que da la calidad pedida y cuya
+    latencia estimada para esta imagen entra en `latency_target`. Si ninguno
+    entra se rebaja la calidad. Si ni así, el objetivo es inalcanzable (el
+    recorte de una foto grande domina) y solo compensa el más rápido cuando
+    tarda menos de la mitad. Se descartan los que no caben en memoria.
+    """
+    budget_mb = SESSIONS.memory_budget / (1024 * 1024)
+    candidates = [n for n in AUTO_MODELS if MODEL_REGISTRY[n]["memoria_mb"] <= budget_mb] or list(AUTO_MODELS)
+    cost = {name: SPEED.estimate(name, pixels, matting) for name in candidates}
+    by_cost = sorted(candidates, key=cost.get)
+    for level in range(QUALITY_LEVELS[quality], 0, -1):
+        for name in by_cost:
+            fits = latency_target is None or cost[name] <= latency_target
+            if MODEL_REGISTRY[name]["calidad"] >= level and fits:
+                return name
+    wanted = next((n for n in by_cost if MODEL_REGISTRY[n]["calidad"] >= QUALITY_LEVELS[quality]), by_cost[0])
+    return by_cost[0] if cost[by_cost[0]] < cost[wanted] / 2 else wanted
+
+def measure_models(runs=3, report=None):
+    """Mide la inferencia de los modelos ya descargados y la guarda para el modo automático."""
+    sample, _, _ = synthetic_sample(640, 480)
+    for name in MODEL_REGISTRY:
+        if not os.path.exists(os.path.join(os.environ["U2NET_HOME"], f"{name}.onnx")):
+            continue
+        session = SESSIONS.get(name)
+        _predict_masks(session, [sample])
+        for _ in range(runs):
+            start = time.perf_counter()
+            _predict_masks(session, [sample])
+            SPEED.observe("modelos", name, time.perf_counter() - start)
+        if report:
+            report(f"  {name}: {SPEED.inference_s(name) * 1000:.0f} ms por imagen")
+    SPEED.save()
+
+# --- Variantes cuantizadas ---
+# int8: cuantización dinámica de pesos, no necesita imágenes
+# int8_static: pesos y activaciones en INT8, calibrado con imágenes locales
+# fp16: media precisión; pensado para GPU, en CPU puede no estar soportado
+MODEL_VARIANTS = ("int8", "int8_static", "fp16")
+
+def split_variant(model_name):
+    """'u2net_int8' -> ('u2net', 'int8'); 'u2net' -> ('u2net', None)."""
+    for variant in MODEL_VARIANTS:
+        if model_name.endswith(f"_{variant}"):
+            base_name = model_name[:-len(variant) - 1]
+            if base_name in MODEL_NAMES.values():
+                return base_name, variant
+    return model_name, None
+
+def resolve_mode(mode, pixels=0):
+    """
+    Modo de la interfaz ('objetos', 'objetos-int8'...) a nombre de modelo.
+    'auto' elige el modelo según los megapíxeles de la imagen.
+    """
+    if mode == "auto":
+        return select_model(pixels)
+    base_mode, _, variant = mode.partition("-")
+    if base_mode not in MODEL_NAMES or (variant and variant not in MODEL_VARIANTS):
+        raise ValueError(f"Modo desconocido: {mode}")
+    return f"{MODEL_NAMES[base_mode]}_{variant}" if variant else MODEL_NAMES[base_mode]
+
+def available_variants(model_name):
+    return [
+        variant for variant in MODEL_VARIANTS
+        if os.path.exists(os.path.join(os.environ["U2NET_HOME"], f"{model_name}_{variant}.onnx"))
+    ]
+
+def available_modes():
+    modes = list(MODEL_NAMES) + ["auto"]
+    for mode, model_name in MODEL_NAMES.items():
+        modes.extend(f"{mode}-{variant}" for variant in available_variants(model_name))
+    return modes
+
+def calibration_images(paths, limit=32):
+    images = [path for path, _ in collect_inputs(paths)][:limit]
+    if not images:
+        raise ValueError("La cuantización estática necesita imágenes de calibración")
+    return images
+
+def quantize_model(model_name, variant, calibration_paths=None, limit=32):
+    """
+    Genera `<modelo>_<variante>.onnx` en la caché a partir del modelo FP32.
+    Necesita el paquete `onnx` (y `onnxconverter-common` para fp16).
+    """
+    try:
+        import onnx
+        from onnxruntime import quantization
+    except ImportError:
+        raise ValueError("Para cuantizar hace falta instalar el paquete 'onnx'")
+
+    source = ensure_model(model_name)
+    target = os.path.join(os.environ["U2NET_HOME"], f"{model_name}_{variant}.onnx")
+    tmp_target = f"{target}.tmp"
+
+    if variant == "int8":
+        quantization.quantize_dynamic(source, tmp_target, weight_type=quantization.QuantType.QUInt8)
+
+    elif variant == "int8_static":
+        images = calibration_images(calibration_paths or [], limit)
+
+        class Reader(quantization.CalibrationDataReader):
+            def __init__(self):
+                input_name = ort.InferenceSession(source, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+                self._items = iter(
+                    {input_name: _normalize_input(decode_image(path))[None]} for path in images
+                )
+
+            def get_next(self):
+                return next(self._items, None)
+
+        prepared = f"{target}.pre.onnx"
+        try:
+            quantization.quant_pre_process(source, prepared)
+        except Exception:
+            shutil.copyfile(source, prepared)
+        try:
+            quantization.quantize_static(
+                prepared,
+                tmp_target,
+                Reader(),
+                quant_format=quantization.QuantFormat.QDQ,
+                activation_type=quantization.QuantType.QUInt8,
+                weight_type=quantization.QuantType.QInt8,
+                per_channel=True,
+            )
+        finally:
+            os.remove(prepared)
+
+    elif variant == "fp16":
+        try:
+            from onnxconverter_common import float16
+        except ImportError:
+            raise ValueError("Para la variante fp16 hace falta instalar 'onnxconverter-common'")
+        model = float16.convert_float_to_float16(onnx.load(source), keep_io_types=True)
+        onnx.save(model, tmp_target)
+
+    else:
+        raise ValueError(f"Variante desconocida: {variant}")
+
+    os.replace(tmp_target, target)
+    return target
+
+def _evaluate_variant(model_name, image_paths, runs):
+    """Se ejecuta en un proceso aparte: mide carga, latencia y memoria del modelo."""
+    images = [decode_image(path) for path in image_paths]
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    session = create_session(model_name, RUNTIME)
+    load_time = time.perf_counter() - start
+
+    predict_masks(session, images[:1])
+    times = []
+    masks = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        masks = [predict_mask(session, img) for img in images]
+        times.append((time.perf_counter() - start) / len(images))
+    return {
+        "carga_s": load_time,
+        "latencia_s": sorted(times)[len(times) // 2],
+        "pico_rss_mb": peak_rss_mb(),
+        "incremento_rss_mb": None if rss_before is None else peak_rss_mb() - rss_before,
+        "masks": [np.asarray(mask) for mask in masks],
+    }
+
+def mask_iou(a, b, threshold=128):
+    a = a >= threshold
+    b = b >= threshold
+    union = np.logical_or(a, b).sum()
+    return 1.0 if union == 0 else float(np.logical_and(a, b).sum() / union)
+
+def evaluate_variants(model_name, image_paths=None, runs=3, report=None):
+    """
+    Compara el modelo FP32 con sus variantes: tamaño, carga, latencia por
+    imagen, memoria y IoU de la máscara respecto al FP32. Sin el FP32 no
+    hay referencia para el IoU: si no se puede evaluar se lanza RuntimeError.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not image_paths:
+            image_paths = []
+            for i, size in enumerate([(640, 480), (1024, 768), (1600, 1200)]):
+                path = os.path.join(tmp_dir, f"muestra_{i}.png")
+                synthetic_sample(*size, seed=i)[0].save(path)
+                image_paths.append(path)
+
+        results = []
+        baseline = None
+        ctx = get_context("spawn")
+        for name in [model_name] + [f"{model_name}_{v}" for v in available_variants(model_name)]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                try:
+                    result = pool.submit(_evaluate_variant, name, image_paths, runs).result()
+                except Exception as e:
+                    if baseline is None:
+                        raise RuntimeError(f"No se pudo evaluar el modelo FP32 {name}: {e}") from e
+                    if report:
+                        report(f"  {name}: no se pudo evaluar ({e})")
+                    continue
+            masks = result.pop("masks")
+            if baseline is None:
+                baseline = masks
+            result["iou"] = float(np.mean([mask_iou(m, b) for m, b in zip(masks, baseline)]))
+            result["modelo"] = name
+            result["tamano_mb"] = os.path.getsize(os.path.join(os.environ["U2NET_HOME"], f"{name}.onnx")) / 1e6
+            results.append(result)
+    return results
+
+def format_variant_report(results):
+    lines = [f"{'Modelo':<26}{'Tamaño':>10}{'Carga':>9}{'Latencia':>11}{'Pico RSS':>11}{'IoU':>8}"]
+    for r in results:
+        rss = "n/d" if r["pico_rss_mb"] is None else f"{r['pico_rss_mb']:.0f} MB"
+        lines.append(
+            f"{r['modelo']:<26}{r['tamano_mb']:>7.1f} MB{r['carga_s']:>8.2f}s"
+            f"{r['latencia_s'] * 1000:>9.1f}ms{rss:>11}{r['iou']:>8.3f}"
+        )
+    return "\n".join(lines)
+
+# --- Procesamiento ---
+REMOVE_OPTIONS = {
+    "alpha_matting": True,
+    "matting_backend": "closed_form",
+    "alpha_matting_foreground_threshold": 240,
+    "alpha_matting_background_threshold": 10,
+    "alpha_matting_erode_size": 10,
+}
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+OUTPUT_SUFFIX = "_sin_fondo.png"
+# Formatos de salida con transparencia; el resultado se codifica una sola vez, al guardar
+OUTPUT_FORMATS = ("png", "webp", "avif")
+PNG_COMPRESS_LEVEL = int(os.getenv("EFI_PNG_COMPRESS_LEVEL", "6"))
+WEBP_MAX_SIDE = 16383
+
+def decode_image(source):
+    """Abre la imagen (ruta, bytes o archivo abierto) con la orientación EXIF ya aplicada."""
+    if hasattr(source, "read"):
+        source = source.read()
+    size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    with METRICS.span("decodificar", bytes=size) as span:
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        img = Image.open(source)
+        # exif_transpose devuelve una copia aunque no haya nada que girar
+        if img.getexif().get(0x0112, 1) != 1:
+            img = ImageOps.exif_transpose(img)
+        img.load()
+        span["pixeles"] = img.width * img.height
+    METRICS.count("bytes_leidos", size)
+    return img
+
+# Modelos de la familia U²-Net que comparten entrada 320x320 y normalización
+BATCHABLE_MODELS = ("u2net", "u2netp", "u2net_human_seg")
+U2NET_INPUT_SIZE = (320, 320)
+U2NET_MEAN = (0.485, 0.456, 0.406)
+U2NET_STD = (0.229, 0.224, 0.225)
+
+def _normalize_input(img, size=U2NET_INPUT_SIZE):
+    im = np.asarray(img.convert("RGB").resize(size, Image.LANCZOS), dtype=np.float32)
+    im = im / max(float(im.max()), 1e-6)
+    im = (im - np.array(U2NET_MEAN, dtype=np.float32)) / np.array(U2NET_STD, dtype=np.float32)
+    return im.transpose((2, 0, 1))
+
+def predict_masks(session, images):
+    """
+    Predice las máscaras de varias imágenes con una sola llamada a
+    `session.run`, apilándolas en un tensor NCHW de 320x320. Cada máscara
+    se devuelve escalada al tamaño de su imagen.
+    """
+    start = time.perf_counter()
+    with METRICS.span("inferencia", modelo=session.model_name, imagenes=len(images)):
+        masks = _predict_masks(session, images)
+    SPEED.observe("modelos", session.model_name, (time.perf_counter() - start) / len(images))
+    return masks
+
+def _predict_masks(session, images):
+    if split_variant(session.model_name)[0] not in BATCHABLE_MODELS:
+        return [session.predict(img)[0] for img in images]
+
+    inner = session.inner_session
+    input_meta = inner.get_inputs()[0]
+    size = MODEL_REGISTRY.get(split_variant(session.model_name)[0], {}).get("entrada", U2NET_INPUT_SIZE)
+    batch = np.stack([_normalize_input(img, size) for img in images])
+
+    if isinstance(input_meta.shape[0], int) and input_meta.shape[0] != len(images):
+        # Modelo exportado con lote fijo: se ejecuta una muestra cada vez
+        preds = np.concatenate([
+            inner.run(None, {input_meta.name: batch[i:i + 1]})[0]
+            for i in range(len(images))
+        ])
+    else:
+        preds = inner.run(None, {input_meta.name: batch})[0]
+
+    masks = []
+    for img, pred in zip(images, preds[:, 0]):
+        lo, hi = pred.min(), pred.max()
+        pred = (pred - lo) / max(hi - lo, 1e-6)
+        mask = Image.fromarray((pred * 255).astype(np.uint8), mode="L")
+        masks.append(mask.resize(img.size, Image.LANCZOS))
+    return masks
+
+def predict_mask(session, img):
+    return predict_masks(session, [img])[0]
+
+class MicroBatcher:
+    """
+    Junta las imágenes que llegan desde varios hilos y las pasa al modelo en
+    lotes de hasta `batch_size`. Un lote incompleto se envía cuando la
+    primera imagen lleva esperando `max_latency` segundos.
+    """
+
+    def __init__(self, model_name, batch_size=4, max_latency=0.02, session_options=None):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.max_latency = max_latency
+        self.session_options = session_options or {}
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, img):
+        future = Future()
+        self._queue.put((img, future))
+        return future
+
+    def predict(self, img):
+        return self.submit(img).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_latency
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            try:
+                session = SESSIONS.get(self.model_name, **self.session_options)
+                masks = predict_masks(session, [img for img, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.images += len(batch)
+            for (_, future), mask in zip(batch, masks):
+                future.set_result(mask)
+
+BATCH_SIZE = int(os.getenv("EFI_BATCH_SIZE", "1"))
+BATCH_LATENCY = float(os.getenv("EFI_BATCH_LATENCY_MS", "20")) / 1000
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_batcher(model_name):
+    """Devuelve el agrupador compartido del modelo, creándolo la primera vez."""
+    with _batchers_lock:
+        if model_name not in _batchers:
+            _batchers[model_name] = MicroBatcher(model_name, BATCH_SIZE, BATCH_LATENCY)
+        return _batchers[model_name]
+
+# --- Recorte (alpha matting) ---
+# closed_form: pymatting sobre toda la imagen (máxima calidad, la opción original)
+# fast: solo la franja dudosa del trimap, a resolución reducida, y filtro guiado
+# mask: la máscara del modelo tal cual, sin matting
+MATTING_BACKENDS = ("closed_form", "fast", "mask")
+MATTING_LABELS = {
+    "closed_form": "Calidad",
+    "fast": "Rápido",
+    "mask": "Solo máscara",
+}
+
+def matting_options(backend, base=REMOVE_OPTIONS):
+    if backend not in MATTING_BACKENDS:
+        raise ValueError(f"Método de recorte desconocido: {backend}")
+    options = dict(base, matting_backend=backend)
+    options["alpha_matting"] = backend != "mask"
+    return options
+
+def build_trimap(mask, foreground_threshold, background_threshold, erode_size):
+    """Trimap igual al de rembg: 255 fondo seguro, 0 fondo, 128 dudoso."""
+    mask = np.asarray(mask)
+    structure = np.ones((erode_size, erode_size), dtype=np.uint8) if erode_size > 0 else None
+    is_foreground = ndimage.binary_erosion(mask > foreground_threshold, structure=structure)
+    is_background = ndimage.binary_erosion(mask < background_threshold, structure=structure, border_value=1)
+    trimap = np.full(mask.shape, 128, dtype=np.uint8)
+    trimap[is_foreground] = 255
+    trimap[is_background] = 0
+    return trimap
+
+def _box_filter(x, radius):
+    return cv2.boxFilter(x, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+def guided_coefficients(guide_small, src_small, radius=4, eps=1e-4):
+    """Coeficientes (a, b) del filtro guiado, ya promediados, a baja resolución."""
+    mean_i = _box_filter(guide_small, radius)
+    mean_p = _box_filter(src_small, radius)
+    cov_ip = _box_filter(guide_small * src_small, radius) - mean_i * mean_p
+    var_i = _box_filter(guide_small * guide_small, radius) - mean_i * mean_i
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    return _box_filter(a, radius), _box_filter(b, radius)
+
+def guided_upsample(guide_small, src_small, guide_full, radius=4, eps=1e-4):
+    """
+    Filtro guiado rápido: los coeficientes lineales se calculan a baja
+    resolución y se aplican sobre la guía a resolución completa, de modo
+    que el alfa sigue los bordes reales de la imagen.
+    """
+    mean_a, mean_b = guided_coefficients(guide_small, src_small, radius, eps)
+    size = (guide_full.shape[1], guide_full.shape[0])
+    mean_a = cv2.resize(mean_a, size, interpolation=cv2.INTER_LINEAR)
+    mean_b = cv2.resize(mean_b, size, interpolation=cv2.INTER_LINEAR)
+    return mean_a * guide_full + mean_b
+
+def _solve_band(img_small, mask_small, trimap, tile=160, margin=16, progress=None):
+    """
+    Resuelve el matting por baldosas, visitando solo las que contienen
+    píxeles dudosos. Fuera de la franja el alfa sale del trimap y, donde
+    no hay solución, de la propia máscara.
+    """
+    unknown = trimap == 128
+    trimap = trimap.astype(np.float64) / 255.0
+    alpha = np.where(unknown, np.asarray(mask_small, dtype=np.float64) / 255.0, trimap)
+    height, width = trimap.shape
+    for y in range(0, height, tile):
+        if progress:
+            progress("recorte", y / height)
+        for x in range(0, width, tile):
+            if not unknown[y:y + tile, x:x + tile].any():
+                continue
+            y0, x0 = max(0, y - margin), max(0, x - margin)
+            y1, x1 = min(height, y + tile + margin), min(width, x + tile + margin)
+            sub_trimap = trimap[y0:y1, x0:x1]
+            known = sub_trimap[~unknown[y0:y1, x0:x1]]
+            # Hace falta primer plano y fondo conocidos para que haya solución
+            if known.size == 0 or known.min() == known.max():
+                continue
+            try:
+                sub_alpha = pymatting_cf.estimate_alpha_cf(img_small[y0:y1, x0:x1], sub_trimap)
+            except ValueError:
+                continue
+            ty, tx = y - y0, x - x0
+            alpha[y:y + tile, x:x + tile] = sub_alpha[ty:ty + tile, tx:tx + tile]
+    return alpha
+
+def low_res_matte(small_rgb, small_mask, foreground_threshold, background_threshold,
+                  erode_size, scale=1.0, progress=None):
+    """
+    Parte de baja resolución del método `fast`: trimap y matting sobre la
+    franja dudosa. Devuelve el trimap, el alfa y la guía en gris.
+    """
+    erode = max(1, round(erode_size * scale)) if erode_size > 0 else 0
+    trimap = build_trimap(small_mask, foreground_threshold, background_threshold, erode)
+    img_small = np.asarray(small_rgb, dtype=np.float64) / 255.0
+    alpha_small = _solve_band(img_small, small_mask, trimap, progress=progress).astype(np.float32)
+    guide_small = np.asarray(small_rgb.convert("L"), dtype=np.float32) / 255.0
+    return trimap, alpha_small, guide_small
+
+def fast_alpha_matting(img, mask, foreground_threshold, background_threshold,
+                       erode_size, max_side=1024, progress=None):
+    """
+    Alternativa rápida a `alpha_matting_cutout`. El trimap y el matting se
+    calculan con el lado mayor limitado a `max_side`, solo en la franja
+    dudosa, y el alfa se lleva a resolución completa con un filtro guiado.
+    Se conservan los colores originales en lugar de estimar el primer plano.
+    """
+    rgb = img.convert("RGB")
+    width, height = rgb.size
+    scale = min(1.0, max_side / max(width, height))
+    small_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+    small_rgb = rgb.resize(small_size, Image.BILINEAR) if scale < 1 else rgb
+    small_mask = mask.resize(small_size, Image.BILINEAR) if scale < 1 else mask
+    trimap, alpha_small, guide_small = low_res_matte(
+        small_rgb, small_mask, foreground_threshold, background_threshold, erode_size, scale, progress
+    )
+
+    if scale < 1:
+        guide_full = np.asarray(rgb.convert("L"), dtype=np.float32) / 255.0
+        alpha = guided_upsample(guide_small, alpha_small, guide_full)
+        trimap = cv2.resize(trimap, (width, height), interpolation=cv2.INTER_NEAREST)
+    else:
+        alpha = guided_upsample(guide_small, alpha_small, guide_small)
+
+    # Las zonas seguras del trimap no se tocan
+    alpha[trimap == 255] = 1.0
+    alpha[trimap == 0] = 0.0
+    alpha = Image.fromarray((np.clip(alpha, 0, 1) * 255 + 0.5).astype(np.uint8), mode="L")
+
+    # `convert` ya devolvió una copia: el alfa se añade sobre ella sin otra más
+    rgb.putalpha(alpha)
+    return rgb
+
+def apply_mask(img, mask, options=REMOVE_OPTIONS, progress=None):
+    """Recorta la imagen con la máscara según el método elegido en `options`."""
+    backend = options.get("matting_backend", "closed_form") if options.get("alpha_matting") else "mask"
+    start = time.perf_counter()
+    with METRICS.span("recorte", metodo=backend, pixeles=img.width * img.height):
+        result = _apply_mask(img, mask, options, progress)
+    megapixels = max(img.width * img.height / 1e6, 0.01)
+    SPEED.observe("recorte", backend, (time.perf_counter() - start) / megapixels)
+    return result
+
+def _apply_mask(img, mask, options, progress):
+    if options.get("alpha_matting"):
+        thresholds = (
+            options["alpha_matting_foreground_threshold"],
+            options["alpha_matting_background_threshold"],
+            options["alpha_matting_erode_size"],
+        )
+        try:
+            if options.get("matting_backend", "closed_form") == "fast":
+                return fast_alpha_matting(img, mask, *thresholds, progress=progress)
+            return rembg_bg.alpha_matting_cutout(img, mask, *thresholds)
+        except ValueError:
+            pass
+    return compose_cutout(img, mask)
+
+# Filas por franja al componer; ~12 MB de trabajo con una foto de 6000 px de ancho
+COMPOSE_ROWS = 256
+
+def compose_cutout(img, mask, rows=COMPOSE_ROWS):
+    """
+    El mismo resultado que `naive_cutout` de rembg (la imagen sobre un fondo
+    transparente, mezclada con la máscara) pero por franjas de filas: aparte
+    de la salida RGBA no se crean copias completas de la imagen.
+    """
+    result = Image.new("RGBA", img.size, 0)
+    for y0 in range(0, img.height, rows):
+        box = (0, y0, img.width, min(img.height, y0 + rows))
+        # paste convierte cada franja a RGBA; con la imagen entera sería una copia completa
+        result.paste(img.crop(box), box, mask.crop(box))
+    return result
+
+# --- Imágenes grandes ---
+# Por encima de este tamaño se procesa por franjas con memoria acotada
+LARGE_IMAGE_PIXELS = int(float(os.getenv("EFI_LARGE_IMAGE_MP", "40")) * 1_000_000)
+LARGE_IMAGE_BUDGET_MB = int(os.getenv("EFI_LARGE_IMAGE_BUDGET_MB", "128"))
+# Los escaneos de 100+ MP son justo el caso de uso; PIL avisa desde ~89 MP
+Image.MAX_IMAGE_PIXELS = 1_000_000_000
+# Bytes de trabajo por píxel de una franja: RGB, guía, coeficientes, alfa y filas PNG
+STRIP_BYTES_PER_PIXEL = 40
+LARGE_MASK_SIDE = 1024
+LARGE_PREVIEW_SIDE = 1600
+# Las imágenes grandes se decodifican a un archivo temporal aquí y no en
+# /tmp, que en muchos sistemas está en RAM
+LARGE_IMAGE_DIR = os.path.join(CACHE_DIR, "grandes")
+# Modos que PIL puede decodificar sobre un archivo mapeado y bytes por píxel
+MAPPED_MODES = {"RGB": 4, "RGBA": 4, "L": 1}
+
+def image_pixels(path):
+    """Píxeles de la imagen leyendo solo la cabecera."""
+    with Image.open(path) as img:
+        return img.width * img.height
+
+# Lado mayor de la vista rápida; u2net trabaja a 320 px, así la máscara no pierde detalle
+PROXY_SIDE = 640
+
+# Lado mayor de la imagen con la que se predice la máscara; el mismo que la
+# vista rápida para que su máscara se reutilice sin reescalar
+INFERENCE_SIDE = PROXY_SIDE
+
+def decode_reduced(source, max_side=INFERENCE_SIDE):
+    """
+    Decodifica (ruta, bytes o archivo abierto) solo lo que hace falta para predecir la
+    máscara: en JPEG la reducción se hace en el dominio DCT (`draft`), sin
+    tocar todos los píxeles, y en el resto con `reduce` antes del filtro.
+    La orientación EXIF se aplica igual que en `decode_image`. Devuelve la
+    imagen y el tamaño completo ya girado; si la imagen no supera
+    `max_side` se devuelve entera, tal como la daría `decode_image`.
+    """
+    if hasattr(source, "read"):
+        # Se abre dos veces (cabecera y decodificación): mejor en memoria
+        source = source.read()
+    size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    img = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    orientation = img.getexif().get(0x0112, 1)
+    # Orientaciones EXIF 5-8 giran la imagen 90°
+    full_size = img.size[::-1] if orientation in (5, 6, 7, 8) else img.size
+    if max(img.size) <= max_side:
+        return decode_image(source), full_size
+
+    with METRICS.span("decodificar", bytes=size, reducida=True) as span:
+        # draft elige la escala DCT (1/2, 1/4, 1/8) que aún cubre el tamaño final
+        scale = max_side / max(img.size)
+        img.draft("RGB", (max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+        # thumbnail reduce primero por bloques (`reduce`) y filtra después
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        span["pixeles"] = img.width * img.height
+    METRICS.count("bytes_leidos", size)
+    return img, full_size
+
+def upscale_mask(mask, size):
+    """
+    Lleva la máscara de la imagen reducida al tamaño completo. Bilineal,
+    como en las franjas de `process_large_image`: en una máscara suave no
+    se distingue de LANCZOS y tarda veinte veces menos.
+    """
+    return Image.fromarray(cv2.resize(np.asarray(mask), size, interpolation=cv2.INTER_LINEAR))
+
+def open_reduced(path, max_side):
+    """Imagen RGB con el lado mayor limitado a `max_side` (ver `decode_reduced`)."""
+    return decode_reduced(path, max_side)[0].convert("RGB")
+
+def _resize_rows(src, width, height, y0, y1):
+    """
+    Filas y0..y1 de `src` escalado bilinealmente a (width, height), con el
+    mismo criterio de centros de píxel que cv2.resize, sin crear la imagen
+    completa.
+    """
+    src_h = src.shape[0]
+    ys = (np.arange(y0, y1, dtype=np.float32) + 0.5) * (src_h / height) - 0.5
+    ys = np.clip(ys, 0, src_h - 1)
+    i0 = ys.astype(np.int32)
+    i1 = np.minimum(i0 + 1, src_h - 1)
+    wy = (ys - i0)[:, None]
+    rows = src[i0] * (1 - wy) + src[i1] * wy
+    return cv2.resize(rows.astype(np.float32), (width, y1 - y0), interpolation=cv2.INTER_LINEAR)
+
+def _oriented(array, orientation):
+    """Vista (sin copiar) con la orientación EXIF aplicada, como `ImageOps.exif_transpose`."""
+    if orientation in (5, 6, 7, 8):
+        array = array.swapaxes(0, 1)
+    if orientation in (3, 4, 7, 8):
+        array = array[::-1]
+    if orientation in (2, 3, 6, 7):
+        array = array[:, ::-1]
+    return array
+
+class MappedImage:
+    """
+    Imagen completa decodificada sobre un archivo temporal mapeado en
+    memoria (en `LARGE_IMAGE_DIR`) en lugar de en la del proceso.
+
+    Mientras se decodifica y al recorrerla por franjas, las páginas ya
+    usadas se devuelven al sistema con `release`: los datos siguen en el
+    archivo y el proceso solo tiene residentes las filas con las que
+    trabaja. El archivo ocupa ancho x alto x 4 bytes en disco mientras la
+    imagen está abierta. En Windows no hay `madvise` y es el sistema quien
+    decide qué páginas del archivo quedan en memoria.
+
+    Los modos que no están en `MAPPED_MODES` (paleta, 16 bits, CMYK...) se
+    decodifican en memoria como en `decode_image`.
+    """
+
+    def __init__(self, path):
+        self._file = None
+        self._map = None
+        size = os.path.getsize(path)
+        with Image.open(path) as img:
+            orientation = img.getexif().get(0x0112, 1)
+            with METRICS.span("decodificar", bytes=size, mapeada=img.mode in MAPPED_MODES) as span:
+                if img.mode in MAPPED_MODES:
+                    array = self._decode_mapped(img)
+                else:
+                    array = np.asarray(img.convert("RGB"))
+                span["pixeles"] = img.width * img.height
+        METRICS.count("bytes_leidos", size)
+        self._array = _oriented(array, orientation)
+        self.height, self.width = self._array.shape[:2]
+
+    def _decode_mapped(self, img):
+        width, height = img.size
+        pixel_bytes = MAPPED_MODES[img.mode]
+        os.makedirs(LARGE_IMAGE_DIR, exist_ok=True)
+        self._file = tempfile.TemporaryFile(dir=LARGE_IMAGE_DIR)
+        self._file.truncate(width * height * pixel_bytes)
+        self._map = mmap.mmap(self._file.fileno(), width * height * pixel_bytes)
+        # PIL decodifica sobre `img.im` si ya tiene el modo y el tamaño de la imagen
+        img.im = Image.core.map_buffer(self._map, img.size, "raw", 0, (img.mode, width * pixel_bytes, 1))
+        read = getattr(img, "load_read", img.fp.read)
+
+        def load_read(n):
+            self.release()
+            return read(n)
+
+        img.load_read = load_read
+        try:
+            img.load()
+        except BaseException:
+            img.im = None
+            self.close()
+            raise
+        finally:
+            # Sin el ciclo imagen -> load_read -> imagen, el mapa se puede cerrar enseguida
+            del img.load_read
+        self.release()
+        return np.frombuffer(self._map, dtype=np.uint8).reshape(height, width, pixel_bytes)
+
+    def rows(self, y0, y1):
+        """Filas y0..y1 en RGB (uint8), como las de `decode_image(...).convert("RGB")`."""
+        strip = self._array[y0:y1]
+        if strip.shape[2] == 1:
+            return np.repeat(strip, 3, axis=2)
+        return np.ascontiguousarray(strip[..., :3])
+
+    def release(self):
+        """Devuelve al sistema las páginas mapeadas; los datos siguen en el archivo."""
+        if self._map is not None and hasattr(mmap, "MADV_DONTNEED"):
+            self._map.madvise(mmap.MADV_DONTNEED)
+
+    def close(self):
+        self._array = None
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+def _nearest_rows(src, width, height, y0, y1):
+    rows = np.minimum(((np.arange(y0, y1) + 0.5) * (src.shape[0] / height)).astype(np.int32), src.shape[0] - 1)
+    cols = np.minimum(((np.arange(width) + 0.5) * (src.shape[1] / width)).astype(np.int32), src.shape[1] - 1)
+    return src[np.ix_(rows, cols)]
+
+class PngStreamWriter:
+    """
+    Escribe un PNG RGBA de 8 bits por franjas de filas, comprimiendo sobre
+    la marcha, para no tener la imagen de salida completa en memoria.
+    """
+
+    def __init__(self, path, width, height, compress_level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self._tmp_path = f"{path}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._zlib = zlib.compressobj(compress_level)
+        self._pending = []
+        self._pending_size = 0
+        self._rows = 0
+
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    def _flush(self, force=False):
+        if self._pending and (force or self._pending_size >= 1 << 20):
+            self._chunk(b"IDAT", b"".join(self._pending))
+            self._pending = []
+            self._pending_size = 0
+
+    def write_rows(self, rgba):
+        # Filtro "Sub" de PNG: cada byte menos el del píxel anterior
+        filtered = rgba.reshape(rgba.shape[0], -1).copy()
+        filtered[:, 4:] -= rgba.reshape(rgba.shape[0], -1)[:, :-4]
+        rows = np.empty((filtered.shape[0], filtered.shape[1] + 1), dtype=np.uint8)
+        rows[:, 0] = 1
+        rows[:, 1:] = filtered
+        data = self._zlib.compress(rows.tobytes())
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+        self._rows += rgba.shape[0]
+        self._flush()
+
+    def close(self):
+        self._pending.append(self._zlib.flush())
+        self._flush(force=True)
+        self._chunk(b"IEND", b"")
+        self._file.close()
+        if self._rows != self.height:
+            os.remove(self._tmp_path)
+            raise ValueError("La imagen de salida quedó incompleta")
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+def process_large_image(input_path, output_path, model_name="u2net", options=REMOVE_OPTIONS,
+                        memory_budget_mb=LARGE_IMAGE_BUDGET_MB, compress_level=6, progress=None):
+    """
+    Quita el fondo de imágenes muy grandes con memoria acotada.
+
+    La máscara y el matting (método `fast`, o la máscara sola con `mask`)
+    se calculan sobre una versión reducida; con `closed_form` también se
+    usa `fast`. Después la imagen completa, decodificada sobre un archivo
+    mapeado (`MappedImage`), se recorre por franjas: en cada una se aplica
+    el filtro guiado a resolución completa y las filas se comprimen
+    directamente al PNG. El trabajo por franja se limita a
+    `memory_budget_mb`. Devuelve una vista previa reducida.
+
+    Las franjas solo pueden escribirse en PNG; para WebP/AVIF se escribe un
+    PNG temporal que después se recodifica entero, así que en esos formatos
+    la memoria crece con la imagen.
+    """
+    progress = progress or (lambda stage, fraction=1.0: None)
+    fmt = output_format(output_path)
+    final_path = output_path
+    if fmt != "png":
+        output_path = f"{output_path}.png.tmp"
+    progress("inferencia", 0.0)
+    small_rgb = open_reduced(input_path, LARGE_MASK_SIDE)
+    small_mask = predict_mask(SESSIONS.get(model_name), small_rgb)
+    progress("inferencia", 1.0)
+
+    with Image.open(input_path) as probe:
+        width, height = probe.size
+        # Orientaciones EXIF 5-8 giran la imagen 90°
+        if probe.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    scale = small_rgb.width / width
+
+    use_matting = options.get("alpha_matting")
+    if use_matting:
+        trimap, alpha_small, guide_small = low_res_matte(
+            small_rgb,
+            small_mask,
+            options["alpha_matting_foreground_threshold"],
+            options["alpha_matting_background_threshold"],
+            options["alpha_matting_erode_size"],
+            scale,
+            progress,
+        )
+        mean_a, mean_b = guided_coefficients(guide_small, alpha_small)
+    progress("recorte", 1.0)
+    if not use_matting:
+        mask_small = np.asarray(small_mask, dtype=np.float32) / 255.0
+    del small_rgb
+
+    progress("decodificar", 0.0)
+    full = MappedImage(input_path)
+    progress("decodificar", 1.0)
+
+    strip_rows = max(16, memory_budget_mb * 1024 * 1024 // (width * STRIP_BYTES_PER_PIXEL))
+    preview_scale = min(1.0, LARGE_PREVIEW_SIDE / max(width, height))
+    preview_width = max(1, round(width * preview_scale))
+    preview_parts = []
+
+    strips_started = time.perf_counter()
+    writer = PngStreamWriter(output_path, width, height, compress_level)
+    try:
+        for y0 in range(0, height, strip_rows):
+            progress("guardar", y0 / height)
+            y1 = min(height, y0 + strip_rows)
+            strip = full.rows(y0, y1)
+            if use_matting:
+                guide = cv2.cvtColor(strip, cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+                alpha = _resize_rows(mean_a, width, height, y0, y1) * guide
+                alpha += _resize_rows(mean_b, width, height, y0, y1)
+                del guide
+                known = _nearest_rows(trimap, width, height, y0, y1)
+                alpha[known == 255] = 1.0
+                alpha[known == 0] = 0.0
+            else:
+                alpha = _resize_rows(mask_small, width, height, y0, y1)
+
+            rgba = np.empty((y1 - y0, width, 4), dtype=np.uint8)
+            rgba[..., :3] = strip
+            rgba[..., 3] = np.clip(alpha * 255 + 0.5, 0, 255)
+            del strip, alpha
+            writer.write_rows(rgba)
+            full.release()
+
+            preview_rows = round(y1 * preview_scale) - round(y0 * preview_scale)
+            if preview_rows > 0:
+                preview_parts.append(cv2.resize(rgba, (preview_width, preview_rows), interpolation=cv2.INTER_AREA))
+            del rgba
+    except BaseException:
+        writer.abort()
+        full.close()
+        raise
+    writer.close()
+    full.close()
+    written = os.path.getsize(output_path)
+    METRICS.log(tramo="franjas", ms=round((time.perf_counter() - strips_started) * 1000, 2),
+                pixeles=width * height, filas_por_franja=strip_rows, bytes=written)
+    if fmt == "png":
+        METRICS.count("bytes_escritos", written)
+    else:
+        try:
+            with Image.open(output_path) as streamed:
+                save_image(streamed, final_path, compress_level)
+        finally:
+            os.remove(output_path)
+    progress("guardar", 1.0)
+
+    return Image.fromarray(np.vstack(preview_parts), mode="RGBA")
+
+# --- Caché de resultados ---
+RESULT_CACHE_DIR = os.path.join(CACHE_DIR, "results")
+
+class ResultCache:
+    """
+    Caché en disco de resultados ya procesados.
+
+    La clave es el SHA-256 de los bytes de entrada junto con el modelo y las
+    opciones de recorte. Solo se guarda la máscara alfa comprimida en PNG;
+    al acertar, el recorte se reconstruye con los píxeles originales sin
+    pasar por el modelo. Al superar `max_bytes` se borran las entradas
+    usadas hace más tiempo (la fecha de modificación marca el último uso).
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._total = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data, model_name, options):
+        digest = hashlib.sha256(data)
+        digest.update(model_name.encode("utf-8"))
+        digest.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            alpha = Image.open(path)
+            alpha.load()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return alpha
+
+    def put(self, key, alpha):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        alpha.save(tmp_path, format="PNG", optimize=True)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_size()
+            else:
+                self._total += size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        for folder, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".png"):
+                    try:
+                        stat = os.stat(os.path.join(folder, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(folder, name)))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self._total = total
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total = 0
+
+RESULTS = ResultCache(max_bytes=int(os.getenv("EFI_RESULT_CACHE_MB", "256")) * 1024 * 1024)
+
+def rebuild_cutout(img, alpha):
+    cutout = img.convert("RGB")
+    cutout.putalpha(alpha)
+    return cutout
+
+def cutout_from_cache(cache, data, model_name, options):
+    """Devuelve (clave, recorte o None) consultando la caché con los bytes de entrada."""
+    if cache is None:
+        return None, None
+    key = cache.key(data, model_name, options)
+    alpha = cache.get(key)
+    if alpha is None:
+        METRICS.count("cache_fallos")
+        return key, None
+    METRICS.count("cache_aciertos")
+    return key, rebuild_cutout(decode_image(data), alpha)
+
+def avif_available():
+    """AVIF llega con Pillow 11.2+ o con el complemento pillow-avif-plugin."""
+    if ".avif" not in Image.registered_extensions():
+        try:
+            import pillow_avif  # noqa: F401 (registra el formato en Pillow)
+        except ImportError:
+            return False
+    return ".avif" in Image.registered_extensions()
+
+def output_format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in OUTPUT_FORMATS else "png"
+
+def encode_image(img, fp, fmt="png", compress_level=PNG_COMPRESS_LEVEL, quality=None):
+    """
+    Codifica el recorte RGBA. PNG usa `compress_level` (0 rápido … 9
+    pequeño). WebP es sin pérdida, con un esfuerzo que sigue a
+    `compress_level`, salvo que se indique `quality`; AVIF usa `quality`
+    (80 por defecto). El alfa se conserva en los tres.
+    """
+    with METRICS.span("guardar", formato=fmt, pixeles=img.width * img.height) as span:
+        _encode_image(img, fp, fmt, compress_level, quality)
+        span["bytes"] = fp.tell() if hasattr(fp, "tell") else os.path.getsize(fp)
+    METRICS.count("bytes_escritos", span["bytes"])
+
+def _encode_image(img, fp, fmt, compress_level, quality):
+    if fmt == "png":
+        img.save(fp, format="PNG", compress_level=compress_level)
+    elif fmt == "webp":
+        if max(img.size) > WEBP_MAX_SIDE:
+            raise ValueError(f"WebP admite como máximo {WEBP_MAX_SIDE} px por lado; usa PNG")
+        if quality is None:
+            img.save(fp, format="WEBP", lossless=True, quality=max(10, compress_level * 10), method=4)
+        else:
+            img.save(fp, format="WEBP", quality=quality, alpha_quality=100, method=4)
+    elif fmt == "avif":
+        if not avif_available():
+            raise ValueError("AVIF no está disponible: instala Pillow 11.2+ o pillow-avif-plugin")
+        img.save(fp, format="AVIF", quality=80 if quality is None else quality)
+    else:
+        raise ValueError(f"Formato de salida desconocido: {fmt}")
+
+def save_image(img, output_path, compress_level=PNG_COMPRESS_LEVEL, quality=None):
+    # Se escribe en un temporal para no dejar salidas a medias que luego se omitan
+    tmp_path = f"{output_path}.tmp"
+    try:
+        encode_image(img, tmp_path, output_format(output_path), compress_level, quality)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+def collect_inputs(patterns, output_dir=None, fmt="png"):
+    """
+    Expande carpetas y patrones glob en pares (entrada, salida).
+    Las salidas siguen la convención `<nombre>_sin_fondo.<formato>`.
+    """
+    jobs = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root_dir = pattern
+            paths = sorted(
+                os.path.join(folder, name)
+                for folder, _, names in os.walk(pattern)
+                for name in names
+            )
+        else:
+            root_dir = None
+            paths = sorted(glob.glob(pattern, recursive=True))
+
+        for path in paths:
+            if not path.lower().endswith(IMAGE_EXTENSIONS) or os.path.splitext(path)[0].endswith("_sin_fondo"):
+                continue
+            path = os.path.abspath(path)
+            if path in seen:
+                continue
+            seen.add(path)
+
+            base_name = f"{os.path.splitext(path)[0]}_sin_fondo.{fmt}"
+            if output_dir:
+                if root_dir:
+                    rel = os.path.relpath(base_name, os.path.abspath(root_dir))
+                else:
+                    rel = os.path.basename(base_name)
+                output_path = os.path.join(output_dir, rel)
+            else:
+                output_path = base_name
+            jobs.append((path, output_path))
+    return jobs
+
+STAGE_LABELS = {
+    "decodificar": "Decodificando",
+    "decodificar_completa": "Decodificando la imagen completa",
+    "inferencia": "Detectando el objeto",
+    "recorte": "Recortando",
+    "guardar": "Guardando",
+}
+
+class JobCancelled(Exception):
+    """El trabajo se canceló desde la interfaz."""
+
+class StageProgress:
+    """
+    Avance por etapas de un trabajo, para pasar como `progress`.
+
+    Cada llamada `progress(etapa, fracción)` actualiza esa etapa y emite
+    `emit(etapa, porcentaje, eta)` con el porcentaje global ponderado y los
+    segundos estimados hasta terminar (None mientras no hay datos). Si
+    `cancel` (un threading.Event) está activo lanza JobCancelled, así cada
+    llamada es también un punto de cancelación.
+    """
+
+    WEIGHTS = {"decodificar": 0.1, "inferencia": 0.4, "recorte": 0.4, "guardar": 0.1}
+    # Imágenes grandes: el filtro guiado y la compresión por franjas dominan
+    LARGE_WEIGHTS = {"inferencia": 0.15, "recorte": 0.15, "decodificar": 0.1, "guardar": 0.6}
+
+    def __init__(self, emit, cancel=None, weights=None, interval=0.1):
+        self.emit = emit
+        self.cancel = cancel
+        self.weights = dict(weights or self.WEIGHTS)
+        self.interval = interval
+        self.done = {stage: 0.0 for stage in self.weights}
+        self.started = time.perf_counter()
+        self._last = 0.0
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise JobCancelled()
+
+    def __call__(self, stage, fraction=1.0):
+        self.check()
+        with self._lock:
+            if stage in self.done:
+                self.done[stage] = max(self.done[stage], min(1.0, fraction))
+            total = sum(self.weights[s] * self.done[s] for s in self.weights) / sum(self.weights.values())
+            now = time.perf_counter()
+            # Inicio y fin de etapa siempre se emiten; los pasos intermedios, con límite
+            if 0.0 < fraction < 1.0 and now - self._last < self.interval:
+                return
+            self._last = now
+        elapsed = now - self.started
+        eta = elapsed * (1 - total) / total if total > 0.02 else None
+        self.emit(stage, total * 100, eta)
+
+def remove_background(data, model_name="u2net", options=REMOVE_OPTIONS, cache=RESULTS, predict=None,
+                      progress=None):
+    """
+    Núcleo sin interfaz: bytes de una imagen → recorte RGBA.
+
+    Consulta la caché de resultados, predice la máscara con `predict(img)`
+    (por defecto, el agrupador compartido del modelo) y aplica el recorte.
+    `progress(etapa, fracción)` recibe el avance de cada etapa.
+    """
+    progress = progress or (lambda stage, fraction=1.0: None)
+    key, result = cutout_from_cache(cache, data, model_name, options)
+    if result is not None:
+        for stage in ("decodificar", "inferencia", "recorte"):
+            progress(stage, 1.0)
+        return result
+    progress("decodificar", 0.0)
+    img, full_size = decode_reduced(data)
+    progress("decodificar", 1.0)
+    progress("inferencia", 0.0)
+    mask = (predict or get_batcher(model_name).predict)(img)
+    progress("inferencia", 1.0)
+    if img.size != full_size:
+        # La resolución completa solo hace falta para componer el recorte
+        progress("decodificar_completa", 0.0)
+        img = decode_image(data)
+        progress("decodificar_completa", 1.0)
+    progress("recorte", 0.0)
+    if mask.size != img.size:
+        mask = upscale_mask(mask, img.size)
+    result = apply_mask(img, mask, options, progress)
+    progress("recorte", 1.0)
+    if key is not None:
+        cache.put(key, result.getchannel("A"))
+    return result
+
+def proxy_cutout(source, model_name="u2net", predict=None, max_side=PROXY_SIDE):
+    """
+    Primera fase de la vista rápida: máscara sobre la imagen reducida y sin
+    matting. Devuelve (recorte reducido, máscara); la máscara se reutiliza
+    al refinar con `mask_predictor`, así la inferencia no se repite.
+    """
+    small = open_reduced(source, max_side)
+    mask = (predict or get_batcher(model_name).predict)(small)
+    small.putalpha(mask)
+    return small, mask
+
+def mask_predictor(mask):
+    """`predict` para `remove_background` que escala una máscara ya calculada."""
+    return lambda img: mask if mask.size == img.size else mask.resize(img.size, Image.LANCZOS)
+
+# --- Selección de área ---
+AREA_TILE = 256
+# Lado de la zona que se procesa alrededor de un punto
+AREA_POINT_SIDE = 512
+# Contexto extra alrededor de cada zona para que el modelo vea los bordes del objeto
+AREA_CONTEXT = 0.1
+
+class AreaCutout:
+    """
+    Recorte por zonas elegidas a mano sobre la imagen completa.
+
+    Cada zona se procesa recortada a resolución nativa (con un margen de
+    contexto) y su alfa se pega en el lienzo de la imagen entera. El lienzo
+    se divide en teselas de `AREA_TILE` px: al añadir, borrar o deshacer una
+    zona solo se recomponen las teselas que toca, y el alfa de cada zona ya
+    procesada se conserva, así que deshacer o repetir una zona no vuelve a
+    pasar por el modelo. Desde la interfaz las ediciones se piden con
+    `submit`, que las aplica de una en una y en el orden de los clics.
+    """
+
+    def __init__(self, image, model_name="u2net", options=REMOVE_OPTIONS, predict=None, tile=AREA_TILE):
+        self.image = image if image.mode == "RGB" else image.convert("RGB")
+        self.model_name = model_name
+        self.options = options
+        self.predict = predict or get_batcher(model_name).predict
+        self.tile = tile
+        self.alpha = np.zeros((self.image.height, self.image.width), dtype=np.uint8)
+        self.regions = []
+        self._crops = {}
+        self._lock = threading.Lock()
+        self._edits = queue.Queue()
+        self._editor = None
+
+    def submit(self, edit, done):
+        """
+        Encola `edit` (p. ej. `lambda: area.add(box)` o `area.undo`) en el
+        hilo de ediciones: con un solo hilo deshacer quita siempre la última
+        zona pedida aunque aún se esté calculando. `done` recibe la parte del
+        lienzo que cambió o la excepción.
+        """
+        if self._editor is None:
+            self._editor = threading.Thread(target=self._edit_loop, daemon=True)
+            self._editor.start()
+        self._edits.put((edit, done))
+
+    def _edit_loop(self):
+        while (item := self._edits.get()) is not None:
+            edit, done = item
+            try:
+                changed = edit()
+            except Exception as e:
+                changed = e
+            done(changed)
+
+    def close(self):
+        """Termina el hilo de ediciones cuando acaben las pendientes."""
+        if self._editor is not None:
+            self._edits.put(None)
+            self._editor = None
+
+    def clip(self, box):
+        x0, y0, x1, y1 = (round(v) for v in box)
+        x0, x1 = sorted((min(max(x0, 0), self.image.width), min(max(x1, 0), self.image.width)))
+        y0, y1 = sorted((min(max(y0, 0), self.image.height), min(max(y1, 0), self.image.height)))
+        return x0, y0, x1, y1
+
+    def point_box(self, x, y, side=AREA_POINT_SIDE):
+        return self.clip((x - side / 2, y - side / 2, x + side / 2, y + side / 2))
+
+    def _region_alpha(self, box):
+        """Alfa de la zona, calculado sobre el recorte con contexto; se guarda para reutilizarlo."""
+        alpha = self._crops.get(box)
+        if alpha is not None:
+            return alpha
+        x0, y0, x1, y1 = box
+        margin_x, margin_y = round((x1 - x0) * AREA_CONTEXT), round((y1 - y0) * AREA_CONTEXT)
+        cx0, cy0, cx1, cy1 = self.clip((x0 - margin_x, y0 - margin_y, x1 + margin_x, y1 + margin_y))
+        crop = self.image.crop((cx0, cy0, cx1, cy1))
+        cutout = apply_mask(crop, self.predict(crop), self.options)
+        alpha = np.asarray(cutout.getchannel("A"))[y0 - cy0:y1 - cy0, x0 - cx0:x1 - cx0].copy()
+        self._crops[box] = alpha
+        return alpha
+
+    def add(self, box, erase=False):
+        """Añade una zona (o la borra con `erase`); devuelve la parte del lienzo que cambió."""
+        box = self.clip(box)
+        if box[2] - box[0] < 2 or box[3] - box[1] < 2:
+            return None
+        if not erase:
+            with METRICS.span("zona", pixeles=(box[2] - box[0]) * (box[3] - box[1])):
+                self._region_alpha(box)
+        with self._lock:
+            self.regions.append((box, erase))
+            return self._recompose(box)
+
+    def undo(self):
+        with self._lock:
+            if not self.regions:
+                return None
+            box, _ = self.regions.pop()
+            return self._recompose(box)
+
+    def clear(self):
+        with self._lock:
+            self.regions = []
+            self.alpha[:] = 0
+            return 0, 0, self.image.width, self.image.height
+
+    def _recompose(self, box):
+        """Rehace solo las teselas que toca `box` aplicando las zonas en orden."""
+        t = self.tile
+        area = (
+            box[0] // t * t, box[1] // t * t,
+            min(self.image.width, -(-box[2] // t) * t), min(self.image.height, -(-box[3] // t) * t),
+        )
+        ax0, ay0, ax1, ay1 = area
+        canvas = np.zeros((ay1 - ay0, ax1 - ax0), dtype=np.uint8)
+        for (x0, y0, x1, y1), erase in self.regions:
+            ix0, iy0, ix1, iy1 = max(x0, ax0), max(y0, ay0), min(x1, ax1), min(y1, ay1)
+            if ix0 >= ix1 or iy0 >= iy1:
+                continue
+            target = canvas[iy0 - ay0:iy1 - ay0, ix0 - ax0:ix1 - ax0]
+            if erase:
+                target[:] = 0
+            else:
+                alpha = self._crops[(x0, y0, x1, y1)]
+                np.maximum(target, alpha[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0], out=target)
+        self.alpha[ay0:ay1, ax0:ax1] = canvas
+        return area
+
+    def alpha_region(self, box):
+        x0, y0, x1, y1 = box
+        with self._lock:
+            return self.alpha[y0:y1, x0:x1].copy()
+
+    def result(self):
+        with self._lock:
+            return rebuild_cutout(self.image, Image.fromarray(self.alpha))
+
+def _process_file(job, model_name, options, intra_op_threads, use_cache,
+                  large_pixels=LARGE_IMAGE_PIXELS, memory_budget_mb=LARGE_IMAGE_BUDGET_MB,
+                  compress_level=PNG_COMPRESS_LEVEL, quality=None):
+    """Cadena completa para un archivo; se usa en los procesos de trabajo."""
+    input_path, output_path = job
+    with profile_job(os.path.splitext(os.path.basename(input_path))[0]):
+        pixels = image_pixels(input_path)
+        if pixels > large_pixels:
+            process_large_image(input_path, output_path, model_name, options, memory_budget_mb, compress_level)
+            return pixels
+        with open(input_path, "rb") as f:
+            data = f.read()
+        session_options = {"intra_op_num_threads": intra_op_threads} if intra_op_threads else {}
+        result = remove_background(
+            data, model_name, options, RESULTS if use_cache else None,
+            predict=lambda img: predict_mask(SESSIONS.get(model_name, **session_options), img),
+        )
+        save_image(result, output_path, compress_level, quality)
+        return result.width * result.height
+
+# --- Procesos con pesos compartidos ---
+def _shared_worker(conn, model_name, options, session_options, use_cache, memory_budget_mb, compress_level):
+    """
+    Bucle de un proceso de `SharedWorkers`. La imagen llega y el recorte sale
+    por memoria compartida; por la tubería solo pasan rutas, nombres y tamaños.
+    """
+    # Ctrl+C lo atiende el proceso principal, que cierra los procesos al terminar
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    segments = {}
+
+    def attach(role, name):
+        segment = segments.get(role)
+        if segment is None or segment.name != name:
+            if segment is not None:
+                segment.close()
+            segment = segments[role] = shared_memory.SharedMemory(name=name)
+        return segment
+
+    session = SESSIONS.get(model_name, **session_options)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        input_path, output_path, input_name, input_size, output_name = task
+        try:
+            with profile_job(os.path.splitext(os.path.basename(input_path))[0]):
+                if output_name is None:
+                    # Las imágenes grandes se escriben por franjas desde aquí
+                    process_large_image(input_path, output_path, model_name, options, memory_budget_mb, compress_level)
+                    conn.send(("ok", None))
+                    continue
+                data = bytes(attach("entrada", input_name).buf[:input_size])
+                result = remove_background(
+                    data, model_name, options, RESULTS if use_cache else None,
+                    predict=lambda img: predict_mask(session, img),
+                )
+                output = attach("salida", output_name)
+                np.ndarray((result.height, result.width, 4), np.uint8, output.buf)[:] = np.asarray(result)
+                conn.send(("ok", result.size))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    for segment in segments.values():
+        segment.close()
+
+class SharedWorkers:
+    """
+    Procesos de trabajo que comparten una sola copia de los pesos del modelo.
+
+    Los pesos se guardan aparte y alineados (`export_shared_model`) y cada
+    proceso los mapea desde la caché de páginas del sistema. Donde hay `fork`
+    el modelo se carga aquí una vez y los procesos se crean después,
+    heredando la sesión ya preparada; con varios hilos de onnxruntime por
+    proceso, o en Windows, se usa `spawn` y cada uno abre su sesión sobre el
+    mismo archivo mapeado. La imagen de entrada y el recorte RGBA pasan por
+    memoria compartida (un par de segmentos por proceso) sin serializarse.
+
+    Con `shared=False` cada proceso carga su propia copia, como `--processes`;
+    sirve de referencia en `benchmark_workers`.
+    """
+
+    def __init__(self, processes, model_name="u2net", options=REMOVE_OPTIONS, intra_op_threads=1,
+                 use_cache=True, large_pixels=LARGE_IMAGE_PIXELS, memory_budget_mb=LARGE_IMAGE_BUDGET_MB,
+                 compress_level=PNG_COMPRESS_LEVEL, quality=None, shared=True):
+        self.processes = max(1, processes)
+        self.model_name = model_name
+        self.options = options
+        self.use_cache = use_cache
+        self.large_pixels = large_pixels
+        self.memory_budget_mb = memory_budget_mb
+        self.compress_level = compress_level
+        self.quality = quality
+        self.session_options = {"intra_op_num_threads": max(1, intra_op_threads), "shared_weights": shared}
+        # Sin hilos propios de onnxruntime la sesión se puede heredar con fork
+        self.forking = shared and intra_op_threads <= 1 and "fork" in get_all_start_methods()
+        self.workers = []
+
+    def start(self):
+        if self.forking:
+            session = SESSIONS.get(self.model_name, **self.session_options)
+            # Arenas y planes de memoria listos antes de copiar el proceso
+            predict_mask(session, Image.new("RGB", (64, 64)))
+            gc.freeze()
+        elif self.session_options["shared_weights"]:
+            ensure_shared_model(self.model_name, SESSIONS._config(None, self.session_options))
+        if os.name == "posix":
+            # Un único registro de segmentos para todos: si cada proceso tuviera
+            # el suyo, al terminar borraría los segmentos que solo ha abierto
+            resource_tracker.ensure_running()
+        ctx = get_context("fork" if self.forking else "spawn")
+        for _ in range(self.processes):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_shared_worker, daemon=True,
+                args=(child_conn, self.model_name, self.options, self.session_options,
+                      self.use_cache, self.memory_budget_mb, self.compress_level),
+            )
+            process.start()
+            child_conn.close()
+            self.workers.append((process, conn))
+        return self
+
+    def close(self):
+        for process, conn in self.workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process, conn in self.workers:
+            process.join(timeout=10)
+            conn.close()
+        self.workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, jobs, on_done):
+        """Reparte los pares (entrada, salida); llama a `on_done(job, píxeles, error)` por cada uno."""
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        for _ in self.workers:
+            pending.put(None)
+        for thread in self.feed(pending, on_done):
+            thread.join()
+
+    def feed(self, pending, on_done):
+        """
+        Arranca un hilo por proceso que toma trabajos de la cola `pending`
+        hasta encontrar un None (hace falta uno por proceso).
+        """
+        threads = [
+            threading.Thread(target=self._feed, args=(conn, pending, on_done), daemon=True)
+            for _, conn in self.workers
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _feed(self, conn, pending, on_done):
+        """Un hilo por proceso: le pasa trabajos y guarda sus recortes."""
+        slot = {}
+        try:
+            while True:
+                job = pending.get()
+                if job is None:
+                    return
+                try:
+                    pixels = self._process(conn, slot, job)
+                except Exception as e:
+                    on_done(job, 0, e)
+                else:
+                    on_done(job, pixels, None)
+        finally:
+            for segment in slot.values():
+                segment.close()
+                segment.unlink()
+
+    @staticmethod
+    def _segment(slot, role, size):
+        # Los segmentos se reutilizan entre imágenes y solo crecen cuando no caben
+        segment = slot.get(role)
+        if segment is None or segment.size < size:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+            segment = slot[role] = shared_memory.SharedMemory(create=True, size=max(1, size + size // 4))
+        return segment
+
+    def _process(self, conn, slot, job):
+        input_path, output_path = job
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        pixels = image_pixels(input_path)
+        if pixels > self.large_pixels:
+            conn.send((input_path, output_path, None, 0, None))
+            self._reply(conn)
+            return pixels
+
+        with open(input_path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            source = self._segment(slot, "entrada", size)
+            with source.buf[:size] as view:
+                f.readinto(view)
+        # La salida RGBA se dimensiona con la cabecera (girar por EXIF no cambia los píxeles)
+        output = self._segment(slot, "salida", pixels * 4)
+        conn.send((input_path, output_path, source.name, size, output.name))
+        width, height = self._reply(conn)
+
+        with output.buf[:width * height * 4] as view:
+            image = Image.frombuffer("RGBA", (width, height), view, "raw", "RGBA", 0, 1)
+            save_image(image, output_path, self.compress_level, self.quality)
+            del image
+        return pixels
+
+    @staticmethod
+    def _reply(conn):
+        status, value = conn.recv()
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+class BatchPipeline:
+    """
+    Procesa lotes de imágenes encadenando decodificar → inferencia →
+    recorte → guardar. Cada etapa tiene sus propios hilos y las colas entre
+    etapas están acotadas, así la memoria no crece con el tamaño del lote.
+
+    Con `processes` > 0 la cadena completa de cada archivo se reparte entre
+    procesos, cada uno con su propia sesión del modelo; con `shared_weights`
+    los procesos comparten los pesos (`SharedWorkers`).
+    """
+
+    STAGES = ("decodificar", "inferencia", "recorte", "guardar")
+
+    def __init__(self, model_name="u2net", io_workers=4, infer_workers=1,
+                 matte_workers=2, intra_op_threads=0, processes=0,
+                 options=REMOVE_OPTIONS, queue_size=8, batch_size=1, max_latency=0.02,
+                 cache=RESULTS, large_pixels=LARGE_IMAGE_PIXELS,
+                 memory_budget_mb=LARGE_IMAGE_BUDGET_MB, compress_level=PNG_COMPRESS_LEVEL,
+                 quality=None, shared_weights=False):
+        self.model_name = model_name
+        self.shared_weights = shared_weights
+        self.compress_level = compress_level
+        self.quality = quality
+        self.cache = cache
+        self.large_pixels = large_pixels
+        self.memory_budget_mb = memory_budget_mb
+        # Las imágenes grandes se procesan de una en una para respetar el presupuesto
+        self._large_lock = threading.Lock()
+        self.io_workers = max(1, io_workers)
+        # Con lotes, cada hilo de inferencia espera una imagen del lote
+        self.infer_workers = max(1, infer_workers, batch_size)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.matte_workers = max(1, matte_workers)
+        self.intra_op_threads = intra_op_threads
+        self.processes = processes
+        self.options = options
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+
+    def _reset_stats(self):
+        self.stats = {
+            "procesadas": 0,
+            "omitidas": 0,
+            "errores": [],
+            "pixeles": 0,
+            "etapas": {stage: 0.0 for stage in self.STAGES},
+        }
+
+    def _record(self, stage, elapsed):
+        with self._lock:
+            self.stats["etapas"][stage] += elapsed
+
+    def _fail(self, item, error):
+        with self._lock:
+            self.stats["errores"].append((item["input"], str(error)))
+
+    def _stage(self, name, func, inbox, outbox, workers):
+        """Lanza los hilos de una etapa; al terminar propaga el fin a la siguiente."""
+        def worker():
+            while True:
+                item = inbox.get()
+                if item is None:
+                    break
+                start = time.perf_counter()
+                try:
+                    func(item)
+                except Exception as e:
+                    self._fail(item, e)
+                    continue
+                finally:
+                    self._record(name, time.perf_counter() - start)
+                if outbox is not None:
+                    outbox.put(item)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def _decode(self, item):
+        item["large"] = image_pixels(item["input"]) > self.large_pixels
+        if item["large"]:
+            item["key"], item["result"] = None, None
+            return
+        with open(item["input"], "rb") as f:
+            data = f.read()
+        item["key"], item["result"] = cutout_from_cache(self.cache, data, self.model_name, self.options)
+        if item["result"] is None:
+            item["image"], full_size = decode_reduced(data)
+            # Entre etapas viaja el archivo codificado, no la imagen completa
+            if item["image"].size != full_size:
+                item["data"] = data
+
+    def _infer(self, item):
+        # Los aciertos de caché y las imágenes grandes atraviesan estas etapas sin más
+        if item["result"] is not None or item["large"]:
+            return
+        if self.batcher is not None:
+            item["mask"] = self.batcher.predict(item["image"])
+        else:
+            item["mask"] = predict_mask(self.session, item["image"])
+
+    def _matte(self, item):
+        if item["result"] is not None or item["large"]:
+            return
+        img, mask = item.pop("image"), item.pop("mask")
+        if "data" in item:
+            img = decode_image(item.pop("data"))
+            mask = upscale_mask(mask, img.size)
+        item["result"] = apply_mask(img, mask, self.options)
+        if item["key"] is not None:
+            self.cache.put(item["key"], item["result"].getchannel("A"))
+
+    def _encode(self, item):
+        os.makedirs(os.path.dirname(item["output"]) or ".", exist_ok=True)
+        if item["large"]:
+            with self._large_lock:
+                process_large_image(
+                    item["input"], item["output"], self.model_name, self.options,
+                    self.memory_budget_mb, self.compress_level
+                )
+            pixels = image_pixels(item["input"])
+        else:
+            result = item.pop("result")
+            save_image(result, item["output"], self.compress_level, self.quality)
+            pixels = result.width * result.height
+        with self._lock:
+            self.stats["procesadas"] += 1
+            self.stats["pixeles"] += pixels
+
+    def _run_threads(self, jobs):
+        session_options = {"intra_op_num_threads": self.intra_op_threads} if self.intra_op_threads else {}
+        self.session = SESSIONS.get(self.model_name, **session_options)
+        self.batcher = None
+        if self.batch_size > 1:
+            self.batcher = MicroBatcher(
+                self.model_name, self.batch_size, self.max_latency, session_options
+            )
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.STAGES]
+        plan = [
+            ("decodificar", self._decode, self.io_workers),
+            ("inferencia", self._infer, self.infer_workers),
+            ("recorte", self._matte, self.matte_workers),
+            ("guardar", self._encode, self.io_workers),
+        ]
+        stages = []
+        for i, (name, func, workers) in enumerate(plan):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            stages.append((self._stage(name, func, queues[i], outbox, workers), outbox))
+
+        for input_path, output_path in jobs:
+            queues[0].put({"input": input_path, "output": output_path})
+
+        # Fin de lote: cada etapa avisa a la siguiente cuando todos sus hilos terminan
+        for _ in range(self.io_workers):
+            queues[0].put(None)
+        for i, (threads, outbox) in enumerate(stages):
+            for t in threads:
+                t.join()
+            if outbox is not None:
+                for _ in range(plan[i + 1][2]):
+                    outbox.put(None)
+        if self.batcher is not None:
+            self.batcher.close()
+
+    def _run_shared(self, jobs):
+        def done(job, pixels, error):
+            if error is not None:
+                self._fail({"input": job[0]}, error)
+                return
+            with self._lock:
+                self.stats["procesadas"] += 1
+                self.stats["pixeles"] += pixels
+
+        with SharedWorkers(
+            self.processes, self.model_name, self.options, self.intra_op_threads,
+            self.cache is not None, self.large_pixels, self.memory_budget_mb,
+            self.compress_level, self.quality,
+        ) as workers:
+            workers.run(jobs, done)
+
+    def _run_processes(self, jobs):
+        if self.shared_weights:
+            return self._run_shared(jobs)
+        # "spawn" evita heredar los hilos de onnxruntime del proceso principal
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=get_context("spawn")) as pool:
+            futures = {}
+            for job in jobs:
+                os.makedirs(os.path.dirname(job[1]) or ".", exist_ok=True)
+                future = pool.submit(
+                    _process_file, job, self.model_name, self.options,
+                    self.intra_op_threads, self.cache is not None,
+                    self.large_pixels, self.memory_budget_mb, self.compress_level, self.quality
+                )
+                futures[future] = job
+            for future in as_completed(futures):
+                try:
+                    pixels = future.result()
+                except Exception as e:
+                    self._fail({"input": futures[future][0]}, e)
+                    continue
+                self.stats["procesadas"] += 1
+                self.stats["pixeles"] += pixels
+
+    def run(self, jobs, overwrite=False):
+        """Procesa los pares (entrada, salida) y devuelve las estadísticas."""
+        self._reset_stats()
+        pending = []
+        for job in jobs:
+            if not overwrite and os.path.exists(job[1]):
+                self.stats["omitidas"] += 1
+            else:
+                pending.append(job)
+
+        start = time.perf_counter()
+        if pending:
+            if self.processes > 0:
+                self._run_processes(pending)
+            else:
+                self._run_threads(pending)
+        self.stats["tiempo"] = time.perf_counter() - start
+        return self.stats
+
+def format_batch_summary(stats):
+    elapsed = max(stats["tiempo"], 1e-9)
+    lines = [
+        f"Procesadas: {stats['procesadas']}  Omitidas: {stats['omitidas']}  "
+        f"Errores: {len(stats['errores'])}",
+        f"Tiempo total: {stats['tiempo']:.1f}s  |  {stats['procesadas'] / elapsed:.2f} img/s  |  "
+        f"{stats['pixeles'] / 1e6 / elapsed:.1f} MP/s",
+    ]
+    busy = [f"{name} {secs:.1f}s" for name, secs in stats["etapas"].items() if secs]
+    if busy:
+        lines.append("Tiempo por etapa (suma de hilos): " + ", ".join(busy))
+    for path, error in stats["errores"]:
+        lines.append(f"  Error en {path}: {error}")
+    return "\n".join(lines)
+
+# --- Vídeo y secuencias ---
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+# La máscara de vídeo se calcula al tamaño con el que trabaja u2net
+VIDEO_MASK_SIDE = 320
+# OpenCV no escribe canal alfa: los vídeos transparentes se codifican con ffmpeg
+ALPHA_VIDEO_CODECS = {
+    ".webm": ["-c:v", "libvpx-vp9", "-pix_fmt", "yuva420p", "-auto-alt-ref", "0"],
+    ".mov": ["-c:v", "prores_ks", "-profile:v", "4444", "-pix_fmt", "yuva444p10le"],
+}
+OPAQUE_VIDEO_FOURCC = {".mp4": "mp4v", ".m4v": "mp4v", ".mov": "mp4v", ".avi": "MJPG", ".mkv": "XVID"}
+
+def sequence_inputs(source):
+    """Fotogramas de una carpeta o de un patrón glob, en orden de nombre."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+class VideoOutput:
+    """
+    Escribe fotogramas RGBA en orden. Con `background` se compone sobre ese
+    color y OpenCV genera un vídeo opaco; si no, `.webm`/`.mov` conservan el
+    alfa pasando los fotogramas a ffmpeg por una tubería.
+    """
+
+    def __init__(self, path, fps, size, background=None):
+        ext = os.path.splitext(path)[1].lower()
+        self.background = background
+        self._process = self._writer = None
+        ffmpeg = self.check(path, background)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if background is not None:
+            fourcc = cv2.VideoWriter_fourcc(*OPAQUE_VIDEO_FOURCC.get(ext, "mp4v"))
+            self._writer = cv2.VideoWriter(path, fourcc, fps, size)
+            if not self._writer.isOpened():
+                raise ValueError(f"OpenCV no puede escribir {ext}")
+            return
+        import subprocess
+
+        self._process = subprocess.Popen(
+            [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgba",
+             "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+             *ALPHA_VIDEO_CODECS[ext], path],
+            stdin=subprocess.PIPE,
+        )
+
+    @staticmethod
+    def check(path, background=None):
+        """Comprueba antes de empezar que la salida se puede escribir; devuelve la ruta de ffmpeg."""
+        if background is not None:
+            return None
+        if os.path.splitext(path)[1].lower() not in ALPHA_VIDEO_CODECS:
+            raise ValueError(
+                "Para vídeo transparente usa .webm o .mov; con --background se admite cualquier formato"
+            )
+        ffmpeg = shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise ValueError(
+                "El vídeo transparente necesita ffmpeg en el PATH; usa una carpeta de salida "
+                "(secuencia PNG) o --background para un vídeo opaco"
+            )
+        return ffmpeg
+
+    def write(self, rgba):
+        if self._writer is not None:
+            alpha = rgba[..., 3:4].astype(np.float32) / 255.0
+            rgb = rgba[..., :3] * alpha + np.float32(self.background) * (1.0 - alpha)
+            self._writer.write(cv2.cvtColor(rgb.astype(np.uint8), cv2.COLOR_RGB2BGR))
+        else:
+            self._process.stdin.write(np.ascontiguousarray(rgba).tobytes())
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+        elif self._process is not None:
+            self._process.stdin.close()
+            if self._process.wait():
+                raise RuntimeError(f"ffmpeg terminó con código {self._process.returncode}")
+
+class SequencePipeline:
+    """
+    Quita el fondo de un vídeo o de una secuencia de imágenes.
+
+    Lectura → máscara → recorte → guardar, cada etapa en sus propios hilos.
+    La máscara se calcula en orden sobre el fotograma reducido y solo cuando
+    el contenido cambia: si el fotograma apenas difiere del último inferido
+    (`change_threshold`, en niveles de gris) la máscara anterior se arrastra
+    con flujo óptico, hasta `max_reuse` fotogramas seguidos. Las máscaras
+    nuevas se mezclan con la anterior (`smoothing`) para evitar parpadeos,
+    salvo en los cortes de escena (`cut_threshold`). Nunca hay más de
+    `max_frames` fotogramas en memoria.
+    """
+
+    STAGES = ("decodificar", "inferencia", "recorte", "guardar")
+
+    def __init__(self, model_name="u2net", options=None, matte_workers=2, max_frames=16,
+                 change_threshold=1.5, max_reuse=4, cut_threshold=20.0, smoothing=0.6,
+                 background=None, fps=None, fmt="png", compress_level=PNG_COMPRESS_LEVEL):
+        self.model_name = model_name
+        self.options = options or matting_options("mask")
+        self.matte_workers = max(1, matte_workers)
+        self.max_frames = max(2, max_frames)
+        self.change_threshold = change_threshold
+        self.max_reuse = max_reuse
+        self.cut_threshold = cut_threshold
+        self.smoothing = smoothing
+        self.background = background
+        self.fps = fps
+        self.fmt = fmt
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+
+    def _record(self, stage, elapsed):
+        with self._lock:
+            self.stats["etapas"][stage] += elapsed
+
+    def _read(self, source):
+        """Genera los fotogramas RGB de un vídeo o de una lista de imágenes."""
+        if isinstance(source, str):
+            capture = cv2.VideoCapture(source)
+            if not capture.isOpened():
+                raise ValueError(f"No se pudo abrir el vídeo {source}")
+            self.fps = self.fps or capture.get(cv2.CAP_PROP_FPS) or 25.0
+            try:
+                while True:
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                    yield cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            finally:
+                capture.release()
+        self.fps = self.fps or 25.0
+        for path in source:
+            img = decode_image(path)
+            yield np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+
+    def _reset_mask_state(self):
+        self._key_gray = self._key_mask = self._last_mask = self._grid = None
+        self._frame_shape = None
+        self._since_key = 0
+
+    def _mask(self, rgb):
+        """Máscara reducida (float32, 0-1) del fotograma con reutilización temporal."""
+        height, width = rgb.shape[:2]
+        # La máscara anterior, el flujo y el vídeo de salida suponen un tamaño fijo
+        if self._frame_shape is None:
+            self._frame_shape = (height, width)
+        elif self._frame_shape != (height, width):
+            raise ValueError(
+                f"Fotograma de {width}x{height}: la secuencia debe tener el tamaño del primero "
+                f"({self._frame_shape[1]}x{self._frame_shape[0]})"
+            )
+        scale = VIDEO_MASK_SIDE / max(width, height)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        small = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        change = float("inf") if self._key_gray is None else float(cv2.absdiff(gray, self._key_gray).mean())
+
+        if change < self.change_threshold and self._since_key < self.max_reuse:
+            # Flujo (a media resolución) del fotograma actual hacia el de referencia:
+            # la máscara de referencia se muestrea desplazada
+            flow = cv2.calcOpticalFlowFarneback(
+                cv2.pyrDown(gray), cv2.pyrDown(self._key_gray), None, 0.5, 2, 15, 2, 5, 1.1, 0
+            )
+            flow = cv2.resize(flow, size, interpolation=cv2.INTER_LINEAR) * 2
+            if self._grid is None or self._grid[0].shape != gray.shape:
+                self._grid = np.meshgrid(np.arange(size[0], dtype=np.float32), np.arange(size[1], dtype=np.float32))
+            mask = cv2.remap(self._key_mask, self._grid[0] + flow[..., 0], self._grid[1] + flow[..., 1],
+                             cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+            self._since_key += 1
+            self.stats["reutilizadas"] += 1
+        else:
+            mask = np.asarray(predict_mask(self.session, Image.fromarray(small)), dtype=np.float32) / 255.0
+            if self._last_mask is not None and change < self.cut_threshold:
+                mask = self.smoothing * mask + (1.0 - self.smoothing) * self._last_mask
+            self._key_gray, self._key_mask, self._since_key = gray, mask, 0
+            self.stats["inferidas"] += 1
+        self._last_mask = mask
+        return mask
+
+    def _matte(self, rgb, mask):
+        height, width = rgb.shape[:2]
+        alpha = cv2.resize(mask, (width, height), interpolation=cv2.INTER_LINEAR)
+        alpha = np.clip(alpha * 255 + 0.5, 0, 255).astype(np.uint8)
+        if self.options.get("alpha_matting"):
+            return np.asarray(apply_mask(Image.fromarray(rgb), Image.fromarray(alpha), self.options))
+        rgba = np.empty((height, width, 4), dtype=np.uint8)
+        rgba[..., :3] = rgb
+        rgba[..., 3] = alpha
+        return rgba
+
+    def run(self, source, output):
+        """
+        `source` es la ruta de un vídeo o una lista de imágenes; `output`, un
+        archivo de vídeo o una carpeta para la secuencia de imágenes.
+        """
+        self.stats = {
+            "fotogramas": 0, "inferidas": 0, "reutilizadas": 0, "errores": [],
+            "etapas": {stage: 0.0 for stage in self.STAGES},
+        }
+        self.session = SESSIONS.get(self.model_name)
+        self._reset_mask_state()
+        as_video = os.path.splitext(output)[1].lower() in VIDEO_EXTENSIONS
+        if not as_video:
+            os.makedirs(output, exist_ok=True)
+
+        # Cada fotograma ocupa un hueco desde que se lee hasta que se escribe
+        slots = threading.Semaphore(self.max_frames)
+        stop = threading.Event()
+        to_mask, to_matte, to_write = queue.Queue(), queue.Queue(), queue.Queue()
+
+        def fail(error):
+            with self._lock:
+                self.stats["errores"].append(str(error))
+            stop.set()
+
+        def reader():
+            try:
+                frames = self._read(source)
+                while not stop.is_set():
+                    # Con tiempo límite para enterarse de `stop` aunque no se libere ningún hueco
+                    if not slots.acquire(timeout=0.5):
+                        continue
+                    start = time.perf_counter()
+                    rgb = next(frames, None)
+                    self._record("decodificar", time.perf_counter() - start)
+                    if rgb is None or stop.is_set():
+                        slots.release()
+                        break
+                    to_mask.put((self.stats["fotogramas"], rgb))
+                    self.stats["fotogramas"] += 1
+            except Exception as e:
+                fail(e)
+            to_mask.put(None)
+
+        def masker():
+            while (item := to_mask.get()) is not None:
+                if stop.is_set():
+                    slots.release()
+                    continue
+                index, rgb = item
+                start = time.perf_counter()
+                try:
+                    to_matte.put((index, rgb, self._mask(rgb)))
+                except Exception as e:
+                    slots.release()
+                    fail(e)
+                self._record("inferencia", time.perf_counter() - start)
+            for _ in range(self.matte_workers):
+                to_matte.put(None)
+
+        def matter():
+            while (item := to_matte.get()) is not None:
+                index, rgb, mask = item
+                if stop.is_set():
+                    slots.release()
+                    continue
+                start = time.perf_counter()
+                try:
+                    rgba = self._matte(rgb, mask)
+                    self._record("recorte", time.perf_counter() - start)
+                    if as_video:
+                        to_write.put((index, rgba))
+                        continue
+                    # La secuencia se guarda en paralelo: cada fotograma es su propio archivo
+                    start = time.perf_counter()
+                    path = os.path.join(output, f"{index:06d}.{self.fmt}")
+                    save_image(Image.fromarray(rgba), path, self.compress_level)
+                    self._record("guardar", time.perf_counter() - start)
+                except Exception as e:
+                    fail(e)
+                slots.release()
+            to_write.put(None)
+
+        def writer():
+            # Los hilos de recorte terminan en cualquier orden; el vídeo se escribe en orden
+            pending, next_index, finished, video = {}, 0, 0, None
+            try:
+                while finished < self.matte_workers:
+                    item = to_write.get()
+                    if item is None:
+                        finished += 1
+                        continue
+                    pending[item[0]] = item[1]
+                    while next_index in pending:
+                        rgba = pending.pop(next_index)
+                        next_index += 1
+                        try:
+                            if not stop.is_set():
+                                start = time.perf_counter()
+                                if video is None:
+                                    video = VideoOutput(output, self.fps, (rgba.shape[1], rgba.shape[0]), self.background)
+                                video.write(rgba)
+                                self._record("guardar", time.perf_counter() - start)
+                        finally:
+                            slots.release()
+            except Exception as e:
+                fail(e)
+                # Los fotogramas retenidos y los que sigan llegando liberan su hueco
+                # para que las otras etapas no se bloqueen
+                for _ in pending:
+                    slots.release()
+                pending.clear()
+                while finished < self.matte_workers:
+                    if to_write.get() is None:
+                        finished += 1
+                    else:
+                        slots.release()
+            finally:
+                if video is not None:
+                    try:
+                        video.close()
+                    except Exception as e:
+                        fail(e)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=reader, daemon=True), threading.Thread(target=masker, daemon=True)]
+        threads += [threading.Thread(target=matter, daemon=True) for _ in range(self.matte_workers)]
+        if as_video:
+            threads.append(threading.Thread(target=writer, daemon=True))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.stats["tiempo"] = time.perf_counter() - start
+        METRICS.count("fotogramas", self.stats["fotogramas"])
+        METRICS.count("fotogramas_reutilizados", self.stats["reutilizadas"])
+        return self.stats
+
+def format_sequence_summary(stats):
+    elapsed = max(stats["tiempo"], 1e-9)
+    lines = [
+        f"Fotogramas: {stats['fotogramas']}  Inferidos: {stats['inferidas']}  "
+        f"Reutilizados: {stats['reutilizadas']}  Errores: {len(stats['errores'])}",
+        f"Tiempo total: {stats['tiempo']:.1f}s  |  {stats['fotogramas'] / elapsed:.1f} fps",
+    ]
+    busy = [f"{name} {secs:.1f}s" for name, secs in stats["etapas"].items() if secs]
+    if busy:
+        lines.append("Tiempo por etapa (suma de hilos): " + ", ".join(busy))
+    for error in stats["errores"]:
+        lines.append(f"  Error: {error}")
+    return "\n".join(lines)
+
+# --- Mediciones ---
+def peak_rss_mb():
+    """Pico de memoria residente del proceso en MB (None si no se puede medir)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa en KB y macOS en bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def synthetic_sample(width, height, seed=0):
+    """
+    Imagen de prueba con alfa conocido: un objeto de borde suave sobre un
+    fondo con textura, y la máscara que daría el modelo a 320x320.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    cx, cy = width / 2, height / 2
+    radius = 0.35 * min(width, height) * (1 + 0.08 * np.sin(np.arctan2(yy - cy, xx - cx) * 7))
+    dist = np.hypot(xx - cx, yy - cy)
+    alpha = np.clip((radius - dist) / 4 + 0.5, 0, 1)
+
+    background = rng.integers(0, 90, (height, width, 3)).astype(np.float32)
+    background[..., 0] += 120 * xx / width
+    background[..., 2] += 120 * yy / height
+    foreground = np.empty((height, width, 3), dtype=np.float32)
+    foreground[..., 0] = 230
+    foreground[..., 1] = 170 + 40 * np.sin(xx / 25)
+    foreground[..., 2] = 50
+    rgb = alpha[..., None] * foreground + (1 - alpha[..., None]) * background
+
+    img = Image.fromarray(rgb.astype(np.uint8))
+    mask = Image.fromarray((alpha * 255).astype(np.uint8), mode="L")
+    mask = mask.resize(U2NET_INPUT_SIZE, Image.LANCZOS).resize((width, height), Image.LANCZOS)
+    return img, mask, (alpha * 255).astype(np.uint8)
+
+def _bench_matting_backend(backend, samples):
+    """Se ejecuta en un proceso aparte para que el pico de RSS sea solo suyo."""
+    loaded = [(decode_image(img_path), Image.open(mask_path).convert("L")) for img_path, mask_path in samples]
+    for img, mask in loaded:
+        mask.load()
+
+    options = matting_options(backend)
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    alphas = [np.asarray(apply_mask(img, mask, options).getchannel("A")) for img, mask in loaded]
+    elapsed = time.perf_counter() - start
+    return elapsed, rss_before, peak_rss_mb(), alphas
+
+def benchmark_matting(paths=None, size=(3000, 2000), backends=MATTING_BACKENDS):
+    """
+    Compara los métodos de recorte en tiempo, pico de RSS y error de alfa.
+    Con la imagen sintética el error se mide contra el alfa real; con
+    imágenes propias, contra el resultado de `closed_form`.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Las máscaras se preparan aquí para que el modelo no cuente en las mediciones
+        samples = []
+        references = None
+        if paths:
+            session = SESSIONS.get("u2net")
+            for i, path in enumerate(paths):
+                mask_path = os.path.join(tmp_dir, f"{i}_mask.png")
+                predict_mask(session, decode_image(path)).save(mask_path)
+                samples.append((path, mask_path))
+        else:
+            img, mask, alpha = synthetic_sample(*size)
+            samples.append((os.path.join(tmp_dir, "img.png"), os.path.join(tmp_dir, "mask.png")))
+            img.save(samples[0][0])
+            mask.save(samples[0][1])
+            references = [alpha]
+            del img, mask
+
+        results = []
+        ctx = get_context("spawn")
+        for backend in backends:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                elapsed, rss_before, rss_after, alphas = pool.submit(
+                    _bench_matting_backend, backend, samples
+                ).result()
+            if references is None:
+                references = alphas
+            error = float(np.mean([
+                np.abs(alpha.astype(np.float32) - ref.astype(np.float32)).mean()
+                for alpha, ref in zip(alphas, references)
+            ]))
+            results.append({
+                "backend": backend,
+                "segundos": round(elapsed, 3),
+                "pico_rss_mb": None if rss_after is None else round(rss_after, 1),
+                "incremento_rss_mb": None if rss_after is None else round(rss_after - rss_before, 1),
+                "error_alfa": round(error, 3),
+            })
+    return results
+
+def format_matting_benchmark(results):
+    lines = [f"{'Método':<13}{'Tiempo':>10}{'Pico RSS':>20}{'Error alfa':>12}"]
+    for r in results:
+        if r["pico_rss_mb"] is None:
+            rss = "n/d"
+        else:
+            rss = f"{r['pico_rss_mb']:.0f} MB (+{r['incremento_rss_mb']:.0f})"
+        lines.append(f"{r['backend']:<13}{r['segundos']:>9.2f}s{rss:>20}{r['error_alfa']:>12.3f}")
+    return "\n".join(lines)
+
+def process_memory_mb(pid="self"):
+    """
+    PSS y memoria propia (anónima, que no se puede compartir) de un proceso
+    en MB, leídas de /proc. Solo Linux; None si no se puede medir.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as f:
+            fields = {parts[0].rstrip(":"): int(parts[1]) for parts in map(str.split, f) if parts[-1] == "kB"}
+    except (OSError, ValueError):
+        return None
+    return {"pss": fields["Pss"] / 1024, "propia": fields["Private_Dirty"] / 1024}
+
+def benchmark_workers(model_name="u2net", counts=(1, 2, 4), images=8, size=(1280, 960)):
+    """
+    Memoria al añadir procesos de trabajo: cada uno con su copia del modelo
+    frente a `SharedWorkers` con los pesos compartidos. Se mide con los
+    procesos ya calientes, después de recortar las imágenes de prueba.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        jobs = []
+        for i in range(images):
+            path = os.path.join(tmp_dir, f"{i}.jpg")
+            synthetic_sample(*size, seed=i)[0].save(path, quality=90)
+            jobs.append((path, os.path.join(tmp_dir, f"{i}_sin_fondo.png")))
+
+        base = process_memory_mb()
+        results = []
+        for shared in (False, True):
+            for count in counts:
+                errors = []
+                with SharedWorkers(count, model_name, matting_options("mask"), use_cache=False,
+                                   shared=shared) as workers:
+                    start = time.perf_counter()
+                    workers.run(jobs, lambda job, pixels, error: error and errors.append(error))
+                    elapsed = time.perf_counter() - start
+                    memory = [process_memory_mb(process.pid) for process, _ in workers.workers]
+                    parent = process_memory_mb()
+                if errors:
+                    raise errors[0]
+                measured = base is not None and None not in memory
+                results.append({
+                    "modo": "compartido" if shared else "independiente",
+                    "procesos": count,
+                    "propia_por_proceso_mb": round(statistics.mean(m["propia"] for m in memory), 1) if measured else None,
+                    "pss_total_mb": round(sum(m["pss"] for m in memory) + parent["pss"] - base["pss"], 1) if measured else None,
+                    "img_s": round(images / elapsed, 2),
+                })
+    return results
+
+def format_workers_benchmark(results):
+    lines = [f"{'Modo':<15}{'Procesos':>9}{'Propia/proceso':>16}{'PSS total':>11}{'Por proceso más':>17}{'img/s':>8}"]
+    previous = {}
+    for r in results:
+        if r["pss_total_mb"] is None:
+            lines.append(f"{r['modo']:<15}{r['procesos']:>9}{'n/d':>16}{'n/d':>11}{'n/d':>17}{r['img_s']:>8.2f}")
+            continue
+        # Lo que cuesta cada proceso añadido respecto a la fila anterior del mismo modo
+        last = previous.get(r["modo"])
+        marginal = (
+            f"{(r['pss_total_mb'] - last['pss_total_mb']) / (r['procesos'] - last['procesos']):.0f} MB"
+            if last else "-"
+        )
+        previous[r["modo"]] = r
+        lines.append(
+            f"{r['modo']:<15}{r['procesos']:>9}{r['propia_por_proceso_mb']:>13.0f} MB"
+            f"{r['pss_total_mb']:>8.0f} MB{marginal:>17}{r['img_s']:>8.2f}"
+        )
+    return "\n".join(lines)
+
+# Resoluciones de la batería de pruebas y etapas medidas por separado
+BENCH_SIZES = ((640, 480), (1920, 1080), (4000, 3000))
+BENCH_STAGES = ("decodificar", "sesion", "inferencia", "decodificar_completa", "recorte", "guardar")
+# Encabezados más cortos para la tabla
+BENCH_LABELS = {"decodificar_completa": "completa"}
+# Diferencias por debajo de esto se consideran ruido al comparar con una referencia
+BENCH_NOISE_S = 0.005
+BENCH_NOISE_MB = 10
+
+def _bench_pipeline_case(path, model_name, options, runs, compress_level):
+    """Un caso en un proceso nuevo: la sesión se crea en frío y el pico de RSS es solo suyo."""
+    with open(path, "rb") as f:
+        data = f.read()
+    timings = {stage: [] for stage in BENCH_STAGES}
+
+    # Las importaciones diferidas no forman parte de crear la sesión
+    load_heavy_modules()
+    start = time.perf_counter()
+    session = create_session(model_name)
+    timings["sesion"].append(time.perf_counter() - start)
+
+    # La primera vuelta calienta onnxruntime y numba y no se cuenta
+    for run in range(runs + 1):
+        # Se mide el mismo camino que la interfaz y `batch` (`remove_background`):
+        # decodificación reducida, máscara sobre ella y la imagen completa solo
+        # al recortar. Las etapas se separan con sus avisos de progreso; si la
+        # imagen no supera la reducción no hay decodificación completa y cuenta 0.
+        spans = {}
+
+        def progress(stage, fraction=1.0):
+            now = time.perf_counter()
+            spans.setdefault(stage, [now, now])[1] = now
+
+        result = remove_background(
+            data, model_name, options, cache=None, predict=lambda img: predict_mask(session, img),
+            progress=progress,
+        )
+        start = time.perf_counter()
+        encode_image(result, BytesIO(), "png", compress_level)
+        spans["guardar"] = [start, time.perf_counter()]
+        if run:
+            for stage in BENCH_STAGES:
+                if stage != "sesion":
+                    begin, end = spans.get(stage, (0.0, 0.0))
+                    timings[stage].append(end - begin)
+    return {stage: statistics.median(values) for stage, values in timings.items()}, result.size, peak_rss_mb()
+
+def bench_environment():
+    import platform
+    import subprocess
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "plataforma": platform.platform(),
+        "python": platform.python_version(),
+        "onnxruntime": ort.__version__,
+        "proveedores": available_providers(RUNTIME["providers"]),
+        "cpus": os.cpu_count(),
+    }
+
+def benchmark_pipeline(paths=None, sizes=BENCH_SIZES, model_name="u2net", options=REMOVE_OPTIONS,
+                       runs=3, compress_level=PNG_COMPRESS_LEVEL):
+    """
+    Mide cada etapa de la cadena sin interfaz: decodificar (reducida y
+    completa), crear la sesión, inferencia, recorte y codificar el PNG, más
+    el pico de RSS. Cada caso (imagen sintética de cada tamaño o imagen
+    propia) corre en un proceso nuevo; los tiempos son la mediana de `runs`
+    vueltas.
+    """
+    report = {
+        "entorno": bench_environment(),
+        "modelo": model_name,
+        "recorte": options.get("matting_backend") if options.get("alpha_matting") else "mask",
+        "vueltas": runs,
+        "casos": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = [(os.path.basename(path), path) for path in paths or []]
+        for width, height in sizes:
+            # JPEG, como la mayoría de fotos, para que decodificar cueste lo que cuesta de verdad
+            path = os.path.join(tmp_dir, f"{width}x{height}.jpg")
+            synthetic_sample(width, height)[0].save(path, quality=90)
+            cases.append((f"sintetica_{width}x{height}", path))
+
+        ctx = get_context("spawn")
+        for name, path in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                stages, size, rss = pool.submit(
+                    _bench_pipeline_case, path, model_name, options, runs, compress_level
+                ).result()
+            report["casos"].append({
+                "caso": name,
+                "tamano": list(size),
+                "etapas": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+                "total_s": round(sum(v for k, v in stages.items() if k != "sesion"), 4),
+                "pico_rss_mb": None if rss is None else round(rss, 1),
+            })
+    return report
+
+def compare_benchmarks(report, baseline, threshold=0.10):
+    """
+    Compara con una medición anterior y devuelve las regresiones: etapas o
+    picos de RSS que empeoran más de `threshold` (fracción) y por encima del
+    ruido de medición.
+    """
+    previous = {case["caso"]: case for case in baseline.get("casos", [])}
+    regressions = []
+    for case in report["casos"]:
+        before = previous.get(case["caso"])
+        if before is None:
+            continue
+        metrics = [(stage, case["etapas"][stage], before["etapas"].get(stage), BENCH_NOISE_S)
+                   for stage in case["etapas"]]
+        metrics.append(("total_s", case["total_s"], before.get("total_s"), BENCH_NOISE_S))
+        metrics.append(("pico_rss_mb", case["pico_rss_mb"], before.get("pico_rss_mb"), BENCH_NOISE_MB))
+        for metric, now, then, noise in metrics:
+            if now is None or not then:
+                continue
+            if now - then > noise and now / then > 1 + threshold:
+                regressions.append({
+                    "caso": case["caso"],
+                    "medida": metric,
+                    "antes": then,
+                    "ahora": now,
+                    "cambio": round(now / then - 1, 3),
+                })
+    return regressions
+
+def format_pipeline_benchmark(report, regressions=None):
+    env = report["entorno"]
+    lines = [
+        f"Modelo {report['modelo']}, recorte {report['recorte']}, {report['vueltas']} vueltas "
+        f"(commit {env['commit'] or 'n/d'}, onnxruntime {env['onnxruntime']})",
+        f"{'Caso':<26}" + "".join(f"{BENCH_LABELS.get(stage, stage):>12}" for stage in BENCH_STAGES) + f"{'Total':>10}{'Pico RSS':>11}",
+    ]
+    for case in report["casos"]:
+        rss = "n/d" if case["pico_rss_mb"] is None else f"{case['pico_rss_mb']:.0f} MB"
+        lines.append(
+            f"{case['caso']:<26}"
+            + "".join(f"{case['etapas'][stage] * 1000:>10.0f}ms" for stage in BENCH_STAGES)
+            + f"{case['total_s']:>9.2f}s{rss:>11}"
+        )
+    if regressions is not None:
+        if regressions:
+            lines.append("Regresiones:")
+            for r in regressions:
+                lines.append(
+                    f"  {r['caso']} · {r['medida']}: {r['antes']} → {r['ahora']} (+{r['cambio'] * 100:.0f}%)"
+                )
+        else:
+            lines.append("Sin regresiones respecto a la referencia.")
+    return "\n".join(lines)
+
+# --- Servidor HTTP ---
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+# Imagen que no se puede decodificar (422); cualquier otro fallo es del servidor (500)
+IMAGE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+class InferenceServer:
+    """
+    Servicio HTTP local sobre `remove_background`.
+
+    El modelo se carga al arrancar y queda en memoria. Las peticiones entran
+    en una cola acotada; si está llena se responde 503 con `Retry-After`
+    para que el cliente reintente (contrapresión). Los hilos de trabajo
+    comparten un `MicroBatcher`, así las peticiones simultáneas se agrupan
+    en una sola ejecución del modelo; cada hilo espera su máscara, por eso
+    hay al menos `batch_size` hilos.
+
+    Rutas:
+      POST /remove        imagen en el cuerpo → PNG recortado (?format=webp|avif)
+      POST /jobs          imagen en el cuerpo → {"id": ...} (202)
+      GET  /jobs/<id>     202 mientras se procesa, luego el PNG
+      GET  /health        estado del servicio
+      GET  /metrics       métricas en JSON (o Prometheus con ?format=prometheus)
+    """
+
+    def __init__(self, host="127.0.0.1", port=8080, model_name="u2net", options=REMOVE_OPTIONS,
+                 workers=2, queue_size=16, batch_size=4, max_latency=0.01, max_results=256, cache=RESULTS):
+        self.host = host
+        self.port = port
+        self.model_name = model_name
+        self.options = options
+        self.cache = cache
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.batcher = MicroBatcher(model_name, batch_size, max_latency)
+        # Con lotes, cada hilo espera una imagen del lote
+        self.workers = max(1, workers, batch_size)
+        self.max_results = max_results
+        self.results = OrderedDict()
+        self.started = time.time()
+        self.ready = False
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=2048)
+        self.counters = {"peticiones": 0, "rechazadas": 0, "errores": 0, "completadas": 0}
+
+    def start_workers(self):
+        SESSIONS.get(self.model_name)
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+        self.ready = True
+
+    def _worker(self):
+        while True:
+            data, options, fmt, future, received = self.jobs.get()
+            try:
+                with profile_job("servidor"):
+                    result = remove_background(data, self.model_name, options, self.cache, self.batcher.predict)
+                    buffer = BytesIO()
+                    encode_image(result, buffer, fmt)
+                future.set_result((buffer.getvalue(), f"image/{fmt}"))
+                counter = "completadas"
+            except Exception as e:
+                future.set_exception(e)
+                counter = "errores"
+            with self._lock:
+                self.counters[counter] += 1
+                self._latencies.append(time.perf_counter() - received)
+
+    def submit(self, data, options=None, fmt="png"):
+        """Encola una imagen; devuelve un Future o None si la cola está llena."""
+        future = Future()
+        with self._lock:
+            self.counters["peticiones"] += 1
+        try:
+            self.jobs.put_nowait((data, options or self.options, fmt, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self.counters["rechazadas"] += 1
+            return None
+        return future
+
+    def store_result(self, future):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self.results[job_id] = future
+            while len(self.results) > self.max_results:
+                self.results.popitem(last=False)
+        return job_id
+
+    def metrics(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            counters = dict(self.counters)
+        uptime = time.time() - self.started
+        return {
+            **counters,
+            "en_cola": self.jobs.qsize(),
+            "capacidad_cola": self.jobs.maxsize,
+            "lotes": self.batcher.batches,
+            "imagenes_por_lote": self.batcher.images / self.batcher.batches if self.batcher.batches else 0.0,
+            "latencia_p50_s": percentile(latencies, 50),
+            "latencia_p99_s": percentile(latencies, 99),
+            "por_segundo": counters["completadas"] / uptime if uptime else 0.0,
+            "activo_s": uptime,
+        }
+
+    def prometheus_metrics(self):
+        lines = []
+        for name, value in self.metrics().items():
+            lines.append(f"efi_{name} {value}")
+        return "\n".join(lines) + "\n" + METRICS.to_prometheus()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json", headers=None):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                elif isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_upload(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                # Sin leer el cuerpo la conexión no puede reutilizarse: se cierra
+                if length <= 0:
+                    self._send(400, {"error": "Falta la imagen en el cuerpo de la petición"},
+                               headers={"Connection": "close"})
+                    return None, None, None
+                if length > MAX_UPLOAD_BYTES:
+                    self._send(413, {"error": "La imagen supera el tamaño máximo"},
+                               headers={"Connection": "close"})
+                    return None, None, None
+                data = self.rfile.read(length)
+                query = parse_qs(urlparse(self.path).query)
+                options = server.options
+                if "matting" in query:
+                    try:
+                        options = matting_options(query["matting"][0], server.options)
+                    except ValueError as e:
+                        self._send(400, {"error": str(e)})
+                        return None, None, None
+                fmt = query.get("format", ["png"])[0]
+                if fmt not in OUTPUT_FORMATS or (fmt == "avif" and not avif_available()):
+                    self._send(400, {"error": f"Formato no disponible: {fmt}"})
+                    return None, None, None
+                return data, options, fmt
+
+            def _error(self, error):
+                status = 422 if isinstance(error, IMAGE_ERRORS) else 500
+                self._send(status, {"error": str(error)})
+
+            def _busy(self):
+                self._send(503, {"error": "Servidor ocupado, reintenta"}, headers={"Retry-After": "1"})
+
+            def do_POST(self):
+                route = urlparse(self.path).path
+                if route not in ("/remove", "/jobs"):
+                    self._send(404, {"error": "Ruta desconocida"})
+                    return
+                data, options, fmt = self._read_upload()
+                if data is None:
+                    return
+                future = server.submit(data, options, fmt)
+                if future is None:
+                    self._busy()
+                    return
+                if route == "/jobs":
+                    self._send(202, {"id": server.store_result(future)})
+                    return
+                try:
+                    self._send(200, *future.result())
+                except Exception as e:
+                    self._error(e)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/health":
+                    status = 200 if server.ready else 503
+                    self._send(status, {
+                        "estado": "listo" if server.ready else "cargando",
+                        "modelo": server.model_name,
+                        "en_cola": server.jobs.qsize(),
+                    })
+                elif url.path == "/metrics":
+                    if parse_qs(url.query).get("format") == ["prometheus"]:
+                        self._send(200, server.prometheus_metrics(), "text/plain; version=0.0.4")
+                    else:
+                        self._send(200, {**server.metrics(), "rendimiento": METRICS.snapshot()})
+                elif url.path.startswith("/jobs/"):
+                    with server._lock:
+                        future = server.results.get(url.path[len("/jobs/"):])
+                    if future is None:
+                        self._send(404, {"error": "Trabajo desconocido"})
+                    elif not future.done():
+                        self._send(202, {"estado": "procesando"})
+                    elif future.exception() is not None:
+                        self._error(future.exception())
+                    else:
+                        self._send(200, *future.result())
+                else:
+                    self._send(404, {"error": "Ruta desconocida"})
+
+        return Handler
+
+    def serve_forever(self):
+        httpd = ThreadingHTTPServer((self.host, self.port), self._handler())
+        httpd.daemon_threads = True
+        self.start_workers()
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+def load_test(url, images, concurrency_levels=(1, 2, 4, 8), requests_per_level=40, report=None):
+    """
+    Envía `requests_per_level` peticiones a POST /remove con distintos
+    niveles de concurrencia y mide rendimiento y latencias p50/p99.
+    """
+    payloads = []
+    for path in images:
+        with open(path, "rb") as f:
+            payloads.append(f.read())
+
+    results = []
+    for concurrency in concurrency_levels:
+        latencies = []
+        rejected = 0
+        errors = 0
+        counter = iter(range(requests_per_level))
+        lock = threading.Lock()
+
+        def client():
+            nonlocal rejected, errors
+            http = requests.Session()
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    response = http.post(f"{url}/remove", data=payloads[i % len(payloads)], timeout=300)
+                except requests.RequestException:
+                    with lock:
+                        errors += 1
+                    continue
+                elapsed = time.perf_counter() - start
+                with lock:
+                    if response.status_code == 200:
+                        latencies.append(elapsed)
+                    elif response.status_code == 503:
+                        rejected += 1
+                    else:
+                        errors += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        result = {
+            "concurrencia": concurrency,
+            "completadas": len(latencies),
+            "rechazadas": rejected,
+            "errores": errors,
+            "por_segundo": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_s": percentile(latencies, 50),
+            "p99_s": percentile(latencies, 99),
+        }
+        results.append(result)
+        if report:
+            report(
+                f"{concurrency:>5} {result['por_segundo']:>10.2f} {result['p50_s'] * 1000:>10.0f} "
+                f"{result['p99_s'] * 1000:>10.0f} {rejected:>10} {errors:>8}"
+            )
+    return results
+
+# --- Carpeta vigilada ---
+# Segundos sin cambios de tamaño ni fecha para dar un archivo por copiado
+WATCH_SETTLE_S = 2.0
+WATCH_POLL_S = 5.0
+WATCH_JOURNAL_DIR = os.path.join(CACHE_DIR, "vigilancia")
+
+class WatchJournal:
+    """
+    Diario en disco de una carpeta vigilada: el último estado de cada imagen
+    ("pendiente", "hecho" o "error", con el tamaño y la fecha que tenía
+    entonces) y la fecha de cada carpeta revisada.
+
+    Es un archivo de líneas JSON al que solo se añade, con fsync en cada
+    línea; una línea a medias tras un corte se descarta al leerlo. Al abrirlo,
+    y cuando crece demasiado, se reescribe compacto.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.dirs = {}
+        self._lock = threading.Lock()
+        self._file = None
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "carpeta" in record:
+                        self.dirs[record["carpeta"]] = record["mtime"]
+                    else:
+                        self.files[record["ruta"]] = record
+        except OSError:
+            pass
+        self.compact()
+
+    def compact(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            with open(f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                for folder, mtime in self.dirs.items():
+                    f.write(json.dumps({"carpeta": folder, "mtime": mtime}, ensure_ascii=False) + "\n")
+                for record in self.files.values():
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{self.path}.tmp", self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._lines = len(self.dirs) + len(self.files)
+
+    def _append(self, record):
+        with self._lock:
+            if self._file is None:
+                return
+            if "carpeta" in record:
+                self.dirs[record["carpeta"]] = record["mtime"]
+            else:
+                self.files[record["ruta"]] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._lines += 1
+            oversized = self._lines > 2 * (len(self.files) + len(self.dirs)) + 1000
+        if oversized:
+            self.compact()
+
+    def mark(self, path, state, stat, error=None):
+        record = {"ruta": path, "estado": state, "tam": stat[0], "mtime": stat[1]}
+        if error:
+            record["error"] = error
+        self._append(record)
+
+    def mark_dir(self, folder, mtime):
+        if self.dirs.get(folder) != mtime:
+            self._append({"carpeta": folder, "mtime": mtime})
+
+    def state(self, path, stat):
+        """Estado registrado si la imagen no ha cambiado desde entonces; None si es nueva o distinta."""
+        record = self.files.get(path)
+        if record is not None and (record["tam"], record["mtime"]) == tuple(stat):
+            return record["estado"]
+        return None
+
+    def unfinished(self):
+        return [path for path, record in self.files.items() if record["estado"] == "pendiente"]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class FolderWatcher:
+    """
+    Vigila una carpeta y sus subcarpetas y deja el recorte de cada imagen
+    nueva o modificada a su lado, como `<nombre>_sin_fondo.png`.
+
+    Los cambios llegan como notificaciones del sistema (inotify, FSEvents o
+    ReadDirectoryChangesW, con el paquete opcional `watchdog`) o, sin él,
+    revisando la carpeta cada `poll` segundos. Una imagen solo se procesa
+    cuando su tamaño y su fecha llevan `settle` segundos sin cambiar, así no
+    se leen archivos a medio copiar. Las imágenes listas van a un grupo de
+    hilos con el modelo ya cargado o, con `processes`, a `SharedWorkers`.
+
+    El diario (`WatchJournal`) permite reanudar tras un reinicio o un corte:
+    se retoman las imágenes que quedaron pendientes y, al revisar el árbol,
+    solo se miran las carpetas cuya fecha cambió desde la última vez.
+    """
+
+    def __init__(self, root, model_name="u2net", options=REMOVE_OPTIONS, workers=2, processes=0,
+                 settle=WATCH_SETTLE_S, poll=WATCH_POLL_S, journal_path=None, fmt="png",
+                 compress_level=PNG_COMPRESS_LEVEL, quality=None, use_cache=True, overwrite=False,
+                 polling=False, report=print):
+        self.root = os.path.abspath(root)
+        self.model_name = model_name
+        self.options = options
+        self.workers = max(1, workers)
+        self.processes = processes
+        self.settle = settle
+        self.poll = poll
+        self.fmt = fmt
+        self.compress_level = compress_level
+        self.quality = quality
+        self.use_cache = use_cache
+        self.overwrite = overwrite
+        self.polling = polling
+        self.report = report
+        if journal_path is None:
+            digest = hashlib.sha1(os.path.normcase(self.root).encode("utf-8")).hexdigest()[:16]
+            journal_path = os.path.join(WATCH_JOURNAL_DIR, f"{digest}.jsonl")
+        self.journal = WatchJournal(journal_path)
+        self.pending = queue.Queue()
+        self.stats = {"procesadas": 0, "errores": 0}
+        # ruta -> (tamaño y fecha, momento del último cambio visto)
+        self._candidates = {}
+        # ruta -> (tamaño y fecha al encolarla, momento de encolarla)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._pool = None
+        self._observer = None
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def is_input(self, path):
+        name = os.path.basename(path)
+        # Ocultos y temporales de Office/Windows ("~$...") no son fotos
+        if name.startswith((".", "~$")) or not name.lower().endswith(IMAGE_EXTENSIONS):
+            return False
+        return not os.path.splitext(name)[0].endswith("_sin_fondo")
+
+    def output_path(self, path):
+        return f"{os.path.splitext(path)[0]}_sin_fondo.{self.fmt}"
+
+    def notice(self, path):
+        """Una imagen nueva o cambiada; se procesa cuando deje de cambiar."""
+        path = os.path.abspath(path)
+        if not self.is_input(path):
+            return
+        stat = self._stat(path)
+        if stat is None:
+            return
+        with self._lock:
+            known = self._candidates.get(path)
+            if known is None or known[0] != stat:
+                self._candidates[path] = (stat, time.monotonic())
+
+    def _settle(self):
+        now = time.monotonic()
+        with self._lock:
+            candidates = list(self._candidates.items())
+        for path, (stat, since) in candidates:
+            current = self._stat(path)
+            with self._lock:
+                if current is None:
+                    self._candidates.pop(path, None)
+                elif current != stat:
+                    self._candidates[path] = (current, now)
+                elif now - since >= self.settle and path not in self._inflight:
+                    # Si se está procesando una versión anterior, espera a que termine
+                    self._candidates.pop(path, None)
+                    self._dispatch(path, current)
+
+    def _has_output(self, path, stat):
+        """
+        Recorte posterior a la imagen que no hay que rehacer (salvo con
+        `overwrite`); así no se reprocesan los que ya existían antes de
+        vigilar la carpeta. Si lo hay, queda como hecho en el diario.
+        """
+        if self.overwrite:
+            return False
+        out_stat = self._stat(self.output_path(path))
+        if out_stat is None or out_stat[1] < stat[1]:
+            return False
+        self.journal.mark(path, "hecho", stat)
+        return True
+
+    def _dispatch(self, path, stat):
+        state = self.journal.state(path, stat)
+        if state in ("hecho", "error") or self._has_output(path, stat):
+            return
+        output_path = self.output_path(path)
+        if state is None:
+            self.journal.mark(path, "pendiente", stat)
+        self._inflight[path] = (stat, time.monotonic())
+        self.pending.put((path, output_path))
+
+    def _done(self, job, pixels, error):
+        path = job[0]
+        with self._lock:
+            stat, started = self._inflight.pop(path)
+        rel = os.path.relpath(path, self.root)
+        if error is None:
+            self.journal.mark(path, "hecho", stat)
+            self.stats["procesadas"] += 1
+            self.report(f"{time.strftime('%H:%M:%S')}  listo  {rel} ({time.monotonic() - started:.1f}s)")
+        else:
+            # No se reintenta hasta que el archivo cambie
+            self.journal.mark(path, "error", stat, str(error))
+            self.stats["errores"] += 1
+            self.report(f"{time.strftime('%H:%M:%S')}  error  {rel}: {error}")
+
+    def scan(self, full=False):
+        """
+        Revisa el árbol. Sin `full` solo se miran los archivos de las
+        carpetas cuya fecha cambió desde la última revisión (al añadir,
+        borrar o renombrar archivos cambia la de su carpeta).
+        """
+        folders = [self.root]
+        while folders:
+            folder = folders.pop()
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            unchanged = not full and self.journal.dirs.get(folder) == mtime
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith("."):
+                        folders.append(entry.path)
+                elif not unchanged and self.is_input(entry.path):
+                    stat = self._stat(entry.path)
+                    if (stat is not None and self.journal.state(entry.path, stat) is None
+                            and not self._has_output(entry.path, stat)):
+                        # Queda en el diario antes que la fecha de la carpeta, por si hay un corte
+                        self.journal.mark(entry.path, "pendiente", stat)
+                        self.notice(entry.path)
+            self.journal.mark_dir(folder, mtime)
+
+    def _start_notifications(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher.notice(event.src_path)
+
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher.notice(event.src_path)
+
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher.notice(event.dest_path)
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.root, recursive=True)
+        self._observer.start()
+        return True
+
+    def _start_workers(self):
+        if self.processes > 0:
+            # Antes que cualquier otro hilo: SharedWorkers puede usar fork
+            self._pool = SharedWorkers(
+                self.processes, self.model_name, self.options, 1, self.use_cache,
+                compress_level=self.compress_level, quality=self.quality,
+            ).start()
+            self._threads = self._pool.feed(self.pending, self._done)
+            return
+        # El modelo queda cargado antes de la primera imagen
+        predict_mask(SESSIONS.get(self.model_name), Image.new("RGB", (64, 64)))
+        self._threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                return
+            try:
+                pixels = _process_file(
+                    job, self.model_name, self.options, 0, self.use_cache,
+                    compress_level=self.compress_level, quality=self.quality,
+                )
+            except Exception as e:
+                self._done(job, 0, e)
+            else:
+                self._done(job, pixels, None)
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, full_scan=False):
+        """Vigila hasta `stop()` (o Ctrl+C). Lo que quede a medias se retoma al volver a arrancar."""
+        self._start_workers()
+        notifications = not self.polling and self._start_notifications()
+        resumed = self.journal.unfinished()
+        for path in resumed:
+            self.notice(path)
+        if resumed:
+            self.report(f"Se retoman {len(resumed)} imágenes pendientes")
+        self.scan(full=full_scan)
+        self.report(
+            "Cambios por notificaciones del sistema" if notifications
+            else f"Revisando la carpeta cada {self.poll:g}s (instala 'watchdog' para recibir notificaciones)"
+        )
+        next_poll = time.monotonic() + self.poll
+        try:
+            while not self._stop.wait(min(0.5, self.settle / 2) or 0.1):
+                if not notifications and time.monotonic() >= next_poll:
+                    self.scan(full=True)
+                    next_poll = time.monotonic() + self.poll
+                self._settle()
+        finally:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer.join()
+            for _ in self._threads:
+                self.pending.put(None)
+            for thread in self._threads:
+                thread.join(timeout=60)
+            if self._pool is not None:
+                self._pool.close()
+            self.journal.close()
+
+# --- Vista previa ---
+CHECKER_LIGHT = 255
+CHECKER_DARK = 220
+PREVIEW_MIN_ZOOM = 0.25
+PREVIEW_MAX_ZOOM = 8.0
+
+@lru_cache(maxsize=8)
+def checkerboard(width, height, size=20):
+    """Fondo de cuadros para transparencias, generado de una vez con NumPy."""
+    cells = (np.arange(height)[:, None] // size + np.arange(width)[None, :] // size) % 2
+    gray = np.where(cells == 0, CHECKER_DARK, CHECKER_LIGHT).astype(np.uint8)
+    return Image.fromarray(gray, mode="L").convert("RGB")
+
+def composite_on_checkerboard(image, size=20):
+    bg = checkerboard(image.width, image.height, size).copy()
+    bg.paste(image, (0, 0), image if image.mode == "RGBA" else None)
+    return bg
+
+class PreviewPyramid:
+    """
+    Pirámide de resoluciones (1, 1/2, 1/4...) para mostrar una imagen con
+    zoom y desplazamiento. Cada nivel se crea con `reduce` la primera vez
+    que se necesita, y cada vista solo remuestrea la parte visible del
+    nivel adecuado, así el trabajo depende del tamaño de la ventana y no
+    del de la imagen.
+    """
+
+    def __init__(self, image, min_side=256):
+        self.levels = [image]
+        self.size = image.size
+        self.min_side = min_side
+
+    def level(self, index):
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            if min(previous.size) <= self.min_side:
+                break
+            self.levels.append(previous.reduce(2))
+        return min(index, len(self.levels) - 1)
+
+    def render(self, view_size, zoom, center, background=20):
+        """
+        Vista de `view_size` píxeles con `zoom` píxeles de pantalla por píxel
+        de la imagen y centrada en `center` (coordenadas de la imagen).
+        """
+        view_w, view_h = view_size
+        width, height = self.size
+        # Rectángulo visible en coordenadas de la imagen, recortado a sus bordes
+        left = center[0] - view_w / (2 * zoom)
+        top = center[1] - view_h / (2 * zoom)
+        x0, y0 = max(0.0, left), max(0.0, top)
+        x1 = min(float(width), left + view_w / zoom)
+        y1 = min(float(height), top + view_h / zoom)
+
+        view = checkerboard(view_w, view_h, background).copy()
+        if x1 <= x0 or y1 <= y0:
+            return view
+
+        out_x, out_y = round((x0 - left) * zoom), round((y0 - top) * zoom)
+        out_w = max(1, min(view_w - out_x, round((x1 - x0) * zoom)))
+        out_h = max(1, min(view_h - out_y, round((y1 - y0) * zoom)))
+
+        # Nivel más reducido que aún tenga al menos un píxel por píxel de pantalla
+        index = 0
+        while zoom * 2 ** (index + 1) <= 1:
+            index += 1
+        index = self.level(index)
+        source = self.levels[index]
+        scale_x = source.width / width
+        scale_y = source.height / height
+        box = (x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y)
+        resample = Image.NEAREST if zoom >= 2 else Image.BILINEAR
+        region = source.resize((out_w, out_h), resample, box=box)
+
+        view.paste(region, (out_x, out_y), region if region.mode == "RGBA" else None)
+        return view
+
+# Cola de la aplicación: hilos simultáneos y tamaño de las miniaturas
+GUI_WORKERS = int(os.getenv("EFI_GUI_WORKERS", "2"))
+GUI_MAX_WORKERS = 8
+THUMBNAIL_SIZE = 112
+QUEUE_COLUMNS = 5
+# Vista rápida: primero la máscara sobre la imagen reducida, luego el recorte completo
+PREVIEW_MODES = ("rapida", "al_guardar", "completa")
+PREVIEW_LABELS = {
+    "rapida": "Rápida y refinar",
+    "al_guardar": "Rápida, refinar al guardar",
+    "completa": "Solo completa",
 }
-def get_cache_dir():
-    if sys.platform.startswith('win'):
-        base = os.getenv('LOCALAPPDATA') or os.path.expanduser(r"~\AppData\Local")
-    elif sys.platform == 'darwin':
-        base = os.path.expanduser("~/Library/Caches")
-    else:
-        base = os.getenv('XDG_CACHE_HOME') or os.path.expanduser("~/.cache")
-    return os.path.join(base, "BackgroundRemover", "model_cache")
 
-CACHE_DIR = get_cache_dir()
-os.makedirs(CACHE_DIR, exist_ok=True)
+# Modelo del modo Objetos
+MODEL_CHOICES = ("auto", "objetos", "rapido")
+MODEL_CHOICE_LABELS = {
+    "auto": "Automático",
+    "objetos": "Calidad (u2net)",
+    "rapido": "Rápido (u2netp)",
+}
 
-os.environ.setdefault("U2NET_HOME", CACHE_DIR)
+class QueueJob:
+    """Una imagen en la cola de la aplicación. Solo el hilo de la interfaz cambia su estado."""
+
+    PENDING, RUNNING, DONE, FAILED, CANCELLED = "pendiente", "procesando", "lista", "error", "cancelada"
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, input_path, model_name, options, mode, preview_mode="completa"):
+        self.id = next(self._ids)
+        self.input_path = input_path
+        self.name = os.path.basename(input_path)
+        self.output_path = f"{os.path.splitext(input_path)[0]}{OUTPUT_SUFFIX}"
+        self.model_name = model_name
+        self.options = options
+        self.mode = mode
+        self.preview_mode = preview_mode
+        # Máscara de la vista rápida mientras el recorte no está refinado
+        self.proxy_mask = None
+        self.save_path = None
+        self.result_file = None
+        self.preview = None
+        self.thumbnail = None
+        self.photo = None
+        self.reset()
+
+    def reset(self):
+        self.status = self.PENDING
+        self.message = ""
+        self.percent = 0
+        self.elapsed = 0.0
+        self.cancel = threading.Event()
 
 class BackgroundRemoverApp:
     def __init__(self, root):
@@ -70,12 +4276,37 @@ class BackgroundRemoverApp:
         self.root.geometry("700x500")
         self.root.resizable(False, False)
         
-        self.processing = False
         self.current_image = None
+        self.result_file = None
         self.output_path = ""
         self.mode = "objetos"
+        self.area_mode = False
         
+        self.ready = threading.Event()
+        self.events = queue.Queue()
+        # Cola de imágenes: los hilos comparten el agrupador y la sesión del modelo
+        self.jobs = OrderedDict()
+        self.batch_ids = []
+        self.pending = queue.Queue()
+        self.max_workers = GUI_WORKERS
+        self._workers = 0
+        self._workers_lock = threading.Lock()
+        self._download_lock = threading.Lock()
+        self.selected_job = None
+        self.current_job = None
+        self._pyramid = None
+        self._previews = {}
+        self.queue_window = None
+        self.tiles = {}
         self.setup_ui()
+        if hasattr(self.root, "drop_target_register"):
+            self.root.drop_target_register(DND_FILES)
+            self.root.dnd_bind("<<Drop>>", self.on_drop)
+        self.root.after(0, lambda: mark_startup("ventana visible"))
+        # El modelo se elige aquí: el hilo de carga no lee variables de Tk
+        threading.Thread(target=self.load_engine, args=(self.model_name(),), daemon=True).start()
+        self.root.after(100, self.check_ready)
+        self.root.after(50, self.poll_events)
         
     def setup_ui(self):
         try:
@@ -95,6 +4326,15 @@ class BackgroundRemoverApp:
             bg="#f5f5f5"
         )
         title_label.pack(pady=(0, 10))
+
+        self.ready_label = tk.Label(
+            main_frame,
+            text="● Cargando motor de IA…",
+            font=("Segoe UI", 9),
+            fg="#e67e22",
+            bg="#f5f5f5"
+        )
+        self.ready_label.place(relx=1.0, y=0, anchor="ne")
         
         mode_frame = tk.Frame(main_frame, bg="#f5f5f5")
         mode_frame.pack(pady=(0, 15))
@@ -115,25 +4355,99 @@ class BackgroundRemoverApp:
             mode_frame, 
             text="Modo Personas", 
             variable=self.mode_var,
-            value="mensaje-pmd",
+            value="personas",
             font=("Segoe UI", 10),
             bg="#f5f5f5",
-            command=self._show_mensaje_alert
+            command=self.update_mode
         ).pack(side=tk.LEFT, padx=10)
         
         tk.Radiobutton(
             mode_frame, 
             text="Seleccionar área", 
             variable=self.mode_var,
-            value="mensaje-pmd",
+            value="area",
             font=("Segoe UI", 10),
             bg="#f5f5f5",
-            command=self._show_mensaje_alert
+            command=self.update_mode
         ).pack(side=tk.LEFT, padx=10)
         
+        matting_frame = tk.Frame(main_frame, bg="#f5f5f5")
+        matting_frame.pack(pady=(0, 5))
+
+        tk.Label(
+            matting_frame,
+            text="Recorte:",
+            font=("Segoe UI", 10),
+            bg="#f5f5f5"
+        ).pack(side=tk.LEFT, padx=5)
+
+        self.matting_var = tk.StringVar(value=MATTING_LABELS["closed_form"])
+        ttk.Combobox(
+            matting_frame,
+            textvariable=self.matting_var,
+            values=[MATTING_LABELS[b] for b in MATTING_BACKENDS],
+            state="readonly",
+            width=14
+        ).pack(side=tk.LEFT)
+
+        tk.Label(
+            matting_frame,
+            text="Modelo:",
+            font=("Segoe UI", 10),
+            bg="#f5f5f5"
+        ).pack(side=tk.LEFT, padx=(15, 5))
+
+        self.model_var = tk.StringVar(value=MODEL_CHOICE_LABELS["auto"])
+        ttk.Combobox(
+            matting_frame,
+            textvariable=self.model_var,
+            values=[MODEL_CHOICE_LABELS[c] for c in MODEL_CHOICES],
+            state="readonly",
+            width=15
+        ).pack(side=tk.LEFT)
+
+        # Las variantes cuantizadas solo aparecen si ya se generaron
+        variants = ["fp32"] + available_variants(MODEL_NAMES["objetos"])
+        if len(variants) > 1:
+            tk.Label(
+                matting_frame,
+                text="Precisión:",
+                font=("Segoe UI", 10),
+                bg="#f5f5f5"
+            ).pack(side=tk.LEFT, padx=(15, 5))
+
+        self.variant_var = tk.StringVar(value="fp32")
+        if len(variants) > 1:
+            ttk.Combobox(
+                matting_frame,
+                textvariable=self.variant_var,
+                values=variants,
+                state="readonly",
+                width=12
+            ).pack(side=tk.LEFT)
+
+        view_frame = tk.Frame(main_frame, bg="#f5f5f5")
+        view_frame.pack(pady=(0, 5))
+
+        tk.Label(
+            view_frame,
+            text="Vista:",
+            font=("Segoe UI", 10),
+            bg="#f5f5f5"
+        ).pack(side=tk.LEFT, padx=5)
+
+        self.preview_var = tk.StringVar(value=PREVIEW_LABELS["rapida"])
+        ttk.Combobox(
+            view_frame,
+            textvariable=self.preview_var,
+            values=[PREVIEW_LABELS[m] for m in PREVIEW_MODES],
+            state="readonly",
+            width=22
+        ).pack(side=tk.LEFT)
+        
         self.btn_select = Button(
             main_frame, 
-            text="📷 Seleccionar Imagen", 
+            text="📷 Seleccionar Imágenes", 
             command=self.select_image,
             style="Accent.TButton"
         )
@@ -147,6 +4461,13 @@ class BackgroundRemoverApp:
         )
         self.progress.pack(pady=10)
         self.progress.pack_forget()
+
+        self.btn_cancel = Button(
+            main_frame,
+            text="Cancelar",
+            command=self.cancel_job,
+            style="TButton"
+        )
         
         self.status_label = tk.Label(
             main_frame, 
@@ -178,6 +4499,16 @@ class BackgroundRemoverApp:
             style="TButton"
         )
         self.btn_save.pack(side=tk.LEFT, padx=10)
+
+        self.workers_var = tk.StringVar(value=str(GUI_WORKERS))
+        self.btn_queue = Button(
+            self.result_frame,
+            text="Cola (0)",
+            command=self.show_queue,
+            state=tk.DISABLED,
+            style="TButton"
+        )
+        self.btn_queue.pack(side=tk.LEFT, padx=10)
         
         footer_frame = tk.Frame(main_frame, bg="#f5f5f5")
         footer_frame.pack(side=tk.BOTTOM, pady=(20, 0))
@@ -213,10 +4544,23 @@ class BackgroundRemoverApp:
         style.configure('Accent.TButton', font=('Segoe UI', 11, 'bold'), 
                         foreground='white', background='#3498db')
         style.map('Accent.TButton', background=[('active', '#2980b9')])
+        self.fit_window()
+
+    def fit_window(self):
+        """
+        La ventana no cambia de tamaño: se agranda desde 700x500 lo justo
+        para que quepan todas las filas, contando la barra de progreso y el
+        botón Cancelar que aparecen al procesar.
+        """
+        self.progress.pack(pady=10, before=self.status_label)
+        self.btn_cancel.pack(pady=(0, 5), before=self.status_label)
+        self.root.update_idletasks()
+        width = max(700, self.root.winfo_reqwidth())
+        height = max(500, self.root.winfo_reqheight())
+        self.progress.pack_forget()
+        self.btn_cancel.pack_forget()
+        self.root.geometry(f"{width}x{height}")
     
-    def _show_mensaje_alert(self):
-        messagebox.showinfo("Personas", "Función en desarrollo. ¡Próximamente!")
-        
     # --------------- About window ----------------------------
     def _about_window(self):
         win = tk.Toplevel()
@@ -372,127 +4716,708 @@ class BackgroundRemoverApp:
         )
         version_label.pack(side="bottom", pady=(10, 0))
     
+    def load_engine(self, model_name):
+        """Importa rembg/onnxruntime y carga el modelo sin bloquear la ventana."""
+        try:
+            load_heavy_modules()
+            mark_startup("módulos cargados")
+            SESSIONS.prewarm([model_name], background=False)
+            mark_startup("modelo cargado")
+        finally:
+            self.ready.set()
+
+    def check_ready(self):
+        if not self.ready.is_set():
+            self.root.after(100, self.check_ready)
+            return
+        self.ready_label.config(text="● Listo", fg="#27ae60")
+        if PROFILE_IMPORTS:
+            print(format_import_profile(), file=sys.stderr)
+
+    def model_choice(self):
+        label = self.model_var.get()
+        return next(c for c in MODEL_CHOICES if MODEL_CHOICE_LABELS[c] == label)
+
+    def model_name(self, pixels=0):
+        """Modelo para una imagen de `pixels` píxeles; en automático depende de su tamaño."""
+        name = resolve_mode(self.model_choice() if self.mode == "objetos" else self.mode, pixels)
+        # La precisión elegida solo se aplica si ese modelo tiene la variante
+        variant = self.variant_var.get()
+        if variant != "fp32" and variant in available_variants(name):
+            name = f"{name}_{variant}"
+        return name
+
+    def matting_backend(self):
+        label = self.matting_var.get()
+        return next(b for b in MATTING_BACKENDS if MATTING_LABELS[b] == label)
+
+    def preview_mode(self):
+        label = self.preview_var.get()
+        return next(m for m in PREVIEW_MODES if PREVIEW_LABELS[m] == label)
+
     def update_mode(self):
-        self.mode = self.mode_var.get()
+        mode = self.mode_var.get()
+        # Seleccionar área usa el modelo de objetos sobre las zonas marcadas
+        self.area_mode = mode == "area"
+        if self.area_mode:
+            self.status_label.config(text="Modo seleccionado: Seleccionar área\nElige una imagen y marca las zonas a conservar")
+            return
+        self.mode = mode
         self.status_label.config(text=f"Modo seleccionado: {'Personas' if self.mode == 'personas' else 'Objetos'}")
         
     def select_image(self):
-        if self.processing:
-            messagebox.showwarning("Advertencia", "Ya hay un proceso en ejecución")
-            return
-            
         filetypes = [
             ("Imágenes", "*.png;*.jpg;*.jpeg;*.bmp")
         ]
         
-        input_path = filedialog.askopenfilename(filetypes=filetypes)
-        if input_path:
-            img_size = os.path.getsize(input_path) / (1024 * 1024)  # MB
-            if img_size > 10:
-                if not messagebox.askyesno(
-                    "Advertencia", 
-                    f"La imagen es grande ({img_size:.1f}MB) y puede tardar. ¿Continuar?"
-                ):
+        if self.area_mode:
+            input_path = filedialog.askopenfilename(filetypes=filetypes)
+            if input_path:
+                self.open_area_editor(input_path)
+            return
+        input_paths = filedialog.askopenfilenames(filetypes=filetypes)
+        if input_paths:
+            self.enqueue(input_paths)
+
+    def on_drop(self, event):
+        paths = []
+        for path in self.root.tk.splitlist(event.data):
+            if os.path.isdir(path):
+                paths.extend(input_path for input_path, _ in collect_inputs([path]))
+            elif path.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(path)
+        if paths and self.area_mode:
+            self.open_area_editor(paths[0])
+        elif paths:
+            self.enqueue(paths)
+
+    def enqueue(self, input_paths):
+        big = [p for p in input_paths if os.path.getsize(p) > 10 * 1024 * 1024]
+        if big:
+            text = (
+                f"La imagen es grande ({os.path.getsize(big[0]) / (1024 * 1024):.1f}MB)"
+                if len(big) == 1 else f"{len(big)} imágenes son grandes (más de 10MB)"
+            )
+            if not messagebox.askyesno("Advertencia", f"{text} y puede tardar. ¿Continuar?"):
+                return
+
+        auto = self.mode == "objetos" and self.model_choice() == "auto"
+        options = matting_options(self.matting_backend())
+        preview_mode = self.preview_mode()
+        if not self.active_jobs():
+            self.batch_ids = []
+        for input_path in input_paths:
+            pixels = 0
+            if auto:
+                try:
+                    pixels = image_pixels(input_path)
+                except (OSError, ValueError):
+                    pass
+            job = QueueJob(input_path, self.model_name(pixels), options, self.mode, preview_mode)
+            self.jobs[job.id] = job
+            self.batch_ids.append(job.id)
+            self.pending.put(job)
+            if self.queue_window is not None:
+                self.add_tile(job)
+
+        self.progress.pack(pady=10, before=self.status_label)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.btn_cancel.pack(pady=(0, 5), before=self.status_label)
+        self.btn_queue.config(state=tk.NORMAL)
+        self.ensure_workers()
+        self.update_summary()
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.status in (QueueJob.PENDING, QueueJob.RUNNING)]
+
+    def ensure_workers(self):
+        with self._workers_lock:
+            while self._workers < self.max_workers:
+                self._workers += 1
+                threading.Thread(target=self.worker, daemon=True).start()
+
+    def set_workers(self):
+        try:
+            self.max_workers = max(1, min(GUI_MAX_WORKERS, int(self.workers_var.get())))
+        except (tk.TclError, ValueError):
+            return
+        self.ensure_workers()
+
+    def worker(self):
+        """Hilo de trabajo: toma imágenes de la cola hasta que sobra."""
+        while True:
+            with self._workers_lock:
+                if self._workers > self.max_workers:
+                    self._workers -= 1
                     return
-            
-            self.processing = True
-            self.btn_select.config(state=tk.DISABLED)
-            self.status_label.config(text="Descargando modelo de IA...")
-            self.root.update_idletasks()
-            
-            threading.Thread(
-                target=self.process_image,
-                args=(input_path,),
-                daemon=True
-            ).start()
-    
-    def process_image(self, input_path):
+            try:
+                job = self.pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if not job.cancel.is_set():
+                self.process_image(job)
+
+    def cancel_job(self):
+        for job in self.active_jobs():
+            job.cancel.set()
+            if job.status == QueueJob.PENDING:
+                self.on_job_cancelled(job.id)
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.status_label.config(text="Cancelando…")
+
+    def retry_job(self, job):
+        if job.status in (QueueJob.FAILED, QueueJob.CANCELLED):
+            self.requeue(job)
+
+    def requeue(self, job):
+        if not self.active_jobs():
+            self.batch_ids = []
+        job.reset()
+        self.batch_ids.append(job.id)
+        self.pending.put(job)
+        self.update_tile(job)
+        self.progress.pack(pady=10, before=self.status_label)
+        self.btn_cancel.config(state=tk.NORMAL)
+        self.btn_cancel.pack(pady=(0, 5), before=self.status_label)
+        self.ensure_workers()
+        self.update_summary()
+
+    def retry_failed(self):
+        for job in list(self.jobs.values()):
+            self.retry_job(job)
+
+    def post(self, kind, *args):
+        """Envía un evento al hilo de la interfaz (único que toca los widgets)."""
+        self.events.put((kind, args))
+
+    def poll_events(self):
         try:
-            model_filename = "u2net_human_seg.onnx" if self.mode == "personas" else "u2net.onnx"
-            model_path = os.path.join(CACHE_DIR, model_filename)
-            
-            self.progress.pack()
-            self.progress['value'] = 0
-            self.root.update_idletasks()
-            
-            if not os.path.exists(model_path):
-                self.download_model(model_path)
-            
-            self.status_label.config(text="Procesando imagen (esto puede tardar)...")
-            self.progress['value'] = 50 
-            self.root.update_idletasks()
-            
-            start_time = time.time()
-            with open(input_path, 'rb') as f:
-                input_image = f.read()
-            
-            session = new_session("u2net_human_seg" if self.mode == "personas" else "u2net")
-            output_image = remove(
-                input_image, 
-                session=session,
-                alpha_matting=True,
-                alpha_matting_foreground_threshold=240,
-                alpha_matting_background_threshold=10,
-                alpha_matting_erode_size=10
-            )
-            
-            processing_time = time.time() - start_time
-            self.progress['value'] = 100
-            self.root.update_idletasks()
-            
-            self.current_image = Image.open(BytesIO(output_image))
-            base_name = os.path.splitext(input_path)[0]
-            self.output_path = f"{base_name}_sin_fondo.png"
+            while True:
+                kind, args = self.events.get_nowait()
+                getattr(self, f"on_{kind}")(*args)
+        except queue.Empty:
+            pass
+        self.root.after(50, self.poll_events)
+
+    def update_summary(self, job=None):
+        batch = [self.jobs[job_id] for job_id in self.batch_ids if job_id in self.jobs]
+        finished = sum(1 for j in batch if j.status not in (QueueJob.PENDING, QueueJob.RUNNING))
+        running = [j for j in batch if j.status == QueueJob.RUNNING]
+        if batch:
+            self.progress['value'] = (finished + sum(j.percent for j in running) / 100) / len(batch) * 100
+        self.btn_queue.config(text=f"Cola ({len(self.jobs)})")
+        if job is not None and job.status == QueueJob.RUNNING:
+            text = f"{job.name}: {job.message}"
+            if len(batch) > 1:
+                text = f"Imagen {finished + 1} de {len(batch)} · {text}"
+            self.status_label.config(text=text)
+
+    def on_job_started(self, job_id):
+        job = self.jobs[job_id]
+        job.status = QueueJob.RUNNING
+        job.message = "Iniciando…"
+        self.update_tile(job)
+        self.update_summary(job)
+
+    def on_job_progress(self, job_id, stage, percent, eta):
+        job = self.jobs[job_id]
+        if job.status != QueueJob.RUNNING:
+            return
+        job.percent = percent
+        job.message = f"{STAGE_LABELS.get(stage, stage)}… {percent:.0f}%"
+        if eta is not None:
+            job.message += f" · quedan ~{eta:.0f} s"
+        self.update_tile(job)
+        self.update_summary(job)
+
+    def on_download(self, downloaded, total):
+        self.status_label.config(
+            text=f"Descargando modelo de IA… {downloaded / 1048576:.0f} / {total / 1048576:.0f} MB"
+        )
+
+    def on_job_done(self, job_id, output_image, thumbnail, processing_time):
+        job = self.jobs[job_id]
+        job.status = QueueJob.DONE
+        job.percent = 100
+        job.elapsed = processing_time
+        job.message = f"Listo en {processing_time:.1f}s ({job.model_name})"
+        job.thumbnail = thumbnail
+        job.photo = None
+        job.proxy_mask = None
+        job.preview = output_image if job.result_file else None
+        self.update_tile(job)
+        if self.selected_job is None or self.selected_job == job.id:
+            self.show_job(job, output_image)
+        self.refresh_previews(job, output_image)
+        self.job_finished(job)
+        if job.save_path:
+            save_path, job.save_path = job.save_path, None
+            self.export_image(output_image, job.result_file, save_path)
+
+    def on_job_proxy(self, job_id, proxy, mask, thumbnail, final):
+        """Vista rápida lista: se muestra ya y se sustituye cuando llegue el recorte refinado."""
+        job = self.jobs[job_id]
+        if job.status != QueueJob.RUNNING:
+            return
+        job.proxy_mask = mask
+        job.preview = proxy
+        job.thumbnail = thumbnail
+        job.photo = None
+        if final:
+            job.status = QueueJob.DONE
+            job.percent = 100
+            job.message = "Vista rápida · se refina al guardar"
+        else:
+            job.message = "Vista rápida · refinando…"
+        self.update_tile(job)
+        if self.selected_job is None or self.selected_job == job.id:
+            self.show_job(job, proxy)
+        if final:
+            self.job_finished(job)
+        else:
+            self.update_summary(job)
+
+    def refine_job(self, job, save_path):
+        """Guardar una vista rápida: se refina a resolución completa y se guarda al terminar."""
+        job.save_path = save_path
+        if job.status == QueueJob.DONE:
+            self.requeue(job)
+        self.status_label.config(text=f"{job.name}: refinando a resolución completa para guardar…")
+
+    def on_job_cancelled(self, job_id):
+        job = self.jobs[job_id]
+        job.status = QueueJob.CANCELLED
+        job.message = "Cancelada"
+        self.update_tile(job)
+        self.job_finished(job)
+
+    def on_job_failed(self, job_id, message):
+        job = self.jobs[job_id]
+        job.status = QueueJob.FAILED
+        job.message = f"Error: {message}"
+        self.update_tile(job)
+        if len(self.batch_ids) == 1:
+            messagebox.showerror("Error", f"Ocurrió un error: {message}")
+        self.job_finished(job)
+
+    def job_finished(self, job):
+        self.update_summary()
+        if self.active_jobs():
+            return
+        batch = [self.jobs[job_id] for job_id in self.batch_ids if job_id in self.jobs]
+        done = [j for j in batch if j.status == QueueJob.DONE]
+        failed = sum(1 for j in batch if j.status == QueueJob.FAILED)
+        self.progress.pack_forget()
+        self.btn_cancel.pack_forget()
+        if len(batch) == 1 and done:
             self.status_label.config(
-                text=f"¡Procesado en {processing_time:.1f}s!\nModo: {'Personas' if self.mode == 'personas' else 'Objetos'}\n"
+                text=f"¡Procesado en {done[0].elapsed:.1f}s!\nModo: {'Personas' if done[0].mode == 'personas' else 'Objetos'}\n"
             )
-            
-            notification.notify(
-                title='Fondo Removido',
-                message=f"¡La imagen ha sido procesada!",
-                timeout=10,
-                app_name="EFI",
-                app_icon=resource_path("resources/efi-icon.ico")
+        elif len(batch) == 1:
+            self.status_label.config(text=batch[0].message if batch else "")
+        else:
+            text = f"¡{len(done)} de {len(batch)} imágenes procesadas!"
+            if failed:
+                text += f"\n{failed} con error: puedes reintentarlas desde la cola"
+            self.status_label.config(text=text)
+        if done:
+            threading.Thread(target=self.notify_done, args=(len(done),), daemon=True).start()
+
+    def notify_done(self, count):
+        plyer.notification.notify(
+            title='Fondo Removido',
+            message="¡La imagen ha sido procesada!" if count == 1 else f"¡{count} imágenes procesadas!",
+            timeout=10,
+            app_name="EFI",
+            app_icon=resource_path("resources/efi-icon.ico")
+        )
+
+    def show_job(self, job, output_image):
+        self.current_job = job
+        self.current_image = output_image
+        self.result_file = job.result_file
+        self.output_path = job.output_path
+        self.btn_preview.config(state=tk.NORMAL)
+        self.btn_save.config(state=tk.NORMAL)
+
+    def select_job(self, job):
+        """Convierte en imagen actual un resultado de la cola."""
+        if job.status != QueueJob.DONE and job.preview is None:
+            return
+        self.selected_job = job.id
+        if job.preview is not None:
+            self.show_job(job, job.preview)
+        else:
+            # Solo se guardan miniaturas: el recorte sale de la caché de resultados
+            threading.Thread(target=self.load_job_result, args=(job,), daemon=True).start()
+        if self.queue_window is not None:
+            for tile_id, tile in self.tiles.items():
+                tile["frame"].config(bg="#3498db" if tile_id == job.id else "#ffffff")
+
+    def load_job_result(self, job):
+        try:
+            self.post("job_loaded", job.id, self.job_result(job))
+        except Exception as e:
+            self.post("job_failed", job.id, str(e))
+
+    def on_job_loaded(self, job_id, output_image):
+        if self.selected_job == job_id:
+            self.show_job(self.jobs[job_id], output_image)
+
+    def job_result(self, job):
+        mask = job.proxy_mask
+        with open(job.input_path, "rb") as f:
+            return remove_background(
+                f.read(), job.model_name, job.options, predict=mask_predictor(mask) if mask is not None else None
             )
+
+    def process_image(self, job):
+        """Hilo de trabajo: no toca widgets, solo envía eventos con `post`."""
+        self.post("job_started", job.id)
+        try:
+            model_path = os.path.join(CACHE_DIR, f"{job.model_name}.onnx")
+            with self._download_lock:
+                if not os.path.exists(model_path):
+                    self.download_model(model_path, job.cancel)
             
-            self.btn_preview.config(state=tk.NORMAL)
-            self.btn_save.config(state=tk.NORMAL)
+            start_time = time.time()
+            large = image_pixels(job.input_path) > LARGE_IMAGE_PIXELS
+            if large:
+                weights = StageProgress.LARGE_WEIGHTS
+            else:
+                # El PNG se codifica al guardar, no durante el proceso
+                weights = {k: v for k, v in StageProgress.WEIGHTS.items() if k != "guardar"}
+            progress = StageProgress(lambda *event: self.post("job_progress", job.id, *event), job.cancel, weights)
+            with profile_job(f"gui_{job.id}"):
+                if large:
+                    # Imagen enorme: el resultado va directo a disco y aquí solo queda la vista previa
+                    job.result_file = os.path.join(CACHE_DIR, "grandes", f"{job.id}.png")
+                    os.makedirs(os.path.dirname(job.result_file), exist_ok=True)
+                    output_image = process_large_image(
+                        job.input_path, job.result_file, job.model_name, job.options, progress=progress
+                    )
+                else:
+                    with open(job.input_path, 'rb') as f:
+                        input_image = f.read()
+                    output_image, predict = None, None
+                    if job.proxy_mask is not None:
+                        # Refinado al guardar: se reutiliza la máscara de la vista rápida
+                        predict = mask_predictor(job.proxy_mask)
+                    elif job.preview_mode != "completa":
+                        output_image = cutout_from_cache(RESULTS, input_image, job.model_name, job.options)[1]
+                        if output_image is None:
+                            proxy, mask = proxy_cutout(input_image, job.model_name)
+                            progress.check()
+                            final = job.preview_mode == "al_guardar"
+                            self.post("job_proxy", job.id, proxy, mask, self.make_thumbnail(proxy), final)
+                            if final:
+                                return
+                            predict = mask_predictor(mask)
+                    if output_image is None:
+                        output_image = remove_background(
+                            input_image, job.model_name, job.options, predict=predict, progress=progress
+                        )
+            progress.check()
+            
+            processing_time = time.time() - start_time
+            self.post("job_done", job.id, output_image, self.make_thumbnail(output_image), processing_time)
             
+        except JobCancelled:
+            self.post("job_cancelled", job.id)
         except Exception as e:
-            self.status_label.config(text=f"Error: {str(e)}")
-            messagebox.showerror("Error", f"Ocurrió un error: {str(e)}")
-        finally:
-            self.processing = False
-            self.progress.pack_forget()
-            self.btn_select.config(state=tk.NORMAL)
-            self.root.update_idletasks()
+            self.post("job_failed", job.id, str(e))
     
-    def download_model(self, model_path):
+    def download_model(self, model_path, cancel):
         try:
-            key = "personas" if model_path.endswith("u2net_human_seg.onnx") else "objetos"
-            model_url = MODEL_URLS[key]
-
-            response = requests.get(model_url, stream=True, timeout=60, verify=certifi.where())
-            response.raise_for_status()
+            def on_progress(downloaded, total):
+                if cancel.is_set():
+                    raise JobCancelled()
+                if total:
+                    self.post("download", downloaded, total)
 
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+            model_name = os.path.splitext(os.path.basename(model_path))[0]
+            ensure_model(model_name, progress=on_progress)
 
-            with open(model_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size:
-                            progress = int((downloaded / total_size) * 100)
-                            self.progress['value'] = progress
-                            self.root.update_idletasks()
+        except JobCancelled:
+            raise
+        except Exception as e:
+            raise ValueError(f"Error al descargar el modelo: {e}")
 
-            if os.path.getsize(model_path) < 50_000_000:
-                raise ValueError("El modelo descargado está incompleto")
+    def make_thumbnail(self, image):
+        thumb = image.copy()
+        thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), reducing_gap=2.0)
+        return composite_on_checkerboard(thumb, 8)
 
+    # --------------- Seleccionar área ----------------------------
+    def open_area_editor(self, input_path):
+        try:
+            # Solo la cabecera: decodificar y reducir una foto grande se hace fuera del hilo de la interfaz
+            model_name = self.model_name(image_pixels(input_path))
         except Exception as e:
-            raise ValueError(f"Error al descargar el modelo: {e}")
+            messagebox.showerror("Error", f"No se pudo abrir la imagen: {e}")
+            return
+        screen = (self.root.winfo_screenwidth() * 0.7, self.root.winfo_screenheight() * 0.7)
+        matting = matting_options(self.matting_backend())
+        self.status_label.config(text="Abriendo la imagen…")
+
+        def load():
+            try:
+                image = decode_image(input_path)
+                area = AreaCutout(image, model_name, matting)
+                scale = min(1.0, screen[0] / image.width, screen[1] / image.height)
+                view = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                base = np.asarray(area.image.resize(view, Image.LANCZOS, reducing_gap=2.0), dtype=np.float32)
+            except Exception as e:
+                self.post("area_loaded", input_path, e, None, None)
+                return
+            self.post("area_loaded", input_path, area, scale, base)
+
+        threading.Thread(target=load, daemon=True).start()
+
+    def on_area_loaded(self, input_path, area, scale, base):
+        if isinstance(area, Exception):
+            self.status_label.config(text="")
+            messagebox.showerror("Error", f"No se pudo abrir la imagen: {area}")
+            return
+        self.status_label.config(text="Marca las zonas a conservar en la ventana de selección")
+
+        win = tk.Toplevel(self.root)
+        win.title(f"Seleccionar área - {os.path.basename(input_path)}")
+        win.configure(bg="#f5f5f5")
+        win.bind("<Destroy>", lambda event: area.close() if event.widget is win else None)
+
+        view = (base.shape[1], base.shape[0])
+        shown = np.zeros((view[1], view[0]), dtype=np.float32)
+        state = {"start": None, "rect": None, "busy": 0}
+
+        canvas = tk.Canvas(win, width=view[0], height=view[1], highlightthickness=0, cursor="crosshair")
+        canvas.pack(padx=10, pady=10)
+        image_item = canvas.create_image(0, 0, anchor="nw")
+        hint = "Arrastrar: añadir zona · Clic: zona alrededor del punto · Botón derecho: borrar"
+        status = tk.Label(win, text=hint, font=("Segoe UI", 9), fg="#7f8c8d", bg="#f5f5f5")
+
+        def render():
+            # Lo que no está seleccionado se ve oscurecido
+            weight = 0.35 + 0.65 * shown[..., None]
+            photo = ImageTk.PhotoImage(Image.fromarray((base * weight).astype(np.uint8)))
+            canvas.itemconfig(image_item, image=photo)
+            canvas.image = photo
+
+        def refresh(changed):
+            if not win.winfo_exists():
+                return
+            state["busy"] -= 1
+            status.config(text="Procesando zona…" if state["busy"] else hint)
+            if isinstance(changed, Exception):
+                messagebox.showerror("Error", f"No se pudo procesar la zona: {changed}", parent=win)
+                return
+            if changed is None:
+                return
+            # Solo se actualiza en pantalla la parte del lienzo que cambió
+            x0, y0, x1, y1 = changed
+            dx0, dy0 = int(x0 * scale), int(y0 * scale)
+            dx1, dy1 = min(view[0], -int(-x1 * scale // 1)), min(view[1], -int(-y1 * scale // 1))
+            if dx1 <= dx0 or dy1 <= dy0:
+                return
+            alpha = area.alpha_region((int(dx0 / scale), int(dy0 / scale), int(dx1 / scale), int(dy1 / scale)))
+            shown[dy0:dy1, dx0:dx1] = cv2.resize(alpha, (dx1 - dx0, dy1 - dy0), interpolation=cv2.INTER_AREA) / 255.0
+            render()
+
+        def run(func):
+            state["busy"] += 1
+            status.config(text="Procesando zona…")
+            area.submit(func, lambda changed: self.post("area_ready", refresh, changed))
+
+        def on_press(event, erase=False):
+            state["start"] = (event.x, event.y)
+            state["rect"] = canvas.create_rectangle(
+                event.x, event.y, event.x, event.y,
+                outline="#c0392b" if erase else "#3498db", width=2, dash=(4, 2)
+            )
+
+        def on_drag(event):
+            if state["rect"] is not None:
+                canvas.coords(state["rect"], *state["start"], event.x, event.y)
+
+        def on_release(event, erase=False):
+            if state["rect"] is None:
+                return
+            canvas.delete(state["rect"])
+            state["rect"] = None
+            x, y = state["start"]
+            if abs(event.x - x) < 4 and abs(event.y - y) < 4:
+                box = area.point_box(event.x / scale, event.y / scale)
+            else:
+                box = (x / scale, y / scale, event.x / scale, event.y / scale)
+            run(lambda: area.add(box, erase))
+
+        def use_result():
+            self.current_job = None
+            self.current_image = area.result()
+            self.result_file = None
+            self.output_path = f"{os.path.splitext(input_path)[0]}{OUTPUT_SUFFIX}"
+            self.btn_preview.config(state=tk.NORMAL)
+            self.btn_save.config(state=tk.NORMAL)
+            self.status_label.config(text="Recorte por zonas listo: revisa la vista previa o guárdalo")
+
+        canvas.bind("<ButtonPress-1>", on_press)
+        canvas.bind("<B1-Motion>", on_drag)
+        canvas.bind("<ButtonRelease-1>", on_release)
+        canvas.bind("<ButtonPress-3>", lambda e: on_press(e, erase=True))
+        canvas.bind("<B3-Motion>", on_drag)
+        canvas.bind("<ButtonRelease-3>", lambda e: on_release(e, erase=True))
+        render()
+
+        btn_frame = tk.Frame(win, bg="#f5f5f5")
+        btn_frame.pack(pady=(0, 5))
+        Button(btn_frame, text="Deshacer", command=lambda: run(area.undo)).pack(side=tk.LEFT, padx=5)
+        Button(btn_frame, text="Limpiar", command=lambda: run(area.clear)).pack(side=tk.LEFT, padx=5)
+        Button(btn_frame, text="Usar recorte", command=use_result, style="Accent.TButton").pack(side=tk.LEFT, padx=5)
+        status.pack(pady=(0, 10))
+
+    def on_area_ready(self, refresh, changed):
+        refresh(changed)
+
+    # --------------- Cola de imágenes ----------------------------
+    def show_queue(self):
+        if self.queue_window is not None:
+            self.queue_window.lift()
+            return
+
+        win = tk.Toplevel(self.root)
+        win.title("Cola de imágenes")
+        win.geometry("760x520")
+        win.configure(bg="#f5f5f5")
+        win.protocol("WM_DELETE_WINDOW", self.close_queue)
+        self.queue_window = win
+
+        toolbar = tk.Frame(win, bg="#f5f5f5", padx=10, pady=8)
+        toolbar.pack(fill=tk.X)
+
+        tk.Label(toolbar, text="Simultáneas:", font=("Segoe UI", 10), bg="#f5f5f5").pack(side=tk.LEFT)
+        tk.Spinbox(
+            toolbar,
+            from_=1,
+            to=GUI_MAX_WORKERS,
+            width=3,
+            textvariable=self.workers_var,
+            command=self.set_workers
+        ).pack(side=tk.LEFT, padx=(5, 15))
+
+        Button(toolbar, text="Añadir…", command=self.select_image, style="TButton").pack(side=tk.LEFT, padx=5)
+        Button(toolbar, text="Reintentar fallidas", command=self.retry_failed, style="TButton").pack(side=tk.LEFT, padx=5)
+        Button(toolbar, text="Guardar todas", command=self.save_all, style="TButton").pack(side=tk.LEFT, padx=5)
+        Button(toolbar, text="Quitar terminadas", command=self.clear_finished, style="TButton").pack(side=tk.LEFT, padx=5)
+
+        body = tk.Frame(win, bg="#f5f5f5")
+        body.pack(fill=tk.BOTH, expand=True)
+        canvas = tk.Canvas(body, bg="#f5f5f5", highlightthickness=0)
+        scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=canvas.yview)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.grid_frame = tk.Frame(canvas, bg="#f5f5f5")
+        canvas.create_window((0, 0), window=self.grid_frame, anchor="nw")
+        self.grid_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+
+        self.tiles = {}
+        for job in self.jobs.values():
+            self.add_tile(job)
+
+    def close_queue(self):
+        self.queue_window.destroy()
+        self.queue_window = None
+        self.tiles = {}
+
+    def add_tile(self, job):
+        index = len(self.tiles)
+        frame = tk.Frame(self.grid_frame, bg="#ffffff", padx=4, pady=4)
+        frame.grid(row=index // QUEUE_COLUMNS, column=index % QUEUE_COLUMNS, padx=6, pady=6, sticky="n")
+
+        image_label = tk.Label(frame, bg="#ffffff", width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, cursor="hand2")
+        image_label.pack()
+        tk.Label(frame, text=job.name[:18], font=("Segoe UI", 9), bg="#ffffff").pack()
+        status_label = tk.Label(frame, font=("Segoe UI", 8), fg="#7f8c8d", bg="#ffffff", wraplength=THUMBNAIL_SIZE + 10)
+        status_label.pack()
+        retry_btn = Button(frame, text="Reintentar", command=lambda: self.retry_job(job), style="Toolbutton")
+
+        for widget in (frame, image_label):
+            widget.bind("<Button-1>", lambda e: self.select_job(job))
+            widget.bind("<Double-Button-1>", lambda e: (self.select_job(job), self.show_preview()))
+
+        self.tiles[job.id] = {
+            "frame": frame,
+            "image": image_label,
+            "status": status_label,
+            "retry": retry_btn,
+        }
+        self.update_tile(job)
+
+    def update_tile(self, job):
+        tile = self.tiles.get(job.id) if self.queue_window is not None else None
+        if tile is None:
+            return
+        if job.thumbnail is not None and job.photo is None:
+            job.photo = ImageTk.PhotoImage(job.thumbnail)
+        if job.photo is not None:
+            # Con imagen, width/height del Label pasan a medirse en píxeles
+            tile["image"].config(image=job.photo, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE)
+        else:
+            tile["image"].config(text="⏳", font=("Segoe UI", 20), width=6, height=3)
+        colors = {
+            QueueJob.DONE: "#27ae60",
+            QueueJob.FAILED: "#c0392b",
+            QueueJob.CANCELLED: "#7f8c8d",
+        }
+        tile["status"].config(text=job.message or "En cola", fg=colors.get(job.status, "#2c3e50"))
+        if job.status in (QueueJob.FAILED, QueueJob.CANCELLED):
+            tile["retry"].pack()
+        else:
+            tile["retry"].pack_forget()
+
+    def clear_finished(self):
+        for job_id, job in list(self.jobs.items()):
+            if job.status in (QueueJob.DONE, QueueJob.CANCELLED):
+                del self.jobs[job_id]
+                if job.result_file and job.result_file != self.result_file:
+                    try:
+                        os.remove(job.result_file)
+                    except OSError:
+                        pass
+        if self.queue_window is not None:
+            for tile in self.tiles.values():
+                tile["frame"].destroy()
+            self.tiles = {}
+            for job in self.jobs.values():
+                self.add_tile(job)
+        self.update_summary()
+
+    def save_all(self):
+        done = [job for job in self.jobs.values() if job.status == QueueJob.DONE]
+        if not done:
+            messagebox.showinfo("Cola", "Todavía no hay imágenes procesadas")
+            return
+        threading.Thread(target=self.save_jobs, args=(done,), daemon=True).start()
+
+    def save_jobs(self, jobs):
+        saved = 0
+        errors = []
+        for job in jobs:
+            try:
+                if job.result_file:
+                    shutil.copyfile(job.result_file, job.output_path)
+                else:
+                    save_image(self.job_result(job), job.output_path)
+                saved += 1
+            except Exception as e:
+                errors.append(f"{job.name}: {e}")
+        self.post("saved", saved, errors)
+
+    def on_saved(self, saved, errors):
+        if errors:
+            messagebox.showerror("Error", "No se pudieron guardar:\n" + "\n".join(errors[:10]))
+        messagebox.showinfo("Éxito", f"{saved} imágenes guardadas junto a sus originales (*{OUTPUT_SUFFIX})")
     
     def show_preview(self):
         if not self.current_image:
@@ -514,18 +5439,92 @@ class BackgroundRemoverApp:
         max_height = int(screen_height * 0.8)
         
         ratio = min(max_width/img_width, max_height/img_height)
-        new_size = (int(img_width * ratio), int(img_height * ratio))
-        
-        preview_image = self.current_image.resize(new_size, Image.LANCZOS)
-        
-        checker = self.create_checkerboard()
-        bg = self.tile_pattern(preview_image.size, checker)
-        bg.paste(preview_image, (0, 0), preview_image if preview_image.mode == 'RGBA' else None)
-        
-        preview_photo = ImageTk.PhotoImage(bg)
-        preview_label = tk.Label(preview_window, image=preview_photo)
-        preview_label.image = preview_photo
-        preview_label.pack(padx=10, pady=10)
+        view_size = (max(1, int(img_width * ratio)), max(1, int(img_height * ratio)))
+
+        # La pirámide se reutiliza mientras no cambie la imagen actual
+        if self._pyramid is None or self._pyramid.levels[0] is not self.current_image:
+            self._pyramid = PreviewPyramid(self.current_image)
+        state = {
+            "pyramid": self._pyramid, "size": (img_width, img_height), "fit": ratio,
+            "zoom": ratio, "center": (img_width / 2, img_height / 2), "drag": None, "pending": False,
+        }
+
+        canvas = tk.Canvas(
+            preview_window, width=view_size[0], height=view_size[1],
+            highlightthickness=0, cursor="fleur"
+        )
+        canvas.pack(padx=10, pady=10)
+        image_item = canvas.create_image(0, 0, anchor="nw")
+
+        def render():
+            state["pending"] = False
+            photo = ImageTk.PhotoImage(state["pyramid"].render(view_size, state["zoom"], state["center"]))
+            canvas.itemconfig(image_item, image=photo)
+            canvas.image = photo
+
+        def schedule():
+            # Varios eventos seguidos de la rueda o del arrastre se pintan una sola vez
+            if not state["pending"]:
+                state["pending"] = True
+                preview_window.after_idle(render)
+
+        def clamp_center(cx, cy):
+            width, height = state["size"]
+            return min(max(cx, 0), width), min(max(cy, 0), height)
+
+        def zoom_at(factor, x, y):
+            zoom = min(max(state["zoom"] * factor, state["fit"] * PREVIEW_MIN_ZOOM), PREVIEW_MAX_ZOOM)
+            cx, cy = state["center"]
+            # El punto bajo el cursor se queda quieto
+            px = cx + (x - view_size[0] / 2) / state["zoom"]
+            py = cy + (y - view_size[1] / 2) / state["zoom"]
+            state["center"] = clamp_center(px - (x - view_size[0] / 2) / zoom, py - (y - view_size[1] / 2) / zoom)
+            state["zoom"] = zoom
+            schedule()
+
+        def on_wheel(event):
+            up = event.num == 4 or getattr(event, "delta", 0) > 0
+            zoom_at(1.25 if up else 0.8, event.x, event.y)
+
+        def on_press(event):
+            state["drag"] = (event.x, event.y, state["center"])
+
+        def on_drag(event):
+            x, y, (cx, cy) = state["drag"]
+            state["center"] = clamp_center(
+                cx - (event.x - x) / state["zoom"], cy - (event.y - y) / state["zoom"]
+            )
+            schedule()
+
+        def reset(event=None):
+            width, height = state["size"]
+            state["zoom"] = state["fit"]
+            state["center"] = (width / 2, height / 2)
+            schedule()
+
+        def replace(image):
+            # La vista rápida se cambia por el recorte refinado sin mover el encuadre
+            scale = image.width / state["size"][0]
+            state["pyramid"] = self._pyramid = PreviewPyramid(image)
+            state["size"] = image.size
+            state["fit"] /= scale
+            state["zoom"] /= scale
+            state["center"] = (state["center"][0] * scale, state["center"][1] * scale)
+            schedule()
+
+        if self.current_job is not None:
+            self._previews[preview_window] = (self.current_job.id, replace)
+            preview_window.bind(
+                "<Destroy>", lambda e: e.widget is preview_window and self._previews.pop(preview_window, None)
+            )
+
+        canvas.bind("<MouseWheel>", on_wheel)
+        canvas.bind("<Button-4>", on_wheel)
+        canvas.bind("<Button-5>", on_wheel)
+        canvas.bind("<ButtonPress-1>", on_press)
+        canvas.bind("<B1-Motion>", on_drag)
+        canvas.bind("<Double-Button-1>", reset)
+        render()
         
         btn_frame = tk.Frame(preview_window)
         btn_frame.pack(pady=(0, 10))
@@ -535,32 +5534,36 @@ class BackgroundRemoverApp:
             text="Guardar Como", 
             command=self.save_image_as
         ).pack(side=tk.LEFT, padx=5)
+
+        Button(
+            btn_frame,
+            text="Ajustar",
+            command=reset
+        ).pack(side=tk.LEFT, padx=5)
+
+        tk.Label(
+            btn_frame,
+            text="Rueda: zoom · Arrastrar: mover · Doble clic: ajustar",
+            font=("Segoe UI", 9),
+            fg="#7f8c8d"
+        ).pack(side=tk.LEFT, padx=10)
     
-    def create_checkerboard(self, size=20):
-        tile = Image.new('RGB', (size*2, size*2), (255, 255, 255))
-        draw = ImageDraw.Draw(tile)
-        draw.rectangle([0, 0, size, size], fill=(220, 220, 220))
-        draw.rectangle([size, size, size*2, size*2], fill=(220, 220, 220))
-        return tile
-    
-    def tile_pattern(self, image_size, pattern):
-        width, height = image_size
-        pattern_width, pattern_height = pattern.size
-        tiles_x = (width // pattern_width) + 2
-        tiles_y = (height // pattern_height) + 2
-        
-        bg = Image.new('RGB', 
-                      (pattern_width * tiles_x, pattern_height * tiles_y))
-        for y in range(tiles_y):
-            for x in range(tiles_x):
-                bg.paste(pattern, (x * pattern_width, y * pattern_height))
-        
-        return bg.crop((0, 0, width, height))
-    
+    def refresh_previews(self, job, output_image):
+        for job_id, replace in list(self._previews.values()):
+            if job_id == job.id:
+                replace(output_image)
+
     def save_result(self):
+        job = self.current_job
+        if job is not None and job.proxy_mask is not None and self.current_image is job.preview:
+            self.refine_job(job, self.output_path)
+            return
         if self.current_image and self.output_path:
             try:
-                self.current_image.save(self.output_path)
+                if self.result_file:
+                    shutil.copyfile(self.result_file, self.output_path)
+                else:
+                    save_image(self.current_image, self.output_path)
                 messagebox.showinfo("Éxito", f"Imagen guardada en:\n{self.output_path}")
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo guardar: {e}")
@@ -573,30 +5576,460 @@ class BackgroundRemoverApp:
             defaultextension=".png",
             filetypes=[
                 ("PNG transparente", "*.png"),
+                ("WebP transparente (más pequeño)", "*.webp"),
+                *([("AVIF transparente", "*.avif")] if avif_available() else []),
                 ("JPEG con fondo blanco", "*.jpg"),
                 ("Todos los archivos", "*.*")
             ]
         )
         
+        if not save_path:
+            return
+        job = self.current_job
+        if job is not None and job.proxy_mask is not None and self.current_image is job.preview:
+            self.refine_job(job, save_path)
+        else:
+            self.export_image(self.current_image, self.result_file, save_path)
+
+    def export_image(self, image, result_file, save_path):
         if save_path:
             try:
-                if save_path.lower().endswith(('.jpg', '.jpeg')):
-                    background = Image.new('RGB', self.current_image.size, (255, 255, 255))
-                    background.paste(self.current_image, (0, 0), self.current_image)
-                    background.save(save_path, quality=95)
+                if result_file and save_path.lower().endswith('.png'):
+                    shutil.copyfile(result_file, save_path)
+                elif result_file:
+                    with Image.open(result_file) as saved:
+                        self.write_export(saved, save_path)
                 else:
-                    self.current_image.save(save_path)
+                    self.write_export(image, save_path)
                 
                 messagebox.showinfo("Éxito", f"Imagen guardada en:\n{save_path}")
             except Exception as e:
                 messagebox.showerror("Error", f"No se pudo guardar: {e}")
     
+    def write_export(self, image, save_path):
+        if save_path.lower().endswith(('.jpg', '.jpeg')):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, (0, 0), image)
+            background.save(save_path, quality=95)
+        else:
+            save_image(image, save_path)
+
     def donate(self):
         webbrowser.open("https://coindrop.to/jesuspineda")
         
-if __name__ == "__main__":
-    root = tk.Tk()
+# --- Línea de comandos ---
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="efi",
+        description="EFI - elimina el fondo de imágenes. Sin argumentos abre la aplicación de escritorio.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch = subparsers.add_parser("batch", help="Procesa carpetas o patrones glob sin interfaz gráfica")
+    batch.add_argument("inputs", nargs="+", help="Carpetas, archivos o patrones glob (p. ej. 'fotos/**/*.jpg')")
+    batch.add_argument("-o", "--output-dir", help="Carpeta de salida (por defecto, junto a cada imagen)")
+    batch.add_argument("--mode", choices=available_modes(), default="objetos",
+                       help="Modo; las variantes cuantizadas se eligen como 'objetos-int8'")
+    batch.add_argument("--latency-target", type=float, default=AUTO_LATENCY_S,
+                       help="Con --mode auto: segundos por imagen como máximo")
+    batch.add_argument("--quality-target", choices=QUALITY_LEVELS, default=AUTO_QUALITY,
+                       help="Con --mode auto: calidad mínima del modelo")
+    batch.add_argument("--io-workers", type=int, default=4, help="Hilos para leer y guardar")
+    batch.add_argument("--infer-workers", type=int, default=1, help="Hilos de inferencia sobre la misma sesión")
+    batch.add_argument("--matte-workers", type=int, default=2, help="Hilos para el recorte (alpha matting)")
+    batch.add_argument("--intra-op-threads", type=int, default=0, help="Hilos internos de onnxruntime (0 = automático)")
+    batch.add_argument("--processes", type=int, default=0, help="Repartir la cadena completa entre N procesos")
+    batch.add_argument("--shared-weights", action="store_true",
+                       help="Los procesos comparten una copia de los pesos y reciben las imágenes por memoria compartida")
+    batch.add_argument("--matting", choices=MATTING_BACKENDS, default="closed_form",
+                       help="Método de recorte: calidad, rápido o solo máscara")
+    batch.add_argument("--large-image-mp", type=float, default=LARGE_IMAGE_PIXELS / 1e6,
+                       help="A partir de estos megapíxeles se procesa por franjas; en ellas closed_form se sustituye por fast")
+    batch.add_argument("--memory-budget-mb", type=int, default=LARGE_IMAGE_BUDGET_MB,
+                       help="Memoria de trabajo en imágenes grandes (sin contar el modelo; WebP/AVIF no se limitan)")
+    batch.add_argument("--batch-size", type=int, default=4, help="Imágenes por ejecución del modelo")
+    batch.add_argument("--max-latency-ms", type=float, default=50, help="Espera máxima para completar un lote")
+    batch.add_argument("--overwrite", action="store_true", help="Reprocesar aunque la salida ya exista")
+    batch.add_argument("--format", choices=OUTPUT_FORMATS, default="png", help="Formato de salida con transparencia")
+    batch.add_argument("--compress-level", type=int, choices=range(10), default=PNG_COMPRESS_LEVEL,
+                       metavar="0-9", help="Compresión PNG: 0 más rápido, 9 más pequeño")
+    batch.add_argument("--quality", type=int, help="Calidad WebP/AVIF con pérdida (WebP sin pérdida si se omite)")
+    batch.add_argument("--no-cache", action="store_true", help="No consultar ni llenar la caché de resultados")
+
+    video = subparsers.add_parser("video", help="Quita el fondo de un vídeo o de una secuencia de imágenes")
+    video.add_argument("input", help="Vídeo, carpeta de fotogramas o patrón glob ('frames/*.png')")
+    video.add_argument("-o", "--output", required=True,
+                       help="Vídeo de salida (.webm/.mov transparente) o carpeta para la secuencia")
+    video.add_argument("--mode", choices=available_modes(), default="objetos", help="Modo del modelo")
+    video.add_argument("--matting", choices=MATTING_BACKENDS, default="mask",
+                       help="Método de recorte por fotograma (por defecto, solo máscara)")
+    video.add_argument("--background", help="Color de fondo (p. ej. '#ffffff') para un vídeo opaco")
+    video.add_argument("--fps", type=float, help="Fotogramas por segundo (por defecto, los del vídeo o 25)")
+    video.add_argument("--format", choices=OUTPUT_FORMATS, default="png", help="Formato de la secuencia de salida")
+    video.add_argument("--compress-level", type=int, choices=range(10), default=PNG_COMPRESS_LEVEL,
+                       metavar="0-9", help="Compresión PNG de la secuencia: 0 más rápido, 9 más pequeño")
+    video.add_argument("--change-threshold", type=float, default=1.5,
+                       help="Cambio medio (niveles de gris) por debajo del cual se reutiliza la máscara")
+    video.add_argument("--max-reuse", type=int, default=4, help="Fotogramas seguidos sin inferencia como máximo")
+    video.add_argument("--smoothing", type=float, default=0.6,
+                       help="Peso de la máscara nueva frente a la anterior (1 = sin suavizado)")
+    video.add_argument("--cut-threshold", type=float, default=20.0,
+                       help="Cambio a partir del cual se considera un corte de escena")
+    video.add_argument("--matte-workers", type=int, default=2, help="Hilos para el recorte y la codificación")
+    video.add_argument("--max-frames", type=int, default=16, help="Fotogramas en memoria como máximo")
+
+    bench = subparsers.add_parser("bench-matting", help="Compara los métodos de recorte")
+    bench.add_argument("images", nargs="*", help="Imágenes propias (por defecto, una sintética)")
+    bench.add_argument("--size", default="3000x2000", help="Tamaño de la imagen sintética, ANCHOxALTO")
+    bench.add_argument("--backends", nargs="+", choices=MATTING_BACKENDS, default=list(MATTING_BACKENDS))
+    bench.add_argument("--json", help="Guardar los resultados en este archivo")
+
+    workers = subparsers.add_parser("bench-workers", help="Memoria por proceso con y sin pesos compartidos")
+    workers.add_argument("--mode", choices=available_modes(), default="objetos")
+    workers.add_argument("--counts", nargs="+", type=int, default=[1, 2, 4], help="Números de procesos a medir")
+    workers.add_argument("--images", type=int, default=8, help="Imágenes sintéticas por medición")
+    workers.add_argument("--json", help="Guardar los resultados en este archivo")
+
+    suite = subparsers.add_parser("bench", help="Mide cada etapa de la cadena y detecta regresiones")
+    suite.add_argument("images", nargs="*", help="Imágenes propias además de las sintéticas")
+    suite.add_argument("--sizes", nargs="*", default=[f"{w}x{h}" for w, h in BENCH_SIZES],
+                       help="Tamaños de las imágenes sintéticas, ANCHOxALTO")
+    suite.add_argument("--mode", choices=available_modes(), default="objetos")
+    suite.add_argument("--matting", choices=MATTING_BACKENDS, default="fast")
+    suite.add_argument("--runs", type=int, default=3, help="Vueltas medidas por caso")
+    suite.add_argument("--json", help="Guardar los resultados en este archivo")
+    suite.add_argument("--baseline", help="JSON de una medición anterior con la que comparar")
+    suite.add_argument("--threshold", type=float, default=10, help="Empeoramiento en %% que cuenta como regresión")
+
+    calibrate = subparsers.add_parser("calibrate", help="Busca la configuración de onnxruntime más rápida")
+    calibrate.add_argument("--mode", choices=available_modes(), default="objetos")
+    calibrate.add_argument("--runs", type=int, default=5, help="Ejecuciones medidas por configuración")
+
+    digests = subparsers.add_parser("model-digests", help="SHA-256 de los modelos publicados, para el registro")
+    digests.add_argument("models", nargs="*", choices=list(MODEL_REGISTRY), default=list(MODEL_REGISTRY),
+                         help="Modelos a comprobar (por defecto, todos); los que falten se descargan")
+
+    quantize = subparsers.add_parser("quantize", help="Genera variantes INT8/FP16 del modelo")
+    quantize.add_argument("--mode", choices=sorted(MODEL_NAMES), default="objetos")
+    quantize.add_argument("--variants", nargs="+", choices=MODEL_VARIANTS, default=["int8"])
+    quantize.add_argument("--calibration", nargs="*", default=[],
+                          help="Imágenes o carpetas para calibrar la variante int8_static")
+    quantize.add_argument("--samples", type=int, default=32, help="Máximo de imágenes de calibración")
+
+    evaluate = subparsers.add_parser("evaluate", help="Compara el modelo FP32 con sus variantes")
+    evaluate.add_argument("images", nargs="*", help="Imágenes de prueba (por defecto, sintéticas)")
+    evaluate.add_argument("--mode", choices=sorted(MODEL_NAMES), default="objetos")
+    evaluate.add_argument("--runs", type=int, default=3)
+    evaluate.add_argument("--json", help="Guardar los resultados en este archivo")
+
+    serve = subparsers.add_parser("serve", help="Servicio HTTP local con el modelo en memoria")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--mode", choices=available_modes(), default="objetos")
+    serve.add_argument("--matting", choices=MATTING_BACKENDS, default="fast")
+    serve.add_argument("--workers", type=int, default=2, help="Peticiones procesadas a la vez (al menos --batch-size)")
+    serve.add_argument("--queue-size", type=int, default=16, help="Peticiones en espera antes de responder 503")
+    serve.add_argument("--batch-size", type=int, default=4)
+    serve.add_argument("--max-latency-ms", type=float, default=10)
+    serve.add_argument("--no-cache", action="store_true", help="No usar la caché de resultados")
+
+    watch = subparsers.add_parser("watch", help="Vigila una carpeta y recorta las imágenes que van llegando")
+    watch.add_argument("folder", help="Carpeta a vigilar (incluye subcarpetas)")
+    watch.add_argument("--mode", choices=available_modes(), default="objetos")
+    watch.add_argument("--matting", choices=MATTING_BACKENDS, default="closed_form")
+    watch.add_argument("--workers", type=int, default=2, help="Hilos con el modelo cargado")
+    watch.add_argument("--processes", type=int, default=0,
+                       help="Usar N procesos con los pesos compartidos en lugar de hilos")
+    watch.add_argument("--settle", type=float, default=WATCH_SETTLE_S,
+                       help="Segundos sin cambios para dar un archivo por copiado")
+    watch.add_argument("--poll", type=float, default=WATCH_POLL_S,
+                       help="Segundos entre revisiones cuando no hay notificaciones")
+    watch.add_argument("--polling", action="store_true", help="Revisar periódicamente aunque haya notificaciones")
+    watch.add_argument("--full-scan", action="store_true",
+                       help="Al arrancar, revisar todas las carpetas y no solo las que cambiaron")
+    watch.add_argument("--journal", help="Archivo del diario (por defecto, en la carpeta de caché)")
+    watch.add_argument("--overwrite", action="store_true", help="Reprocesar aunque el recorte ya exista")
+    watch.add_argument("--format", choices=OUTPUT_FORMATS, default="png", help="Formato de salida con transparencia")
+    watch.add_argument("--compress-level", type=int, choices=range(10), default=PNG_COMPRESS_LEVEL,
+                       metavar="0-9", help="Compresión PNG: 0 más rápido, 9 más pequeño")
+    watch.add_argument("--quality", type=int, help="Calidad WebP/AVIF con pérdida (WebP sin pérdida si se omite)")
+    watch.add_argument("--no-cache", action="store_true", help="No consultar ni llenar la caché de resultados")
+
+    loadtest = subparsers.add_parser("loadtest", help="Prueba de carga contra un servidor 'serve'")
+    loadtest.add_argument("images", nargs="+", help="Imágenes a enviar")
+    loadtest.add_argument("--url", default="http://127.0.0.1:8080")
+    loadtest.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    loadtest.add_argument("--requests", type=int, default=40, help="Peticiones por nivel de concurrencia")
+    loadtest.add_argument("--json", help="Guardar los resultados en este archivo")
+    return parser
+
+def run_serve(args):
+    server = InferenceServer(
+        host=args.host,
+        port=args.port,
+        model_name=resolve_mode(args.mode),
+        options=matting_options(args.matting),
+        workers=args.workers,
+        queue_size=args.queue_size,
+        batch_size=args.batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        cache=None if args.no_cache else RESULTS,
+    )
+    print(f"EFI escuchando en http://{args.host}:{args.port} (Ctrl+C para salir)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_watch(args):
+    if not os.path.isdir(args.folder):
+        print(f"No existe la carpeta {args.folder}")
+        return 1
+    watcher = FolderWatcher(
+        args.folder,
+        model_name=resolve_mode(args.mode),
+        options=matting_options(args.matting),
+        workers=args.workers,
+        processes=args.processes,
+        settle=args.settle,
+        poll=args.poll,
+        journal_path=args.journal,
+        fmt=args.format,
+        compress_level=args.compress_level,
+        quality=args.quality,
+        use_cache=not args.no_cache,
+        overwrite=args.overwrite,
+        polling=args.polling,
+    )
+    print(f"EFI vigilando {watcher.root} (Ctrl+C para salir)")
+    try:
+        watcher.run(full_scan=args.full_scan)
+    except KeyboardInterrupt:
+        pass
+    print(f"Procesadas: {watcher.stats['procesadas']}, errores: {watcher.stats['errores']}")
+    return 0
+
+def run_loadtest(args):
+    images = [path for path, _ in collect_inputs(args.images)]
+    if not images:
+        print("No se encontraron imágenes.")
+        return 1
+    print(f"{'Conc.':>5} {'img/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'503':>10} {'errores':>8}")
+    results = load_test(args.url.rstrip("/"), images, args.concurrency, args.requests, report=print)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+def run_quantize(args):
+    model_name = MODEL_NAMES[args.mode]
+    for variant in args.variants:
+        print(f"Generando {model_name}_{variant}...")
+        path = quantize_model(model_name, variant, args.calibration, args.samples)
+        print(f"  {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return 0
+
+def run_evaluate(args):
+    images = [path for path, _ in collect_inputs(args.images)] if args.images else None
+    try:
+        results = evaluate_variants(MODEL_NAMES[args.mode], images, args.runs, report=print)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    print(format_variant_report(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+def run_calibrate(args):
+    print(f"Proveedores disponibles: {', '.join(available_providers())}")
+    best, _ = calibrate_runtime(resolve_mode(args.mode), args.runs, report=print)
+    print(
+        f"Configuración elegida: {best['providers'][0]}, {best['intra_op_num_threads']} hilos, "
+        f"modo {best['execution_mode']}, grafo {best['graph_optimization_level']}"
+    )
+    print(f"Guardada en {RUNTIME_CONFIG_PATH}")
+    print("Velocidad de los modelos descargados (modo automático):")
+    measure_models(args.runs, report=print)
+    return 0
+
+def run_model_digests(args):
+    status = 0
+    for model_name in args.models:
+        path = ensure_model(model_name)
+        expected = model_checksum(model_name)
+        if expected and not verify_checksum(path, expected):
+            print(f"{model_name}: no coincide con {expected}")
+            status = 1
+            continue
+        print(f'{model_name}: "sha256": "{file_digest(path)}",')
+    return status
+
+def run_bench_workers(args):
+    results = benchmark_workers(resolve_mode(args.mode), args.counts, args.images)
+    print(format_workers_benchmark(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+def run_bench_matting(args):
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    results = benchmark_matting(args.images, (width, height), args.backends)
+    print(format_matting_benchmark(results))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    return 0
+
+def run_bench(args):
+    sizes = [tuple(int(v) for v in size.lower().split("x")) for size in args.sizes]
+    images = [path for path, _ in collect_inputs(args.images)] if args.images else []
+    report = benchmark_pipeline(
+        images, sizes, resolve_mode(args.mode), matting_options(args.matting), args.runs
+    )
+    regressions = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_benchmarks(report, baseline, args.threshold / 100)
+        report["regresiones"] = regressions
+        if (baseline.get("modelo"), baseline.get("recorte")) != (report["modelo"], report["recorte"]):
+            print("Aviso: la referencia se midió con otro modelo o método de recorte.")
+    print(format_pipeline_benchmark(report, regressions))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 1 if regressions else 0
+
+def run_video(args):
+    if os.path.isfile(args.input) and args.input.lower().endswith(VIDEO_EXTENSIONS):
+        source = args.input
+    else:
+        source = sequence_inputs(args.input)
+        if not source:
+            print("No se encontraron fotogramas.")
+            return 1
+        if os.path.isdir(args.input) and os.path.abspath(args.input) == os.path.abspath(args.output):
+            print("La carpeta de salida debe ser distinta de la de entrada.")
+            return 1
+    try:
+        background = ImageColor.getrgb(args.background)[:3] if args.background else None
+    except ValueError:
+        print(f"Color no válido: {args.background}")
+        return 1
+    if os.path.splitext(args.output)[1].lower() in VIDEO_EXTENSIONS:
+        try:
+            VideoOutput.check(args.output, background)
+        except ValueError as e:
+            print(e)
+            return 1
+
+    pipeline = SequencePipeline(
+        model_name=resolve_mode(args.mode),
+        options=matting_options(args.matting),
+        matte_workers=args.matte_workers,
+        max_frames=args.max_frames,
+        change_threshold=args.change_threshold,
+        max_reuse=args.max_reuse,
+        cut_threshold=args.cut_threshold,
+        smoothing=args.smoothing,
+        background=background,
+        fps=args.fps,
+        fmt=args.format,
+        compress_level=args.compress_level,
+    )
+    print(f"Procesando {args.input}...")
+    stats = pipeline.run(source, args.output)
+    print(format_sequence_summary(stats))
+    return 1 if stats["errores"] else 0
+
+def run_batch(args):
+    if args.format == "avif" and not avif_available():
+        print("AVIF no está disponible: instala Pillow 11.2+ o pillow-avif-plugin")
+        return 1
+    jobs = collect_inputs(args.inputs, args.output_dir, args.format)
+    if not jobs:
+        print("No se encontraron imágenes.")
+        return 1
+
+    model_name = resolve_mode(args.mode)
+    if args.mode == "auto":
+        # Un solo modelo para todo el lote, elegido por el tamaño típico de sus imágenes
+        pixels = []
+        for input_path, _ in jobs:
+            try:
+                pixels.append(image_pixels(input_path))
+            except (OSError, ValueError):
+                pass
+        model_name = select_model(
+            statistics.median(pixels) if pixels else 0, args.matting,
+            args.latency_target, args.quality_target
+        )
+        print(f"Modelo elegido: {model_name} ({MODEL_REGISTRY[model_name]['descripcion']})")
+
+    pipeline = BatchPipeline(
+        model_name=model_name,
+        io_workers=args.io_workers,
+        infer_workers=args.infer_workers,
+        matte_workers=args.matte_workers,
+        intra_op_threads=args.intra_op_threads,
+        processes=args.processes or (os.cpu_count() if args.shared_weights else 0),
+        shared_weights=args.shared_weights,
+        batch_size=args.batch_size,
+        max_latency=args.max_latency_ms / 1000,
+        options=matting_options(args.matting),
+        cache=None if args.no_cache else RESULTS,
+        large_pixels=int(args.large_image_mp * 1e6),
+        memory_budget_mb=args.memory_budget_mb,
+        compress_level=args.compress_level,
+        quality=args.quality,
+    )
+    print(f"Procesando {len(jobs)} imágenes...")
+    stats = pipeline.run(jobs, overwrite=args.overwrite)
+    print(format_batch_summary(stats))
+    return 1 if stats["errores"] else 0
+
+def run_gui():
+    # Arrastrar y soltar archivos necesita tkinterdnd2 (opcional)
+    root = TkinterDnD.Tk() if TkinterDnD is not None else tk.Tk()
     app = BackgroundRemoverApp(root)
     root.mainloop()
     print("EFI App iniciada")
-    print("Todos los derechos reservados - 2025")
\ No newline at end of file
+    print("Todos los derechos reservados - 2025")
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "batch":
+        return run_batch(args)
+    if args.command == "video":
+        return run_video(args)
+    if args.command == "bench":
+        return run_bench(args)
+    if args.command == "bench-matting":
+        return run_bench_matting(args)
+    if args.command == "bench-workers":
+        return run_bench_workers(args)
+    if args.command == "calibrate":
+        return run_calibrate(args)
+    if args.command == "model-digests":
+        return run_model_digests(args)
+    if args.command == "quantize":
+        return run_quantize(args)
+    if args.command == "serve":
+        return run_serve(args)
+    if args.command == "loadtest":
+        return run_loadtest(args)
+    if args.command == "watch":
+        return run_watch(args)
+    if args.command == "evaluate":
+        return run_evaluate(args)
+    run_gui()
+    return 0
+
+mark_startup("módulo cargado")
+
+if __name__ == "__main__":
+    sys.exit(main())
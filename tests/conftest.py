@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# La caché de EFI se fija al importar el módulo: las pruebas usan una propia
+os.environ["XDG_CACHE_HOME"] = tempfile.mkdtemp(prefix="efi-pruebas-")
+os.environ.pop("U2NET_HOME", None)
+os.environ.setdefault("EFI_PERF_LOG", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import efi  # noqa: E402
+from PIL import Image  # noqa: E402
+
+
+@pytest.fixture
+def photo():
+    """Imagen RGB con contenido distinto en cada fila y columna."""
+    return efi.synthetic_sample(96, 64)[0]
+
+
+@pytest.fixture
+def jpeg_bytes(photo):
+    def encode(img=None, **kwargs):
+        from io import BytesIO
+
+        buffer = BytesIO()
+        (img or photo).save(buffer, format="JPEG", quality=95, **kwargs)
+        return buffer.getvalue()
+
+    return encode
+
+
+def full_mask(img):
+    return Image.new("L", img.size, 255)
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import efi
+from conftest import full_mask
+
+
+@pytest.fixture
+def area(photo):
+    calls = []
+
+    def predict(crop):
+        calls.append(crop.size)
+        # La primera zona tarda más que las siguientes
+        time.sleep(0.3 if len(calls) == 1 else 0)
+        return full_mask(crop)
+
+    area = efi.AreaCutout(photo, options=efi.matting_options("mask"), predict=predict, tile=16)
+    area.calls = calls
+    yield area
+    area.close()
+
+
+def wait(area, edits):
+    """Encola las ediciones y devuelve sus resultados en el orden en que terminan."""
+    results, done = [], threading.Event()
+
+    def record(changed):
+        results.append(changed)
+        if len(results) == len(edits):
+            done.set()
+
+    for edit in edits:
+        area.submit(edit, record)
+    assert done.wait(10)
+    return results
+
+
+def test_edits_apply_in_request_order(area):
+    first, second = (0, 0, 40, 30), (50, 30, 90, 60)
+    wait(area, [lambda: area.add(first), lambda: area.add(second), area.undo])
+    assert area.regions == [(first, False)]
+    assert area.alpha[:30, :40].min() == 255
+    assert area.alpha[30:60, 50:90].max() == 0
+
+
+def test_region_alpha_is_reused(area):
+    box = (10, 10, 50, 40)
+    wait(area, [lambda: area.add(box), area.undo, lambda: area.add(box)])
+    assert len(area.calls) == 1
+    assert area.alpha[10:40, 10:50].min() == 255
+
+
+def test_erase_and_clear(area):
+    wait(area, [lambda: area.add((0, 0, 96, 64)), lambda: area.add((0, 0, 48, 64), erase=True)])
+    assert area.alpha[:, :48].max() == 0 and area.alpha[:, 48:].min() == 255
+    result = area.result()
+    assert result.mode == "RGBA" and np.array_equal(np.asarray(result.getchannel("A")), area.alpha)
+    assert wait(area, [area.clear]) == [(0, 0, 96, 64)]
+    assert area.alpha.max() == 0
+
+
+def test_failed_edit_is_reported(area):
+    def broken():
+        raise RuntimeError("sin modelo")
+
+    results = wait(area, [broken, lambda: area.add((0, 0, 10, 10))])
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] is not None
@@ -0,0 +1,32 @@
+import pytest
+
+import efi
+from conftest import full_mask
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    monkeypatch.setattr(efi, "create_session", lambda model_name, config=None: None)
+    monkeypatch.setattr(efi, "predict_mask", lambda session, img: full_mask(img))
+
+
+def test_full_decode_is_its_own_stage(jpeg_bytes):
+    big = efi.synthetic_sample(1000, 800)[0]
+    stages = []
+    efi.remove_background(
+        jpeg_bytes(big), options=efi.matting_options("mask"), cache=None, predict=full_mask,
+        progress=lambda stage, fraction=1.0: stages.append((stage, fraction)),
+    )
+    assert [stage for stage, fraction in stages if fraction == 0.0] == [
+        "decodificar", "inferencia", "decodificar_completa", "recorte",
+    ]
+
+
+@pytest.mark.parametrize("size, full_decode", [((1000, 800), True), ((96, 64), False)])
+def test_bench_case_reports_every_stage(fake_model, tmp_path, size, full_decode):
+    path = tmp_path / "foto.jpg"
+    efi.synthetic_sample(*size)[0].save(path, quality=90)
+    stages, result_size, _ = efi._bench_pipeline_case(str(path), "u2netp", efi.matting_options("mask"), 1, 1)
+    assert set(stages) == set(efi.BENCH_STAGES)
+    assert result_size == size
+    assert (stages["decodificar_completa"] > 0) == full_decode
@@ -0,0 +1,46 @@
+import numpy as np
+from PIL import Image
+
+import efi
+
+
+def test_round_trip_and_key(tmp_path):
+    cache = efi.ResultCache(str(tmp_path))
+    alpha = Image.fromarray(np.arange(64 * 48, dtype=np.uint8).reshape(48, 64) % 251)
+    key = cache.key(b"datos", "u2net", efi.matting_options("fast"))
+    assert cache.get(key) is None
+
+    cache.put(key, alpha)
+    assert np.array_equal(np.asarray(cache.get(key)), np.asarray(alpha))
+    # El modelo y las opciones forman parte de la clave
+    assert key != cache.key(b"datos", "u2netp", efi.matting_options("fast"))
+    assert key != cache.key(b"datos", "u2net", efi.matting_options("mask"))
+
+
+def test_evicts_least_recently_used(tmp_path):
+    noise = np.random.default_rng(0).integers(0, 256, (64, 64), dtype=np.uint8)
+    cache = efi.ResultCache(str(tmp_path))
+    cache.put("a" * 64, Image.fromarray(noise))
+    size = cache._scan_size()
+    # Caben dos entradas; la tercera obliga a borrar la usada hace más tiempo
+    cache.max_bytes = 2 * size + size // 2
+
+    cache.put("b" * 64, Image.fromarray(noise))
+    cache.get("a" * 64)  # "a" pasa a ser la más reciente
+    cache.put("c" * 64, Image.fromarray(noise))
+    assert cache.get("b" * 64) is None
+    assert cache.get("a" * 64) is not None
+    assert cache.get("c" * 64) is not None
+
+
+def test_rebuild_from_cache(tmp_path, jpeg_bytes):
+    cache = efi.ResultCache(str(tmp_path))
+    data = jpeg_bytes()
+    options = efi.matting_options("mask")
+    key, result = efi.cutout_from_cache(cache, data, "u2net", options)
+    assert result is None
+
+    cache.put(key, Image.new("L", (96, 64), 128))
+    _, result = efi.cutout_from_cache(cache, data, "u2net", options)
+    assert result.mode == "RGBA" and result.size == (96, 64)
+    assert result.getchannel("A").getextrema() == (128, 128)
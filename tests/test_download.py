@@ -0,0 +1,115 @@
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import efi
+
+PAYLOAD = os.urandom(efi.MIN_SEGMENT_SIZE + 123_457)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    ranges = True
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        if self.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        start, end = 0, len(PAYLOAD) - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", "")) if self.ranges else None
+        self.requests.append(self.headers.get("Range"))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(PAYLOAD[start:end + 1])
+
+
+@pytest.fixture
+def server():
+    def start(ranges=True):
+        handler = type("Handler", (RangeHandler,), {"ranges": ranges, "requests": []})
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return f"http://127.0.0.1:{httpd.server_port}/modelo.onnx", handler
+
+    servers = []
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_segmented_download_with_sha256(tmp_path, server):
+    url, handler = server()
+    dest = tmp_path / "modelo.onnx"
+    seen = []
+    checksum = f"sha256:{hashlib.sha256(PAYLOAD).hexdigest()}"
+
+    efi.download_file(url, str(dest), checksum, segments=4, progress=lambda done, total: seen.append(done))
+    assert dest.read_bytes() == PAYLOAD
+    assert len([r for r in handler.requests if r]) == 4
+    assert seen[-1] == len(PAYLOAD)
+    assert not os.path.exists(f"{dest}.part") and not os.path.exists(f"{dest}.part.json")
+
+
+def test_resumes_partial_segments(tmp_path, server):
+    url, handler = server()
+    dest = tmp_path / "modelo.onnx"
+    part = f"{dest}.part"
+    step = -(-len(PAYLOAD) // 2)
+    # Primer tramo completo y la mitad del segundo, como tras un corte
+    with open(part, "wb") as f:
+        f.write(PAYLOAD[:step + 1000])
+        f.truncate(len(PAYLOAD))
+    efi.json.dump(
+        {"url": url, "size": len(PAYLOAD), "segments": [[0, step, step], [step, len(PAYLOAD), 1000]]},
+        open(f"{part}.json", "w"),
+    )
+
+    efi.download_file(url, str(dest), f"md5:{hashlib.md5(PAYLOAD).hexdigest()}", segments=2)
+    assert dest.read_bytes() == PAYLOAD
+    assert handler.requests == [f"bytes={step + 1000}-{len(PAYLOAD) - 1}"]
+
+
+def test_checksum_mismatch_keeps_no_file(tmp_path, server):
+    url, _ = server(ranges=False)
+    dest = tmp_path / "modelo.onnx"
+    with pytest.raises(ValueError):
+        efi.download_file(url, str(dest), "sha256:" + "0" * 64)
+    assert not dest.exists() and not os.path.exists(f"{dest}.part")
+
+
+def test_model_checksum_prefers_sha256(monkeypatch):
+    entry = dict(efi.MODEL_REGISTRY["u2netp"], sha256=None)
+    monkeypatch.setitem(efi.MODEL_REGISTRY, "u2netp", entry)
+    assert efi.model_checksum("u2netp") == f"md5:{entry['md5']}"
+    entry["sha256"] = "ab" * 32
+    assert efi.model_checksum("u2netp") == "sha256:" + "ab" * 32
+
+
+def test_md5_fallback_is_logged(monkeypatch, caplog):
+    entry = dict(efi.MODEL_REGISTRY["u2netp"], sha256=None)
+    monkeypatch.setitem(efi.MODEL_REGISTRY, "u2netp", entry)
+    with caplog.at_level("WARNING", logger="efi.modelos"):
+        efi.model_checksum("u2netp")
+        efi.model_checksum("u2net")
+    assert [record.getMessage().split()[0] for record in caplog.records] == ["u2netp", "u2net"]
+    assert efi.model_checksum("u2net") is None
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+import efi
+
+
+class FakeInner:
+    """Sesión de onnxruntime falsa: la máscara es la mitad derecha de la imagen."""
+
+    def __init__(self, batch_dim=None):
+        self.batch_dim = batch_dim
+        self.calls = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="entrada", shape=[self.batch_dim, 3, 320, 320])]
+
+    def run(self, outputs, feed):
+        batch = feed["entrada"]
+        self.calls.append(batch.shape)
+        preds = np.zeros((len(batch), 1, 320, 320), dtype=np.float32)
+        preds[:, 0, :, 160:] = 1.0
+        return [preds]
+
+
+def fake_session(model_name="u2net", batch_dim=None):
+    return SimpleNamespace(model_name=model_name, inner_session=FakeInner(batch_dim))
+
+
+def test_images_share_one_run(photo):
+    session = fake_session()
+    other = photo.resize((40, 30))
+    masks = efi.predict_masks(session, [photo, other, photo])
+    assert session.inner_session.calls == [(3, 3, 320, 320)]
+    assert [mask.size for mask in masks] == [photo.size, other.size, photo.size]
+    left, right = np.asarray(masks[0])[:, :10], np.asarray(masks[0])[:, -10:]
+    assert left.max() == 0 and right.min() == 255
+
+
+def test_fixed_batch_model_runs_one_image_at_a_time(photo):
+    session = fake_session(batch_dim=1)
+    masks = efi.predict_masks(session, [photo, photo])
+    assert session.inner_session.calls == [(1, 3, 320, 320), (1, 3, 320, 320)]
+    assert len(masks) == 2
+
+
+def test_other_models_use_rembg_predict(photo):
+    session = SimpleNamespace(model_name="isnet-general-use", predict=lambda img: [Image.new("L", img.size, 7)])
+    masks = efi.predict_masks(session, [photo])
+    assert masks[0].getpixel((0, 0)) == 7
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import efi
+
+
+def test_png_stream_writer_round_trip(tmp_path):
+    rgba = np.random.default_rng(1).integers(0, 256, (37, 29, 4), dtype=np.uint8)
+    path = tmp_path / "salida.png"
+    writer = efi.PngStreamWriter(str(path), 29, 37, compress_level=1)
+    for y0 in range(0, 37, 10):
+        writer.write_rows(rgba[y0:y0 + 10])
+    writer.close()
+
+    with Image.open(path) as img:
+        assert img.mode == "RGBA"
+        assert np.array_equal(np.asarray(img), rgba)
+
+
+def test_png_stream_writer_rejects_incomplete_image(tmp_path):
+    path = tmp_path / "salida.png"
+    writer = efi.PngStreamWriter(str(path), 8, 8)
+    writer.write_rows(np.zeros((4, 8, 4), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+    assert not path.exists() and not (tmp_path / "salida.png.tmp").exists()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P"])
+@pytest.mark.parametrize("orientation", range(1, 9))
+def test_mapped_image_matches_decode_image(tmp_path, photo, mode, orientation):
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    path = tmp_path / "foto.png"
+    photo.convert(mode).save(path, exif=exif)
+
+    mapped = efi.MappedImage(str(path))
+    try:
+        expected = np.asarray(efi.decode_image(str(path)).convert("RGB"))
+        assert (mapped.width, mapped.height) == (expected.shape[1], expected.shape[0])
+        assert np.array_equal(np.vstack([mapped.rows(y, min(y + 7, mapped.height))
+                                         for y in range(0, mapped.height, 7)]), expected)
+    finally:
+        mapped.close()
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import efi
+
+THRESHOLDS = (240, 10, 10)
+
+
+def disc_mask(size):
+    """Máscara con un disco opaco en el centro y borde suave."""
+    width, height = size
+    y, x = np.ogrid[:height, :width]
+    distance = np.hypot(x - width / 2, y - height / 2) - min(size) / 4
+    return Image.fromarray((np.clip(0.5 - distance / 4, 0, 1) * 255).astype(np.uint8), mode="L")
+
+
+@pytest.mark.parametrize("size, max_side", [((96, 64), 1024), ((300, 200), 100)])
+def test_fast_matting_keeps_size_and_safe_zones(size, max_side):
+    img = efi.synthetic_sample(*size)[0]
+    mask = disc_mask(size)
+    result = efi.fast_alpha_matting(img, mask, *THRESHOLDS, max_side=max_side)
+    assert result.mode == "RGBA" and result.size == size
+    alpha = np.asarray(result.getchannel("A"))
+    assert alpha[size[1] // 2, size[0] // 2] == 255
+    assert alpha[0, 0] == 0
+    assert np.array_equal(np.asarray(result.convert("RGB")), np.asarray(img.convert("RGB")))
+
+
+def test_mask_backend_uses_the_mask_as_alpha(photo):
+    mask = disc_mask(photo.size)
+    result = efi.apply_mask(photo, mask, efi.matting_options("mask"))
+    assert np.array_equal(np.asarray(result.getchannel("A")), np.asarray(mask))
+
+
+def test_compose_cutout_matches_a_single_paste(photo):
+    mask = disc_mask(photo.size)
+    expected = Image.new("RGBA", photo.size, 0)
+    expected.paste(photo, (0, 0), mask)
+    assert np.array_equal(np.asarray(efi.compose_cutout(photo, mask, rows=7)), np.asarray(expected))
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        efi.matting_options("magia")
@@ -0,0 +1,35 @@
+from io import BytesIO
+
+from PIL import Image
+
+import efi
+from conftest import full_mask
+
+
+def test_proxy_cutout_accepts_bytes_file_and_path(tmp_path, jpeg_bytes):
+    data = jpeg_bytes(efi.synthetic_sample(1600, 1200)[0])
+    path = tmp_path / "foto.jpg"
+    path.write_bytes(data)
+
+    for source in (data, BytesIO(data), str(path)):
+        proxy, mask = efi.proxy_cutout(source, predict=full_mask, max_side=640)
+        assert proxy.mode == "RGBA"
+        assert proxy.size == mask.size == (640, 480)
+
+
+def test_decode_reduced_applies_exif_orientation(jpeg_bytes):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    data = jpeg_bytes(efi.synthetic_sample(1600, 1200)[0], exif=exif)
+
+    img, full_size = efi.decode_reduced(data, 640)
+    assert full_size == (1200, 1600)
+    assert img.size == (480, 640)
+    assert efi.decode_image(BytesIO(data)).size == full_size
+
+
+def test_remove_background_matches_full_size(jpeg_bytes):
+    data = jpeg_bytes(efi.synthetic_sample(1600, 1200)[0])
+    result = efi.remove_background(data, options=efi.matting_options("mask"), cache=None, predict=full_mask)
+    assert result.size == (1600, 1200)
+    assert result.getchannel("A").getextrema() == (255, 255)
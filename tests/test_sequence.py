@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+import pytest
+
+import efi
+from conftest import full_mask
+
+
+@pytest.fixture(autouse=True)
+def fake_model(monkeypatch):
+    monkeypatch.setattr(efi.SESSIONS, "get", lambda *args, **kwargs: None)
+    monkeypatch.setattr(efi, "predict_mask", lambda session, img: full_mask(img))
+
+
+def frames(tmp_path, sizes):
+    paths = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"entrada_{i:03d}.png"
+        efi.synthetic_sample(*size, seed=i)[0].save(path)
+        paths.append(str(path))
+    return paths
+
+
+def run(pipeline, source, output):
+    """Ejecuta la secuencia con tiempo límite: un bloqueo hace fallar la prueba."""
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(pipeline.run(source, output)), daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive(), "la secuencia se ha bloqueado"
+    return result
+
+
+def pipeline(**kwargs):
+    return efi.SequencePipeline(max_frames=4, matte_workers=2, options=efi.matting_options("mask"), **kwargs)
+
+
+def test_image_sequence(tmp_path):
+    output = tmp_path / "salida"
+    stats = run(pipeline(), frames(tmp_path, [(64, 48)] * 6), str(output))
+    assert stats["errores"] == []
+    assert stats["fotogramas"] == 6
+    assert stats["inferidas"] + stats["reutilizadas"] == 6
+    assert sorted(os.listdir(output)) == [f"{i:06d}.png" for i in range(6)]
+
+
+def test_mixed_frame_sizes_are_reported(tmp_path):
+    stats = run(pipeline(), frames(tmp_path, [(64, 48), (64, 48), (48, 64)]), str(tmp_path / "salida"))
+    assert len(stats["errores"]) == 1
+    assert "64x48" in stats["errores"][0]
+
+
+def test_writer_failure_does_not_block(tmp_path, monkeypatch):
+    # El primer fotograma tarda: los siguientes esperan en el escritor cuando falla
+    matte = efi.SequencePipeline._matte
+    first = threading.Event()
+
+    def slow(self, rgb, mask):
+        if not first.is_set():
+            first.set()
+            time.sleep(0.5)
+        return matte(self, rgb, mask)
+
+    def failing(self, rgba):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(efi.SequencePipeline, "_matte", slow)
+    monkeypatch.setattr(efi.VideoOutput, "write", failing)
+    stats = run(pipeline(background=(255, 255, 255)), frames(tmp_path, [(64, 48)] * 20), str(tmp_path / "salida.avi"))
+    assert stats["errores"] == ["disco lleno"]
@@ -0,0 +1,88 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import efi
+from conftest import full_mask
+
+
+@pytest.fixture
+def batches(monkeypatch):
+    """Sustituye el modelo por uno falso que anota el tamaño de cada lote."""
+    sizes = []
+
+    def predict_masks(session, imgs):
+        sizes.append(len(imgs))
+        return [full_mask(img) for img in imgs]
+
+    monkeypatch.setattr(efi.SESSIONS, "get", lambda *args, **kwargs: None)
+    monkeypatch.setattr(efi, "predict_masks", predict_masks)
+    return sizes
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**kwargs):
+        server = efi.InferenceServer(port=0, options=efi.matting_options("mask"), cache=None, **kwargs)
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), server._handler())
+        httpd.daemon_threads = True
+        server.start_workers()
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        servers.append(httpd)
+        return server, http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+
+    yield start
+    for httpd in servers:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_simultaneous_requests_fill_a_batch(batches, serve, jpeg_bytes):
+    server, _ = serve(workers=1, batch_size=4, max_latency=1.0)
+    assert server.workers == 4
+    futures = [server.submit(jpeg_bytes()) for _ in range(4)]
+    for future in futures:
+        data, content_type = future.result(timeout=10)
+        assert content_type == "image/png"
+    assert batches == [4]
+
+
+def test_rejected_upload_closes_the_connection(batches, serve, monkeypatch):
+    monkeypatch.setattr(efi, "MAX_UPLOAD_BYTES", 10)
+    _, conn = serve()
+    conn.request("POST", "/remove", body=b"x" * 20)
+    response = conn.getresponse()
+    response.read()
+    assert response.status == 413
+    assert response.getheader("Connection") == "close"
+
+
+def test_remove_keeps_the_connection_alive(batches, serve, jpeg_bytes):
+    _, conn = serve()
+    for _ in range(2):
+        conn.request("POST", "/remove", body=jpeg_bytes())
+        response = conn.getresponse()
+        assert response.status == 200
+        assert response.read().startswith(b"\x89PNG")
+
+
+def test_unreadable_image_is_422_and_server_failure_is_500(batches, serve, monkeypatch, jpeg_bytes):
+    _, conn = serve()
+    conn.request("POST", "/remove", body=b"no es una imagen")
+    response = conn.getresponse()
+    assert response.status == 422
+    response.read()
+
+    def broken(session, imgs):
+        raise RuntimeError("modelo caído")
+
+    monkeypatch.setattr(efi, "predict_masks", broken)
+    conn.request("POST", "/remove", body=jpeg_bytes())
+    response = conn.getresponse()
+    assert response.status == 500
+    assert json.loads(response.read())["error"] == "modelo caído"
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+import efi
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Sustituye la carga del modelo y anota cada sesión creada."""
+    created = []
+
+    def create_session(model_name, config=None):
+        time.sleep(0.05)
+        created.append(model_name)
+        return object()
+
+    monkeypatch.setattr(efi, "create_session", create_session)
+    return created
+
+
+def test_session_is_reused(loads):
+    pool = efi.SessionPool()
+    assert pool.get("u2netp") is pool.get("u2netp")
+    assert loads == ["u2netp"]
+
+
+def test_options_are_part_of_the_key(loads):
+    pool = efi.SessionPool()
+    assert pool.get("u2netp", intra_op_num_threads=1) is not pool.get("u2netp", intra_op_num_threads=2)
+    assert loads == ["u2netp", "u2netp"]
+
+
+def test_simultaneous_requests_load_once(loads):
+    pool = efi.SessionPool()
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(pool.get("u2net"))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert loads == ["u2net"]
+    assert len({id(session) for session in sessions}) == 1
+
+
+def test_least_recently_used_is_evicted(loads):
+    # u2net y u2net_human_seg se estiman en 350 MB, u2netp en 25 MB
+    pool = efi.SessionPool(memory_budget_mb=400)
+    first = pool.get("u2netp")
+    pool.get("u2net")
+    assert pool.get("u2netp") is first
+    pool.get("u2net_human_seg")
+    assert pool.get("u2netp") is first
+    pool.get("u2net")
+    assert loads == ["u2netp", "u2net", "u2net_human_seg", "u2net"]
+
+
+def test_last_session_is_kept_over_budget(loads):
+    pool = efi.SessionPool(memory_budget_mb=1)
+    session = pool.get("u2net")
+    assert pool.get("u2net") is session
+    assert loads == ["u2net"]
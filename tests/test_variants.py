@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+import efi
+
+
+def test_variants_need_the_fp32_baseline(tmp_path, photo):
+    path = tmp_path / "foto.png"
+    photo.save(path)
+    with pytest.raises(RuntimeError, match="FP32"):
+        efi.evaluate_variants("modelo_inexistente", [str(path)], runs=1)
+
+
+def test_mask_iou():
+    a = np.zeros((4, 4), dtype=np.uint8)
+    b = a.copy()
+    assert efi.mask_iou(a, b) == 1.0
+    a[:, :2] = 255
+    b[:, 1:3] = 255
+    assert efi.mask_iou(a, b) == pytest.approx(1 / 3)
@@ -0,0 +1,141 @@
+import os
+
+import efi
+
+
+def touch(path, data=b"foto", mtime=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+    return str(path)
+
+
+def make_watcher(root, journal, **kwargs):
+    return efi.FolderWatcher(str(root), journal_path=str(journal), settle=0, **kwargs)
+
+
+def queued(watcher):
+    watcher._settle()
+    jobs = []
+    while not watcher.pending.empty():
+        jobs.append(watcher.pending.get_nowait())
+    return sorted(os.path.relpath(path, watcher.root) for path, _ in jobs)
+
+
+def finish(watcher):
+    for path, (stat, _) in list(watcher._inflight.items()):
+        watcher._done((path, watcher.output_path(path)), 1, None)
+
+
+def test_journal_survives_truncated_line_and_compacts(tmp_path):
+    path = tmp_path / "diario.jsonl"
+    journal = efi.WatchJournal(str(path))
+    for size in range(5):
+        journal.mark("/fotos/a.jpg", "pendiente", (size, 1))
+    journal.mark("/fotos/a.jpg", "hecho", (5, 1))
+    journal.mark_dir("/fotos", 7)
+    journal.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"ruta": "/fotos/b.j')
+
+    journal = efi.WatchJournal(str(path))
+    assert journal.state("/fotos/a.jpg", (5, 1)) == "hecho"
+    assert journal.state("/fotos/a.jpg", (6, 1)) is None
+    assert journal.dirs == {"/fotos": 7}
+    assert journal.unfinished() == []
+    journal.close()
+    # Compacto: una línea por imagen y carpeta
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+
+
+def test_first_scan_skips_existing_outputs(tmp_path):
+    root = tmp_path / "fotos"
+    touch(root / "a.jpg", mtime=1_000_000_000)
+    touch(root / "a_sin_fondo.png", mtime=2_000_000_000)
+    touch(root / "sub" / "b.png")
+    touch(root / "notas.txt")
+
+    watcher = make_watcher(root, tmp_path / "diario.jsonl")
+    watcher.scan()
+    assert queued(watcher) == [os.path.join("sub", "b.png")]
+    assert watcher.journal.state(str(root / "a.jpg"), watcher._stat(str(root / "a.jpg"))) == "hecho"
+    watcher.journal.close()
+
+
+def test_overwrite_reprocesses_existing_outputs(tmp_path):
+    root = tmp_path / "fotos"
+    touch(root / "a.jpg", mtime=1_000_000_000)
+    touch(root / "a_sin_fondo.png", mtime=2_000_000_000)
+
+    watcher = make_watcher(root, tmp_path / "diario.jsonl", overwrite=True)
+    watcher.scan()
+    assert queued(watcher) == ["a.jpg"]
+    watcher.journal.close()
+
+
+def test_restart_resumes_only_unfinished_work(tmp_path):
+    root = tmp_path / "fotos"
+    journal = tmp_path / "diario.jsonl"
+    for name in ("a.jpg", "b.jpg", "sub/c.jpg"):
+        touch(root / name)
+
+    watcher = make_watcher(root, journal)
+    watcher.scan()
+    assert queued(watcher) == ["a.jpg", "b.jpg", os.path.join("sub", "c.jpg")]
+    # Solo "a" termina antes del corte
+    watcher._done((str(root / "a.jpg"), watcher.output_path(str(root / "a.jpg"))), 1, None)
+    watcher.journal.close()
+
+    watcher = make_watcher(root, journal)
+    assert sorted(os.path.relpath(p, watcher.root) for p in watcher.journal.unfinished()) == [
+        "b.jpg", os.path.join("sub", "c.jpg")
+    ]
+    for path in watcher.journal.unfinished():
+        watcher.notice(path)
+    watcher.scan()
+    assert queued(watcher) == ["b.jpg", os.path.join("sub", "c.jpg")]
+    finish(watcher)
+    watcher.journal.close()
+
+    # Nada cambió: la revisión salta las carpetas y no hay trabajo
+    watcher = make_watcher(root, journal)
+    watcher.scan()
+    assert queued(watcher) == [] and watcher.journal.unfinished() == []
+    # Una imagen modificada vuelve a procesarse
+    touch(root / "b.jpg", b"otra foto")
+    watcher.scan(full=True)
+    assert queued(watcher) == ["b.jpg"]
+    watcher.journal.close()
+
+
+def test_waits_until_file_stops_changing(tmp_path):
+    root = tmp_path / "fotos"
+    watcher = make_watcher(root, tmp_path / "diario.jsonl")
+    watcher.settle = 60
+    path = touch(root / "a.jpg", b"a medias")
+    watcher.notice(path)
+    assert queued(watcher) == []
+
+    watcher.settle = 0
+    touch(root / "a.jpg", b"a medias y completa")
+    # El cambio reinicia la espera; en la siguiente vuelta ya no ha cambiado
+    assert queued(watcher) == []
+    assert queued(watcher) == ["a.jpg"]
+    watcher.journal.close()
+
+
+def test_errors_wait_for_a_change(tmp_path):
+    root = tmp_path / "fotos"
+    path = touch(root / "rota.jpg")
+    watcher = make_watcher(root, tmp_path / "diario.jsonl")
+    watcher.scan()
+    assert queued(watcher) == ["rota.jpg"]
+    watcher._done((path, watcher.output_path(path)), 0, ValueError("no es una imagen"))
+
+    watcher.notice(path)
+    assert queued(watcher) == []
+    touch(root / "rota.jpg", b"ahora si")
+    watcher.notice(path)
+    assert queued(watcher) == ["rota.jpg"]
+    watcher.journal.close()